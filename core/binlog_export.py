@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import zlib
+import struct
+from pymysqlreplication.constants.BINLOG import (
+    QUERY_EVENT, STOP_EVENT, ROTATE_EVENT, FORMAT_DESCRIPTION_EVENT, XID_EVENT, TABLE_MAP_EVENT,
+    HEARTBEAT_LOG_EVENT, ROWS_QUERY_LOG_EVENT, GTID_LOG_EVENT, ANONYMOUS_GTID_LOG_EVENT,
+    PREVIOUS_GTIDS_LOG_EVENT, WRITE_ROWS_EVENT_V1, UPDATE_ROWS_EVENT_V1, DELETE_ROWS_EVENT_V1,
+    WRITE_ROWS_EVENT_V2, UPDATE_ROWS_EVENT_V2, DELETE_ROWS_EVENT_V2, MARIADB_ANNOTATE_ROWS_EVENT,
+    MARIADB_BINLOG_CHECKPOINT_EVENT, MARIADB_GTID_EVENT, MARIADB_GTID_GTID_LIST_EVENT,
+)
+from .partial_json import PARTIAL_UPDATE_ROWS_EVENT
+from .transaction_payload import TRANSACTION_PAYLOAD_EVENT, TransactionPayloadEvent
+from .schema_history import ddl_tables
+from .logger import get_logger
+
+# 获取logger实例
+logger = get_logger("BinlogExport")
+
+BINLOG_MAGIC = b'\xfebin'
+EVENT_HEADER = struct.Struct('<IBIIIH')  # 时间戳、类型、server_id、长度、结束位置、标志
+HEADER_SIZE = EVENT_HEADER.size
+CHECKSUM_SIZE = 4
+LOG_EVENT_BINLOG_IN_USE_F = 0x1          # 格式描述事件中表示文件正在写入
+LOG_EVENT_ARTIFICIAL_F = 0x20            # 服务器生成的不在binlog文件中的事件
+STMT_END_F = 0x1                         # 行事件标志：语句的最后一个行事件
+TABLE_ID_SIZE = 6
+
+# 行事件类型 -> SQL类型
+ROWS_EVENT_TYPES = {
+    WRITE_ROWS_EVENT_V1: 'INSERT', WRITE_ROWS_EVENT_V2: 'INSERT',
+    UPDATE_ROWS_EVENT_V1: 'UPDATE', UPDATE_ROWS_EVENT_V2: 'UPDATE', PARTIAL_UPDATE_ROWS_EVENT: 'UPDATE',
+    DELETE_ROWS_EVENT_V1: 'DELETE', DELETE_ROWS_EVENT_V2: 'DELETE',
+}
+GTID_EVENTS = (GTID_LOG_EVENT, ANONYMOUS_GTID_LOG_EVENT, MARIADB_GTID_EVENT)
+# 与导出的事务无关的事件
+SKIPPED_EVENTS = (STOP_EVENT, ROTATE_EVENT, HEARTBEAT_LOG_EVENT, PREVIOUS_GTIDS_LOG_EVENT,
+                  MARIADB_BINLOG_CHECKPOINT_EVENT, MARIADB_GTID_GTID_LIST_EVENT)
+
+
+def parse_header(event):
+    """解析事件头部，返回(时间戳, 类型, server_id, 长度, 结束位置, 标志)"""
+    return EVENT_HEADER.unpack_from(event)
+
+
+def parse_query(body):
+    """从QUERY_EVENT的事件体中读取(默认库, 语句)"""
+    schema_length = body[8]
+    status_length = struct.unpack_from('<H', body, 11)[0]
+    start = 13 + status_length
+    schema = body[start:start + schema_length].decode('utf-8', 'ignore')
+    query = body[start + schema_length + 1:].decode('utf-8', 'ignore')
+    return schema, query
+
+
+def parse_table_map(body):
+    """从TABLE_MAP_EVENT的事件体中读取(table_id, 库名, 表名)"""
+    table_id = int.from_bytes(body[:TABLE_ID_SIZE], 'little')
+    pos = TABLE_ID_SIZE + 2
+    schema_length = body[pos]
+    schema = body[pos + 1:pos + 1 + schema_length].decode('utf-8', 'ignore')
+    pos += schema_length + 2
+    table_length = body[pos]
+    table = body[pos + 1:pos + 1 + table_length].decode('utf-8', 'ignore')
+    return table_id, schema, table
+
+
+def rows_table_id(event):
+    return int.from_bytes(event[HEADER_SIZE:HEADER_SIZE + TABLE_ID_SIZE], 'little')
+
+
+def rows_flags(event):
+    return struct.unpack_from('<H', event, HEADER_SIZE + TABLE_ID_SIZE)[0]
+
+
+def raw_events(read_packet):
+    """
+    从复制连接（或本地binlog缓存）的 _read_packet 读取原始事件，到EOF包结束
+
+    Yields:
+        bytes: 事件（包含头部，有校验和时包含校验和）
+    """
+    while True:
+        packet = read_packet()
+        if packet.is_eof_packet():
+            return
+        if packet.is_ok_packet():
+            yield packet.get_all_data()[1:]
+
+
+class BinlogExporter(object):
+    """
+    将匹配过滤条件的事务按原始字节写入新的binlog文件
+
+    不解码行数据：只解析事件头部、QUERY_EVENT的语句和TABLE_MAP_EVENT的表名。
+    事务中只保留匹配库表和SQL类型的行事件及其表映射事件，语句的最后一个行事件
+    被去掉时给保留的最后一个行事件加上STMT_END_F；没有保留任何行事件的事务整体跳过。
+    DDL在不限制只处理DML时按涉及的表过滤。压缩的事务展开为普通事件。
+    输出文件以源文件的格式描述事件开头，事件位置按新文件重新计算，有校验和时重新计算CRC32，
+    可以直接用 mysqlbinlog 读取。
+    """
+
+    def __init__(self, path, only_schemas=None, only_tables=None, sql_type=None, only_dml=True,
+                 start_time=None, stop_time=None):
+        """
+        Args:
+            path: 输出文件
+            only_schemas, only_tables: 库表过滤，与BinLogStreamReader相同
+            sql_type: 保留的行事件类型 ['INSERT', 'UPDATE', 'DELETE']，None表示全部
+            only_dml: 不导出DDL
+            start_time, stop_time: datetime，只导出开始时间在此范围内的事务
+        """
+        self.path = path
+        self.only_schemas = set(only_schemas) if only_schemas else None
+        self.only_tables = set(only_tables) if only_tables else None
+        self.sql_type = set(sql_type) if sql_type else None
+        self.only_dml = only_dml
+        self.start_ts = int(start_time.timestamp()) if start_time else None
+        self.stop_ts = int(stop_time.timestamp()) if stop_time else None
+        self.checksum = None          # 输出文件是否带校验和，与第一个格式描述事件一致
+        self.position = len(BINLOG_MAGIC)
+        self.transactions = 0         # 导出的事务数
+        self.skipped_transactions = 0  # 跳过的事务数
+        self.events = 0               # 写入的事件数
+        self._txn = None              # 当前事务的事件（不含校验和）
+        self._in_begin = False
+        self._file = open(path, 'wb')
+        self._file.write(BINLOG_MAGIC)
+
+    def feed(self, event, checksum):
+        """
+        处理一个原始事件
+
+        Args:
+            event: 事件字节
+            checksum: 事件是否带校验和
+        """
+        plain = event[:-CHECKSUM_SIZE] if checksum else event
+        event_type = plain[4]
+        if event_type == FORMAT_DESCRIPTION_EVENT:
+            if self.checksum is None:
+                self.checksum = checksum
+                flags = parse_header(plain)[5] & ~LOG_EVENT_BINLOG_IN_USE_F
+                self._write(plain[:17] + struct.pack('<H', flags) + plain[19:])
+            return
+        if event_type in SKIPPED_EVENTS:
+            if event_type in (ROTATE_EVENT, STOP_EVENT) and not parse_header(plain)[5] & LOG_EVENT_ARTIFICIAL_F:
+                # 文件结束，未完成的事务不会继续
+                if self._txn:
+                    logger.warning("binlog文件结束时事务未提交，丢弃该事务")
+                    self.skipped_transactions += 1
+                self._txn, self._in_begin = None, False
+            return
+        if event_type == TRANSACTION_PAYLOAD_EVENT:
+            for embedded in TransactionPayloadEvent.from_body(plain[HEADER_SIZE:]).embedded_events():
+                self._feed_plain(embedded)
+            return
+        self._feed_plain(plain)
+
+    def _feed_plain(self, event):
+        event_type = event[4]
+        if event_type in GTID_EVENTS:
+            self._txn, self._in_begin = [event], False
+            return
+        if self._txn is None:
+            self._txn = []
+        self._txn.append(event)
+        if event_type == QUERY_EVENT:
+            schema, query = parse_query(event[HEADER_SIZE:])
+            statement = query.strip().upper()
+            if statement == 'BEGIN':
+                self._in_begin = True
+            elif statement == 'COMMIT':
+                self._finish()
+            elif not self._in_begin:
+                self._finish_ddl(schema, query)
+        elif event_type == XID_EVENT:
+            self._finish()
+
+    def _in_time_range(self, events):
+        timestamp = parse_header(events[0])[0]
+        if self.start_ts is not None and timestamp < self.start_ts:
+            return False
+        return self.stop_ts is None or timestamp < self.stop_ts
+
+    def _table_matches(self, schema, table):
+        return (self.only_schemas is None or schema in self.only_schemas) and \
+            (self.only_tables is None or table in self.only_tables)
+
+    def _finish_ddl(self, schema, query):
+        events, self._txn, self._in_begin = self._txn, None, False
+        tables = ddl_tables(query, schema)
+        if tables:
+            matched = any(self._table_matches(s, t) for s, t in tables)
+        else:
+            matched = self.only_tables is None and (self.only_schemas is None or schema in self.only_schemas)
+        if self.only_dml or not matched or not self._in_time_range(events):
+            self.skipped_transactions += 1
+            return
+        self._write_transaction(events)
+
+    def _finish(self):
+        events, self._txn, self._in_begin = self._txn, None, False
+        if not self._in_time_range(events):
+            self.skipped_transactions += 1
+            return
+        kept, statement, table_maps = [], [], {}
+        for event in events:
+            event_type = event[4]
+            if event_type == TABLE_MAP_EVENT:
+                table_id, schema, table = parse_table_map(event[HEADER_SIZE:])
+                table_maps[table_id] = (schema, table)
+                statement.append(event)
+            elif event_type in (ROWS_QUERY_LOG_EVENT, MARIADB_ANNOTATE_ROWS_EVENT):
+                statement.append(event)
+            elif event_type in ROWS_EVENT_TYPES:
+                statement.append(event)
+                if rows_flags(event) & STMT_END_F:
+                    kept.extend(self._filter_statement(statement, table_maps))
+                    statement = []
+            elif event_type in GTID_EVENTS or event_type == XID_EVENT or \
+                    (event_type == QUERY_EVENT and parse_query(event[HEADER_SIZE:])[1].strip().upper() in
+                     ('BEGIN', 'COMMIT')):
+                kept.append(event)
+            # 其他事件（语句格式的DML及其上下文事件）不导出
+        if statement:
+            kept.extend(self._filter_statement(statement, table_maps))
+        if not any(event[4] in ROWS_EVENT_TYPES for event in kept):
+            self.skipped_transactions += 1
+            return
+        self._write_transaction(kept)
+
+    def _filter_statement(self, statement, table_maps):
+        """保留一条语句中匹配的行事件及其表映射事件"""
+        rows = [event for event in statement if event[4] in ROWS_EVENT_TYPES and
+                self._table_matches(*table_maps.get(rows_table_id(event), (None, None))) and
+                (self.sql_type is None or ROWS_EVENT_TYPES[event[4]] in self.sql_type)]
+        if not rows:
+            return []
+        table_ids = set(rows_table_id(event) for event in rows)
+        kept = []
+        for event in statement:
+            if event[4] == TABLE_MAP_EVENT:
+                if parse_table_map(event[HEADER_SIZE:])[0] in table_ids:
+                    kept.append(event)
+            elif event[4] in ROWS_EVENT_TYPES:
+                if event in rows:
+                    kept.append(event)
+            else:
+                kept.append(event)
+        last = kept[-1]
+        flags = rows_flags(last)
+        if not flags & STMT_END_F:
+            offset = HEADER_SIZE + TABLE_ID_SIZE
+            kept[-1] = last[:offset] + struct.pack('<H', flags | STMT_END_F) + last[offset + 2:]
+        return kept
+
+    def _write_transaction(self, events):
+        for event in events:
+            self._write(event)
+        self.transactions += 1
+
+    def _write(self, event):
+        """按新文件中的位置重写事件头部并写入"""
+        size = len(event) + (CHECKSUM_SIZE if self.checksum else 0)
+        timestamp, event_type, server_id, _, _, flags = parse_header(event)
+        data = EVENT_HEADER.pack(timestamp, event_type, server_id, size, self.position + size, flags) + \
+            event[HEADER_SIZE:]
+        if self.checksum:
+            data += struct.pack('<I', zlib.crc32(data) & 0xffffffff)
+        self._file.write(data)
+        self.position += size
+        self.events += 1
+
+    def close(self):
+        """结束导出，丢弃未完成的事务"""
+        self._txn = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
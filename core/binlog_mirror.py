@@ -0,0 +1,513 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import struct
+import threading
+from pymysql.protocol import MysqlPacket
+from pymysqlreplication.constants.BINLOG import (
+    STOP_EVENT, ROTATE_EVENT, FORMAT_DESCRIPTION_EVENT, HEARTBEAT_LOG_EVENT,
+)
+from .binlog_stream import ExtendedBinLogStreamReader, open_dump_connection
+from .logger import get_logger
+
+# 获取logger实例
+logger = get_logger("BinlogMirror")
+
+BINLOG_MAGIC = b'\xfebin'
+EVENT_HEADER = struct.Struct('<IBIIIH')  # 时间戳、类型、server_id、长度、结束位置、标志
+LOG_EVENT_ARTIFICIAL_F = 0x20            # 服务器生成的不在binlog文件中的事件
+EOF_PACKET = b'\xfe\x00\x00\x02\x00'
+INDEX_FILE = 'index.json'
+
+
+class BinlogMirrorError(Exception):
+    """本地binlog缓存与服务器不一致或无法读取"""
+
+
+class BinlogMirror(object):
+    """
+    本地binlog缓存
+
+    通过复制连接下载的原始事件按服务器上的文件分别保存，格式与binlog文件相同
+    （文件头加事件），文件内偏移与服务器位置一致。每个文件记录已下载到的位置和
+    是否完整，正在写入的文件之后只下载追加的部分。超出磁盘预算时按最近使用时间
+    删除文件。索引中记录服务器的server_uuid，服务器变化时清空缓存。
+    预取线程和解析线程共用同一个缓存，对索引的读写都在_lock中进行。
+    """
+
+    def __init__(self, directory, server_key, budget_mb=0):
+        """
+        Args:
+            directory: 缓存根目录
+            server_key: 服务器标识（如 host_port），每个服务器一个子目录
+            budget_mb: 缓存的磁盘占用上限（MB），0表示不限制
+        """
+        self.directory = os.path.join(directory, server_key)
+        os.makedirs(self.directory, exist_ok=True)
+        self.budget = (budget_mb or 0) * 1024 * 1024
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()  # 同一缓存同时只有一个下载
+        self._writing = None  # 正在下载的文件，不会被删除
+        self._server_uuid, self._index = self._load_index()
+        self.downloaded = 0  # 本次下载的字节数
+
+    def _load_index(self):
+        """
+        Returns:
+            tuple: (server_uuid, {文件名: 记录})
+        """
+        path = os.path.join(self.directory, INDEX_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None, {}
+        if 'files' not in index:
+            # 旧格式的索引只有文件记录
+            index = {'server_uuid': None, 'files': index}
+        # 丢弃文件已不存在或长度不符的记录
+        files = dict((name, entry) for name, entry in index['files'].items()
+                     if os.path.exists(self.path(name)) and os.path.getsize(self.path(name)) == entry.get('end'))
+        return index.get('server_uuid'), files
+
+    def _save_index(self):
+        """保存索引，调用方需持有_lock"""
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'server_uuid': self._server_uuid, 'files': self._index}, f)
+        os.replace(path + '.tmp', path)
+
+    def _remove(self, name):
+        """删除文件及其记录，调用方需持有_lock"""
+        del self._index[name]
+        try:
+            os.remove(self.path(name))
+        except OSError:
+            pass
+
+    def validate(self, server_uuid, binlogs=None):
+        """
+        检查缓存是否仍对应服务器上的binlog，删除不一致的部分
+
+        server_uuid变化（故障切换或重建实例）时删除全部文件；服务器上已写完的文件
+        （不是最后一个）比缓存短或长度不同（RESET MASTER后重新生成的同名文件）时删除该文件。
+
+        Args:
+            server_uuid: 服务器的server_uuid，无法获取（如MariaDB）时为None，不比较
+            binlogs: SHOW MASTER LOGS的结果 [(文件名, 文件大小)]
+        """
+        sizes = dict((name, size) for name, size in (binlogs or [])[:-1] if size is not None)
+        with self._lock:
+            if server_uuid is not None and self._server_uuid not in (None, server_uuid):
+                logger.warning(f"服务器的server_uuid从 {self._server_uuid} 变为 {server_uuid}，清空本地binlog缓存")
+                stale = list(self._index)
+            else:
+                stale = [name for name, entry in self._index.items() if name in sizes and (
+                    entry['end'] > int(sizes[name]) or (entry.get('complete') and entry['end'] != int(sizes[name])))]
+                if stale:
+                    logger.warning(f"本地binlog缓存与服务器上的文件不一致，删除 {stale}")
+            for name in stale:
+                if name != self._writing:
+                    self._remove(name)
+            if server_uuid is not None:
+                self._server_uuid = server_uuid
+            self._save_index()
+
+    def path(self, log_file):
+        return os.path.join(self.directory, os.path.basename(log_file))
+
+    def end(self, log_file):
+        """已缓存到的位置，没有缓存时为None"""
+        with self._lock:
+            entry = self._index.get(log_file)
+            return entry['end'] if entry else None
+
+    def checksum(self, log_file):
+        with self._lock:
+            entry = self._index.get(log_file)
+            return bool(entry and entry.get('checksum'))
+
+    def covers(self, log_file, log_pos=None):
+        """缓存是否包含到指定位置，log_pos为None时要求文件完整"""
+        with self._lock:
+            entry = self._index.get(log_file)
+            entry = dict(entry) if entry else None
+        if not entry:
+            return False
+        if entry.get('complete'):
+            return True
+        return log_pos is not None and entry['end'] >= log_pos
+
+    def sync(self, connection_settings, server_id, files, target_file, target_pos=None, keep=None,
+             bandwidth=0, cancel=None):
+        """
+        从服务器下载缺少的部分
+
+        Args:
+            files: 需要的binlog文件，按顺序
+            target_file, target_pos: 下载到的位置，target_pos为None时下载到target_file结束
+            keep: 超出磁盘预算时不删除的文件，默认为files
+            bandwidth: 下载限速（字节/秒），0表示不限速
+            cancel: threading.Event，设置后停止下载
+        """
+        with self._sync_lock:
+            self._sync(connection_settings, server_id, files, target_file, target_pos, bandwidth, cancel)
+        self.touch(files)
+        self.evict(keep=files if keep is None else keep)
+
+    def _sync(self, connection_settings, server_id, files, target_file, target_pos, bandwidth, cancel):
+        start_file = None
+        for log_file in files:
+            if not self.covers(log_file, target_pos if log_file == target_file else None):
+                start_file = log_file
+                break
+            if log_file == target_file:
+                break
+        if start_file is None:
+            return
+
+        start_pos = self.end(start_file) or 4
+        logger.info(f"下载binlog到本地缓存: 从 {start_file}:{start_pos} 到 {target_file}:{target_pos or '文件结束'}")
+        connection, checksum, close = open_dump_connection(connection_settings, server_id, start_file, start_pos)
+        writer = None
+        try:
+            current = start_file
+            writer = self._open_writer(current, checksum)
+            started, received = time.time(), 0
+            while cancel is None or not cancel.is_set():
+                packet = connection._read_packet()
+                if packet.is_eof_packet():
+                    break
+                if not packet.is_ok_packet():
+                    continue
+                event = packet.get_all_data()[1:]
+                timestamp, event_type, _, size, log_pos, flags = EVENT_HEADER.unpack_from(event)
+
+                if event_type == ROTATE_EVENT and (flags & LOG_EVENT_ARTIFICIAL_F or log_pos == 0):
+                    # 服务器开始发送某个文件时的虚拟轮换事件
+                    name = self._rotate_target(event, size, checksum)
+                    if name != current:
+                        writer = self._switch_writer(writer, name, checksum)
+                        current = name
+                    continue
+                if event_type == HEARTBEAT_LOG_EVENT or flags & LOG_EVENT_ARTIFICIAL_F or log_pos == 0:
+                    continue
+
+                end = self.end(current)
+                start = log_pos - size
+                if start < end:
+                    continue
+                if start > end:
+                    raise BinlogMirrorError('%s 的事件不连续: 缓存到 %d，收到的事件从 %d 开始' % (current, end, start))
+                writer.write(event[:size])
+                with self._lock:
+                    self._index[current]['end'] = log_pos
+                self.downloaded += size
+                received += size
+                if bandwidth:
+                    delay = received / float(bandwidth) - (time.time() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+                if event_type in (ROTATE_EVENT, STOP_EVENT):
+                    with self._lock:
+                        self._index[current]['complete'] = True
+                    if current == target_file or current not in files:
+                        break
+                    if event_type == ROTATE_EVENT:
+                        name = self._rotate_target(event, size, checksum)
+                        writer = self._switch_writer(writer, name, checksum)
+                        current = name
+                    continue
+                if current == target_file and target_pos is not None and log_pos >= target_pos:
+                    break
+        finally:
+            if writer is not None:
+                writer.close()
+            close()
+            with self._lock:
+                self._writing = None
+                self._save_index()
+
+    @staticmethod
+    def _rotate_target(event, size, checksum):
+        """从轮换事件中读取下一个文件名"""
+        end = size - 4 if checksum else size
+        return event[EVENT_HEADER.size + 8:end].decode('utf-8', 'ignore')
+
+    def _open_writer(self, log_file, checksum):
+        with self._lock:
+            self._writing = log_file
+            entry = self._index.get(log_file)
+            if entry is None or not os.path.exists(self.path(log_file)):
+                with open(self.path(log_file), 'wb') as f:
+                    f.write(BINLOG_MAGIC)
+                entry = self._index[log_file] = {'end': len(BINLOG_MAGIC), 'complete': False}
+            entry['checksum'] = checksum
+            entry['accessed'] = time.time()
+        return open(self.path(log_file), 'ab')
+
+    def _switch_writer(self, writer, log_file, checksum):
+        writer.close()
+        with self._lock:
+            self._save_index()
+        return self._open_writer(log_file, checksum)
+
+    def touch(self, files):
+        """记录文件的使用时间"""
+        now = time.time()
+        with self._lock:
+            for log_file in files:
+                if log_file in self._index:
+                    self._index[log_file]['accessed'] = now
+            self._save_index()
+
+    @property
+    def size(self):
+        with self._lock:
+            return sum(entry['end'] for entry in self._index.values())
+
+    def evict(self, keep=()):
+        """超出磁盘预算时删除最久未使用的文件，keep中的文件和正在下载的文件不删除"""
+        if not self.budget:
+            return
+        with self._lock:
+            candidates = sorted((entry.get('accessed', 0), name) for name, entry in self._index.items()
+                                if name not in keep and name != self._writing)
+            total = sum(entry['end'] for entry in self._index.values())
+            for _, name in candidates:
+                if total <= self.budget:
+                    break
+                total -= self._index[name]['end']
+                self._remove(name)
+                logger.info(f"本地binlog缓存超出上限，删除 {name}")
+            self._save_index()
+
+    def open_source(self, log_file, log_pos, encoding, wait=None):
+        """
+        打开从缓存读取事件的数据源
+
+        Args:
+            wait: 读到轮换事件、打开下一个文件前调用的函数，参数为文件名（用于等待预取完成）
+        """
+        return MirrorPacketSource(self, log_file, log_pos, encoding, wait)
+
+
+class MirrorPacketSource(object):
+    """
+    从本地缓存读取事件，接口与复制连接的 _read_packet 相同
+
+    与服务器一样先返回虚拟的轮换事件，起始位置不在文件开头时再返回格式描述事件，
+    文件中的轮换事件之后继续读取下一个已缓存的文件，缓存结束时返回EOF包。
+    """
+
+    def __init__(self, mirror, log_file, log_pos, encoding, wait=None):
+        self.mirror = mirror
+        self.encoding = encoding
+        self._wait = wait
+        self._file = None
+        self._checksum = False
+        self._pending = []
+        self._open(log_file, log_pos or 4, artificial=True)
+
+    def _open(self, log_file, log_pos, artificial=False):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        end = self.mirror.end(log_file)
+        if end is None:
+            return
+        self._checksum = self.mirror.checksum(log_file)
+        self._file = open(self.mirror.path(log_file), 'rb')
+        self._end = end
+        if artificial:
+            self._pending.append(self._artificial_rotate(log_file, log_pos, self._checksum))
+        if log_pos > len(BINLOG_MAGIC):
+            self._file.seek(len(BINLOG_MAGIC))
+            description = self._read_event()
+            if description is not None and description[4] == FORMAT_DESCRIPTION_EVENT:
+                # 与服务器相同，不在文件开头时发送的格式描述事件位置为0
+                description = description[:13] + struct.pack('<I', 0) + description[17:]
+                self._pending.append(description)
+            self._seek(log_pos)
+        else:
+            self._file.seek(len(BINLOG_MAGIC))
+
+    @staticmethod
+    def _artificial_rotate(log_file, log_pos, checksum):
+        body = struct.pack('<Q', log_pos) + log_file.encode()
+        size = EVENT_HEADER.size + len(body) + (4 if checksum else 0)
+        event = EVENT_HEADER.pack(0, ROTATE_EVENT, 0, size, 0, LOG_EVENT_ARTIFICIAL_F) + body
+        return event + (b'\x00' * 4 if checksum else b'')
+
+    def _seek(self, log_pos):
+        """按事件长度定位到log_pos，位置不在事件边界时报错"""
+        pos = len(BINLOG_MAGIC)
+        while pos < log_pos:
+            self._file.seek(pos)
+            header = self._file.read(EVENT_HEADER.size)
+            if len(header) < EVENT_HEADER.size:
+                break
+            pos += EVENT_HEADER.unpack(header)[3]
+        if pos != log_pos:
+            raise BinlogMirrorError('起始位置 %d 不在事件边界上' % log_pos)
+        self._file.seek(pos)
+
+    def _read_event(self):
+        if self._file.tell() + EVENT_HEADER.size > self._end:
+            return None
+        header = self._file.read(EVENT_HEADER.size)
+        if len(header) < EVENT_HEADER.size:
+            return None
+        size = EVENT_HEADER.unpack(header)[3]
+        return header + self._file.read(size - EVENT_HEADER.size)
+
+    def _read_packet(self):
+        if self._pending:
+            return MysqlPacket(b'\x00' + self._pending.pop(0), self.encoding)
+        if self._file is None:
+            return MysqlPacket(EOF_PACKET, self.encoding)
+        event = self._read_event()
+        if event is None:
+            return MysqlPacket(EOF_PACKET, self.encoding)
+        if event[4] == ROTATE_EVENT:
+            # 文件结束，继续读取下一个已缓存的文件
+            name = BinlogMirror._rotate_target(event, len(event), self._checksum)
+            if self._wait is not None:
+                self._wait(name)
+            self._open(name, len(BINLOG_MAGIC))
+        return MysqlPacket(b'\x00' + event, self.encoding)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class MirrorBinLogStreamReader(ExtendedBinLogStreamReader):
+    """从本地binlog缓存读取事件的BinLogStreamReader，表结构等仍通过控制连接获取"""
+
+    def __init__(self, *args, **kwargs):
+        self.mirror = kwargs.pop('mirror')
+        self.prefetcher = kwargs.pop('prefetcher', None)
+        super(MirrorBinLogStreamReader, self).__init__(*args, **kwargs)
+
+    def _BinLogStreamReader__connect_to_stream(self):
+        wait = self.prefetcher.ensure if self.prefetcher is not None else None
+        self._stream_connection = self.mirror.open_source(self.log_file, self.log_pos, 'utf8', wait)
+        self._BinLogStreamReader__use_checksum = self.mirror.checksum(self.log_file)
+        self._BinLogStreamReader__connected_stream = True
+
+
+class BinlogPrefetcher(object):
+    """
+    后台预取binlog文件到本地缓存
+
+    按处理顺序逐个下载文件，最多领先正在解析的文件depth个，使用单独的复制连接，
+    解析当前文件的同时下载后面的文件。解析到某个文件时调用ensure()等待其下载完成，
+    预取失败时在当前线程重新下载。统计下载耗时和解析等待下载的时间，
+    两者之差即下载与解析重叠的时间。
+    """
+
+    def __init__(self, mirror, connection_settings, server_id, files, targets=None, depth=2, bandwidth=0):
+        """
+        Args:
+            files: 按处理顺序排列的binlog文件
+            targets: {文件名: 下载到的位置}，不在其中的文件下载到文件结束
+            depth: 最多领先正在解析的文件数
+            bandwidth: 下载限速（字节/秒），0表示不限速
+        """
+        self.mirror = mirror
+        self.connection_settings = connection_settings
+        self.server_id = server_id
+        self.files = list(files)
+        self.targets = targets or {}
+        self.depth = max(depth, 1)
+        self.bandwidth = bandwidth or 0
+        self.download_seconds = 0.0  # 后台下载耗时
+        self.wait_seconds = 0.0      # 解析等待下载的时间
+        self._current = 0
+        self._done = set()
+        self._errors = {}
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='binlog-prefetch', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _sync(self, log_file, cancel=None):
+        self.mirror.sync(self.connection_settings, self.server_id, [log_file], log_file,
+                         self.targets.get(log_file), keep=self.files, bandwidth=self.bandwidth, cancel=cancel)
+
+    def _run(self):
+        for index, log_file in enumerate(self.files):
+            with self._cond:
+                while index > self._current + self.depth and not self._cancel.is_set():
+                    self._cond.wait()
+            if self._cancel.is_set():
+                break
+            started = time.time()
+            try:
+                self._sync(log_file, self._cancel)
+            except Exception as e:
+                logger.warning(f"预取 {log_file} 失败: {str(e)}")
+                self._errors[log_file] = e
+            self.download_seconds += time.time() - started
+            with self._cond:
+                self._done.add(log_file)
+                self._cond.notify_all()
+
+    def ensure(self, log_file):
+        """等待文件下载完成，不在预取列表中的文件直接返回"""
+        if log_file not in self.files:
+            return
+        started = time.time()
+        with self._cond:
+            self._current = max(self._current, self.files.index(log_file))
+            self._cond.notify_all()
+            while log_file not in self._done and self._thread.is_alive():
+                self._cond.wait(0.5)
+        self.wait_seconds += time.time() - started
+        if log_file in self._errors or log_file not in self._done:
+            self._errors.pop(log_file, None)
+            self._sync(log_file)
+
+    def stop(self):
+        """停止预取"""
+        self._cancel.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(5)
+
+    def stats(self):
+        """下载耗时、等待时间和重叠比例"""
+        overlap = max(self.download_seconds - self.wait_seconds, 0.0)
+        return {
+            'download_seconds': self.download_seconds,
+            'wait_seconds': self.wait_seconds,
+            'overlap_seconds': overlap,
+            'overlap_ratio': overlap / self.download_seconds if self.download_seconds else 0.0,
+        }
+
+
+_mirrors = {}
+_mirrors_lock = threading.Lock()
+
+
+def get_binlog_mirror(host, port, directory=None, budget_mb=0):
+    """获取连接对应的本地binlog缓存，同一进程内共享"""
+    directory = os.path.abspath(directory or 'binlog_mirror')
+    server_key = '%s_%s' % (str(host).replace('.', '_').replace(':', '_'), port)
+    key = (directory, server_key)
+    with _mirrors_lock:
+        mirror = _mirrors.get(key)
+        if mirror is None:
+            mirror = _mirrors[key] = BinlogMirror(directory, server_key, budget_mb)
+        mirror.budget = (budget_mb or 0) * 1024 * 1024
+        return mirror
@@ -4,28 +4,67 @@
 import sys
 import os
 import datetime
-import pymysql
-from pymysqlreplication import BinLogStreamReader
-from pymysqlreplication.event import QueryEvent, RotateEvent, FormatDescriptionEvent
+from pymysqlreplication.constants.BINLOG import ROTATE_EVENT
+from pymysqlreplication.event import (
+    QueryEvent, RotateEvent, FormatDescriptionEvent, XidEvent, RowsQueryLogEvent, GtidEvent, MariadbGtidEvent,
+)
+from pymysqlreplication.row_event import WriteRowsEvent, DeleteRowsEvent
 from .binlog_util import (
     concat_sql_from_binlog_event,
     create_unique_file,
-    reversed_lines,
     is_dml_event,
-    event_type
+    event_type,
+    generate_net_sql_pattern,
+    render_sql,
+    position_comment,
+    row_image_absent_columns,
+    prune_row_image,
+    row_image_gap,
+    unknown_columns,
+    rows_query_text,
+    is_expression,
+    rows_query_comment,
+    row_change_args,
+    net_change_args,
+    compose_batch_parts
+)
+from .rollback_spool import RollbackSpool, RECORD_TXN_END, RECORD_PARTS, RECORD_COMMENT, SpoolBudgetExceededError
+from .sql_coalescer import SqlCoalescer, MAX_BATCH_BYTES, pack_parts, unpack_parts, parts_to_sql
+from .change_compactor import ChangeCompactor, primary_key_columns
+from .table_keys import TableKeyCache, is_schema_change
+from .binlog_stream import ExtendedBinLogStreamReader, open_dump_connection
+from .schema_history import SchemaHistory, get_schema_history, ddl_tables
+from .table_metadata import TableColumnCache
+from .partial_json import PartialUpdateRowsEvent
+from .transaction_payload import PayloadDecompressionError, zstd_available
+from .server_probe import get_server_capabilities
+from .server_metadata import server_metadata_cache, query_master_status, query_server_uuid
+from .connection_pool import get_pool
+from .binlog_mirror import get_binlog_mirror, MirrorBinLogStreamReader, BinlogPrefetcher
+from .change_json import JsonChangeWriter, column_names
+from .binlog_export import BinlogExporter, raw_events, parse_header, HEADER_SIZE, CHECKSUM_SIZE, LOG_EVENT_ARTIFICIAL_F
+from .parse_options import OutputLimits, RollbackOptions, SqlOptions, MetadataOptions, CacheOptions, OutputOptions
+from .decoded_cache import (
+    get_decoded_cache, schema_fingerprint, RecordingStream, ReplayStream,
+    SCHEMA_BINLOG, SCHEMA_HISTORY, SCHEMA_SERVER,
 )
 from .logger import get_logger
 
 # 获取logger实例
 logger = get_logger("BinlogParser")
 
+# 原始语句（Rows_query事件）输出模式
+ROWS_QUERY_ONLY = 'only'          # 只输出原始语句，不解码行数据
+ROWS_QUERY_ANNOTATE = 'annotate'  # 在每条语句生成的行SQL上方注释原始语句
+
 
 class BinlogParser(object):
     """Binlog解析器类"""
 
     def __init__(self, connection_settings, start_file=None, start_pos=None, end_file=None, end_pos=None,
                  start_time=None, stop_time=None, only_schemas=None, only_tables=None, no_pk=False,
-                 flashback=False, stop_never=False, back_interval=1.0, only_dml=True, sql_type=None):
+                 flashback=False, stop_never=False, back_interval=1.0, only_dml=True, sql_type=None,
+                 limits=None, rollback=None, sql=None, metadata=None, cache=None, output=None):
         """
         初始化Binlog解析器
 
@@ -42,10 +81,22 @@ class BinlogParser(object):
             no_pk: 生成不包含主键的insert语句
             flashback: 生成回滚SQL
             stop_never: 持续解析
-            back_interval: 回滚SQL间隔时间
+            back_interval: 回滚SQL间隔时间（仅在不分组时使用，每1000条插入一次SELECT SLEEP）
             only_dml: 只处理DML语句
             sql_type: SQL类型过滤
+            limits: OutputLimits，关键字过滤和输出限制，未指定时使用默认值
+            rollback: RollbackOptions，回滚SQL的暂存、分组和限速，未指定时使用默认值
+            sql: SqlOptions，生成SQL的方式，未指定时使用默认值
+            metadata: MetadataOptions，表结构的来源，未指定时使用默认值
+            cache: CacheOptions，本地binlog缓存、预取和解码缓存，未指定时使用默认值
+            output: OutputOptions，SQL以外的输出方式，未指定时使用默认值
         """
+        limits = limits or OutputLimits()
+        rollback = rollback or RollbackOptions()
+        sql = sql or SqlOptions()
+        metadata = metadata or MetadataOptions()
+        cache = cache or CacheOptions()
+        output = output or OutputOptions()
         if not start_file:
             logger.error("缺少参数: start_file")
             raise ValueError('缺少参数: start_file')
@@ -72,11 +123,183 @@ class BinlogParser(object):
         self.no_pk, self.flashback, self.stop_never, self.back_interval = (no_pk, flashback, stop_never, back_interval)
         self.only_dml = only_dml
         self.sql_type = [t.upper() for t in sql_type] if sql_type else []
+        self.keywords = limits.keywords
+        self.max_statements = limits.max_statements
+        self.max_transactions = limits.max_transactions
+        self.max_rows = limits.max_rows
+        self.skip_statements = limits.skip_statements
+        self.spool_dir = rollback.spool_dir
+        self.spool_budget_mb = rollback.spool_budget_mb
+        self.spool_compress = rollback.spool_compress
+        self.group_rollback = rollback.group_rollback
+        self.rollback_group_size = rollback.rollback_group_size
+        self.throttle_rows = rollback.throttle_rows
+        self.throttle_txns = rollback.throttle_txns
+        self.compact = sql.compact
+        self.compact_max_keys = sql.compact_max_keys
+        self._compactor = None
+        self.coalesce = sql.coalesce
+        self.coalesce_max_bytes = sql.coalesce_max_bytes
+        self._coalescer = None
+        self.key_where = sql.key_where
+        self.changed_only = sql.changed_only
+        self.rows_query = sql.rows_query
+        self.rows_query_counts = sql.rows_query_counts
+        if self.rows_query == ROWS_QUERY_ONLY and (flashback or self.compact or self.coalesce):
+            logger.warning("只输出原始语句时不支持回滚、合并净变化和合并多行语句，已忽略这些选项")
+            self.flashback = self.compact = self.coalesce = False
+        self.json_lines = output.json_lines
+        if self.json_lines and (flashback or self.compact or self.coalesce or self.rows_query):
+            logger.warning("JSON Lines输出不支持回滚、合并净变化、合并多行语句和原始语句，已忽略这些选项")
+            self.flashback = self.compact = self.coalesce = False
+            self.rows_query = None
+        self.change_store = change_store = output.change_store
+        if change_store is not None and (self.flashback or self.compact or self.coalesce or self.rows_query or
+                                         self.json_lines):
+            logger.warning("保存到列式存储时不支持回滚、合并净变化、合并多行语句、原始语句和JSON Lines输出，已忽略这些选项")
+            self.flashback = self.compact = self.coalesce = self.json_lines = False
+            self.rows_query = None
+        self._json = None
+        self.schema_history_dir = metadata.schema_history_dir
+        self._table_columns = None  # 表的列定义来源（SchemaHistory或TableColumnCache）
+        self._mirror = None
+        self._server_binlogs = None  # SHOW MASTER LOGS的结果，用于检查本地binlog缓存
+        self.prefetch_files = cache.prefetch_files
+        self.prefetch_bandwidth_mb = cache.prefetch_bandwidth_mb
+        self._prefetcher = None
+        self.prefetch_stats = None  # 最近一次预取的下载与解析重叠统计
+        self.export_binlog = output.export_binlog
+        if self.export_binlog and stop_never:
+            logger.warning("持续解析时不支持导出原始binlog，已忽略")
+            self.export_binlog = None
+        self._decoded_cache = None
+        self._schema_versions = {}  # 解码缓存中表集合对应的当前表结构版本
+        if cache.decoded_cache and (stop_never or self.rows_query == ROWS_QUERY_ONLY):
+            logger.warning("持续解析或只输出原始语句时不使用解码缓存")
+        elif cache.decoded_cache:
+            self._decoded_cache = get_decoded_cache(connection_settings.get('host'), connection_settings.get('port'),
+                                                    cache.decoded_cache_dir)
+        if cache.mirror and stop_never:
+            logger.warning("持续解析时不使用本地binlog缓存")
+        elif cache.mirror:
+            self._mirror = get_binlog_mirror(connection_settings.get('host'), connection_settings.get('port'),
+                                             cache.mirror_dir, cache.mirror_budget_mb)
+        self._rows_query = None  # 当前Rows_query事件的状态
+        self._rows_query_seen = 0
         self.binlogList = []
         self.progress_callback = None  # 进度回调函数
 
+        # 过滤和限制统计
+        self.matched_sql_count = 0  # 匹配关键字的SQL计数
+        self.filtered_sql_count = 0  # 被关键字过滤的SQL计数
+        self.emitted_statements = 0  # 已输出的SQL语句数
+        self.emitted_rows = 0  # 已输出的行变更数
+        self.emitted_transactions = 0  # 已输出的事务数
+        self.limit_reached = False  # 是否因达到限制而提前结束
+        self.next_position = None  # 下一页的续读位置 {'log_file', 'log_pos', 'skip_statements'}
+
         # 初始化数据库连接并获取binlog信息
         self._init_connection()
+        self._key_cache = TableKeyCache(self.connection)
+        # 服务器探测和表结构准备可能较慢，在prepare()中进行
+        self._metadata_options = metadata
+        self._prepared = False
+
+    def prepare(self):
+        """
+        探测服务器、选择解析策略并准备表结构，只执行一次
+
+        process_binlog() 开始时会自动调用；界面应在解析线程中调用，避免阻塞界面。
+        """
+        if self._prepared:
+            return
+        metadata = self._metadata_options
+        self._plan_strategy(metadata.schema_history, metadata.prewarm_metadata)
+        self._init_table_metadata(metadata.schema_history, metadata.prewarm_metadata)
+        if self._mirror is not None:
+            self._validate_mirror()
+        self._prepared = True
+
+    def _validate_mirror(self):
+        """删除本地binlog缓存中与服务器不一致的部分（故障切换、RESET MASTER）"""
+        try:
+            self._mirror.validate(query_server_uuid(self.connection), self._server_binlogs)
+        except Exception as e:
+            logger.warning(f"检查本地binlog缓存失败，不使用本地缓存: {str(e)}")
+            self._mirror = None
+
+    def _plan_strategy(self, schema_history, prewarm):
+        """根据服务器能力选择表结构来源、事件过滤和行定位方式，并记录选择的方案"""
+        try:
+            self.capabilities = get_server_capabilities(self.connection, self.conn_setting)
+        except Exception as e:
+            logger.warning(f"服务器探测失败，使用默认解析策略: {str(e)}")
+            self.capabilities = None
+        caps = self.capabilities
+        self.row_metadata_full = bool(caps and caps.row_metadata_full)
+
+        if caps is not None:
+            if not caps.binlog_enabled:
+                logger.warning("服务器未开启binlog（log_bin=OFF）")
+            if not caps.row_format:
+                logger.warning(f"binlog_format={caps.variables.get('binlog_format')}，只有ROW格式的事件能生成行SQL")
+            if caps.can_replicate is False:
+                logger.warning("当前用户缺少REPLICATION SLAVE/REPLICATION CLIENT权限，可能无法读取binlog")
+            if caps.transaction_compression and not zstd_available():
+                logger.warning("服务器开启了binlog_transaction_compression，需要安装zstandard才能解析压缩的事务")
+            if self.rows_query and not caps.rows_query_events:
+                logger.warning("服务器未开启binlog_rows_query_log_events，只有开启期间写入的事件包含原始语句")
+            if not caps.full_row_image and not self.key_where:
+                # 非完整镜像的前镜像只有主键等列，无法按整行匹配
+                logger.warning(f"binlog_row_image={caps.variables.get('binlog_row_image')}，自动开启按主键定位行")
+                self.key_where = True
+
+        # 不使用原始语句时不解析Rows_query事件
+        self._ignored_events = None if self.rows_query else [RowsQueryLogEvent]
+
+        if self.row_metadata_full:
+            metadata_source = "表映射事件（binlog_row_metadata=FULL）"
+        elif schema_history:
+            metadata_source = "本地表结构历史"
+        elif prewarm:
+            metadata_source = "批量预加载"
+        else:
+            metadata_source = "逐表查询"
+        logger.info(f"解析方案: 表结构来源={metadata_source}, "
+                    f"行定位={'主键或唯一索引' if self.key_where else '整行匹配'}, "
+                    f"跳过事件={[e.__name__ for e in self._ignored_events or []]}")
+
+    def _init_table_metadata(self, schema_history, prewarm):
+        """
+        准备表的列定义和键定义
+
+        使用表结构历史时，同一连接首次使用时批量记录当前的表结构；
+        否则按过滤条件批量预加载，binlog流中出现新的table_id时不再逐表查询。
+        binlog_row_metadata=FULL时表映射事件自带列定义和主键，不需要预加载。
+        """
+        known_tables = None
+        if prewarm and self.row_metadata_full:
+            logger.info("binlog_row_metadata=FULL，列定义和主键取自表映射事件，不预加载表结构")
+            prewarm = False
+        if schema_history:
+            try:
+                history = get_schema_history(self.conn_setting['host'], self.conn_setting['port'],
+                                             self.schema_history_dir)
+                if not history.seeded:
+                    known_tables = history.seed(self.connection, self.eof_file, self.eof_pos,
+                                                self.only_schemas, self.only_tables)
+                self._table_columns = history
+            except Exception as e:
+                logger.warning(f"表结构历史不可用，按需查询表结构: {str(e)}")
+        if self._table_columns is None and prewarm:
+            cache = TableColumnCache()
+            try:
+                known_tables = cache.prewarm(self.connection, self.only_schemas, self.only_tables)
+                self._table_columns = cache
+            except Exception as e:
+                logger.warning(f"预加载表结构失败，按需查询表结构: {str(e)}")
+        if prewarm and self.key_where:
+            self._key_cache.prewarm(self.only_schemas, self.only_tables, known_tables)
 
     def _init_connection(self):
         """初始化数据库连接并获取binlog信息"""
@@ -86,42 +309,38 @@ class BinlogParser(object):
             conn_settings = self.conn_setting.copy()
             if 'charset' not in conn_settings:
                 conn_settings['charset'] = 'utf8mb4'
-            self.connection = pymysql.connect(**conn_settings)
-            with self.connection.cursor() as cursor:
-                cursor.execute("SHOW MASTER STATUS")
-                result = cursor.fetchone()
-                if result:
-                    self.eof_file, self.eof_pos = result[:2]
-                else:
-                    raise ValueError('无法获取MASTER STATUS')
-
-                cursor.execute("SHOW MASTER LOGS")
-                bin_index = [row[0] for row in cursor.fetchall()]
-
-                if self.start_file not in bin_index:
-                    logger.error(f"参数错误: start_file {self.start_file} 不在mysql服务器中")
-                    raise ValueError('参数错误: start_file %s 不在mysql服务器中' % self.start_file)
-
-                logger.info(f"找到binlog文件列表: {bin_index}")
-                binlog2i = lambda x: x.split('.')[1]
-                for binary in bin_index:
-                    if binlog2i(self.start_file) <= binlog2i(binary) <= binlog2i(self.end_file):
-                        self.binlogList.append(binary)
-
-                logger.info(f"待解析的binlog文件: {self.binlogList}")
-
-                cursor.execute("SELECT @@server_id")
-                result = cursor.fetchone()
-                if result:
-                    self.server_id = result[0]
-                else:
-                    raise ValueError('缺少server_id在 %s:%s' % (self.conn_setting['host'], self.conn_setting['port']))
-
-                if not self.server_id:
-                    logger.error(f"缺少server_id在 {self.conn_setting['host']}:{self.conn_setting['port']}")
-                    raise ValueError('缺少server_id在 %s:%s' % (self.conn_setting['host'], self.conn_setting['port']))
-
-                logger.info(f"数据库连接成功, server_id: {self.server_id}")
+            self._pool = get_pool(conn_settings)
+            self.connection = self._pool.acquire()
+
+            # 解析的结束位置每次重新读取，缓存的位置可能已落后于最新的事件
+            self.eof_file, self.eof_pos = query_master_status(self.connection)
+
+            # binlog列表和server_id从按连接共享的缓存读取
+            metadata = server_metadata_cache.get(self.conn_setting, self.connection)
+            if self.start_file not in metadata.binlog_files or self.eof_file not in metadata.binlog_files:
+                # 缓存可能早于新文件的创建，重新查询一次
+                metadata = server_metadata_cache.get(self.conn_setting, self.connection, refresh=True)
+            bin_index = metadata.binlog_files
+            self._server_binlogs = metadata.binlogs
+
+            if self.start_file not in bin_index:
+                logger.error(f"参数错误: start_file {self.start_file} 不在mysql服务器中")
+                raise ValueError('参数错误: start_file %s 不在mysql服务器中' % self.start_file)
+
+            logger.info(f"找到binlog文件列表: {bin_index}")
+            binlog2i = lambda x: x.split('.')[1]
+            for binary in bin_index:
+                if binlog2i(self.start_file) <= binlog2i(binary) <= binlog2i(self.end_file):
+                    self.binlogList.append(binary)
+
+            logger.info(f"待解析的binlog文件: {self.binlogList}")
+
+            self.server_id = metadata.server_id
+            if not self.server_id:
+                logger.error(f"缺少server_id在 {self.conn_setting['host']}:{self.conn_setting['port']}")
+                raise ValueError('缺少server_id在 %s:%s' % (self.conn_setting['host'], self.conn_setting['port']))
+
+            logger.info(f"数据库连接成功, server_id: {self.server_id}")
         except Exception as e:
             logger.error(f"数据库连接失败: {str(e)}")
             raise ValueError(f'数据库连接失败: {str(e)}')
@@ -135,6 +354,72 @@ class BinlogParser(object):
         """获取binlog文件列表"""
         return self.binlogList
 
+    @property
+    def has_limits(self):
+        """是否设置了输出数量限制"""
+        return bool(self.max_statements or self.max_transactions or self.max_rows)
+
+    def _match_keywords(self, sql):
+        """关键字过滤，未设置关键字时全部匹配"""
+        if not self.keywords:
+            return True
+        sql_upper = sql.upper()
+        if any(keyword in sql_upper for keyword in self.keywords):
+            self.matched_sql_count += 1
+            return True
+        self.filtered_sql_count += 1
+        return False
+
+    def _accept_sql(self, sql, is_row=False):
+        """
+        判断SQL是否输出，并更新计数
+
+        所有过滤（包括关键字过滤）之后才计入限制；
+        翻页续读时先跳过上一页已输出的语句。
+
+        Returns:
+            bool: 是否输出该SQL
+        """
+        if not sql or not self._match_keywords(sql):
+            return False
+
+        if self.flashback:
+            # 回滚SQL在倒序输出时才计入限制
+            return True
+
+        self._txn_passed += 1
+        if self._skip_remaining > 0:
+            self._skip_remaining -= 1
+            return False
+
+        self.emitted_statements += 1
+        if is_row:
+            self.emitted_rows += 1
+        return True
+
+    def _statement_limit_hit(self):
+        """语句数或行数是否已达到限制"""
+        return bool((self.max_statements and self.emitted_statements >= self.max_statements) or
+                    (self.max_rows and self.emitted_rows >= self.max_rows))
+
+    def _stop_at(self, log_file, log_pos, skip_statements=0, reverse=False):
+        """
+        记录达到限制时的续读位置
+
+        Args:
+            reverse: 回滚模式倒序输出，log_file/log_pos为下一页的结束位置（None表示整个文件），
+                skip_statements为从该位置倒序跳过的回滚语句数
+        """
+        self.limit_reached = True
+        self.next_position = {
+            'log_file': log_file,
+            'log_pos': log_pos,
+            'skip_statements': skip_statements,
+            'reverse': reverse
+        }
+        logger.info(f"达到输出限制: 语句={self.emitted_statements}, 行={self.emitted_rows}, "
+                    f"事务={self.emitted_transactions}, 续读位置={self.next_position}")
+
     def process_binlog(self, callback=None):
         """
         处理binlog
@@ -147,266 +432,947 @@ class BinlogParser(object):
         """
         try:
             logger.info("开始解析binlog")
+            self.prepare()
             logger.info(f"解析参数: start_file={self.start_file}, start_pos={self.start_pos}, "
                        f"end_file={self.end_file}, end_pos={self.end_pos}")
             logger.info(f"时间范围: {self.start_time} - {self.stop_time}")
             logger.info(f"过滤条件: schemas={self.only_schemas}, tables={self.only_tables}")
             logger.info(f"SQL类型: {self.sql_type}, flashback={self.flashback}")
+            if self.keywords or self.has_limits or self.skip_statements:
+                logger.info(f"关键字: {self.keywords}, 限制: statements={self.max_statements}, "
+                            f"transactions={self.max_transactions}, rows={self.max_rows}, "
+                            f"skip={self.skip_statements}")
+
+            # 重置统计和续读状态
+            self.matched_sql_count = self.filtered_sql_count = 0
+            self.emitted_statements = self.emitted_rows = self.emitted_transactions = 0
+            self.limit_reached = False
+            self.next_position = None
+            self._skip_remaining = self.skip_statements
+            self._txn_passed = 0
+            self._partial_image_tables = set()
+            self._unknown_schema_tables = set()
+            self._rows_query = None
+            self._rows_query_seen = 0
+            self._coalescer = None
+            self._json = JsonChangeWriter(lambda line: self._output(line, callback)) if self.json_lines else None
+            if self.export_binlog:
+                self._export_binlog(callback)
+                logger.info("binlog导出完成")
+                return True
+            if self.change_store is not None and (self.keywords or self.has_limits or self.skip_statements):
+                logger.warning("保存到列式存储时不使用关键字过滤和输出限制")
+            if self.coalesce:
+                max_bytes = self._coalesce_max_bytes()
+                logger.info(f"合并多行语句: 单条语句上限 {max_bytes} 字节")
+                self._coalescer = SqlCoalescer(lambda sql: self._output(sql, callback), max_bytes=max_bytes)
+
+            flashback = self.flashback and not self.compact and not self.stop_never
+            self._start_prefetch(list(reversed(self.binlogList)) if flashback else self.binlogList)
+            try:
+                if self.compact and not self.stop_never:
+                    self._process_compacted(callback)
+                elif self.flashback and not self.stop_never:
+                    self._process_flashback(callback)
+                else:
+                    stream = self._open_stream(self.start_file, self.start_pos)
+                    try:
+                        with self.connection.cursor() as cursor:
+                            self._run_stream(stream, cursor, callback)
+                    finally:
+                        stream.close()
+            finally:
+                self._stop_prefetch()
+                if self._json is not None:
+                    # 输出未提交的记录（到达结束位置或输出限制时）
+                    self._json.flush()
+                    logger.info(f"JSON Lines输出: {self._json.rows} 行变更, {self._json.transactions} 个事务")
+                if self._coalescer:
+                    # 输出最后一批合并语句
+                    self._coalescer.flush()
+                    logger.info(f"合并多行语句: {self._coalescer.rows} 行合并为 {self._coalescer.batches} 条语句")
+
+            if self.change_store is not None:
+                self._output_store_summary(callback)
+            if self.rows_query and not self._rows_query_seen:
+                logger.warning("没有找到Rows_query事件，请确认服务器开启了binlog_rows_query_log_events")
+            logger.info("binlog解析完成")
+            return True
 
-            # 确保BinLogStreamReader使用UTF-8字符集，并增加容错处理
-            stream_conn_settings = self.conn_setting.copy()
-            if 'charset' not in stream_conn_settings:
-                stream_conn_settings['charset'] = 'utf8mb4'
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f'处理binlog时发生错误: {error_msg}')
+
+            # 检查是否是编码错误
+            if 'utf-8' in error_msg.lower() or 'decode' in error_msg.lower() or 'unicode' in error_msg.lower():
+                logger.warning("检测到编码错误，但解析器已处理了部分数据。建议检查数据库字符集设置。")
+                # 对于编码错误，我们返回True表示部分成功，而不是抛出异常
+                return True
+            else:
+                # 对于其他类型的错误，仍然抛出异常
+                raise Exception(f'处理binlog时发生错误: {error_msg}')
 
-            # 添加额外的连接参数以提高编码兼容性
-            stream_conn_settings.update({
-                'use_unicode': True,
-                'charset': 'utf8mb4',
-                'sql_mode': 'TRADITIONAL',
-                'init_command': "SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci"
-            })
+    def _open_stream(self, log_file, log_pos):
+        """打开事件流，使用解码缓存时优先从缓存重放"""
+        if self._decoded_cache is not None:
+            return self._open_decoded_stream(log_file, log_pos)
+        return self._open_binlog_stream(log_file, log_pos)
+
+    def _decode_condition(self):
+        """影响解码结果的条件，解码之后的过滤条件不影响缓存"""
+        if self.row_metadata_full:
+            schema_source = SCHEMA_BINLOG
+        elif isinstance(self._table_columns, SchemaHistory):
+            schema_source = SCHEMA_HISTORY
+        else:
+            schema_source = SCHEMA_SERVER
+        return {
+            'schemas': sorted(self.only_schemas) if self.only_schemas else None,
+            'tables': sorted(self.only_tables) if self.only_tables else None,
+            'rows_query': bool(self.rows_query),
+            'schema_source': schema_source,
+        }
+
+    def _schema_version(self, tables):
+        """缓存段中的表当前的表结构版本，行数据不依赖服务器当前表结构时为表结构来源"""
+        schema_source = self._decode_condition()['schema_source']
+        if schema_source != SCHEMA_SERVER:
+            return schema_source
+        key = tuple(sorted(tables))
+        if key not in self._schema_versions:
+            self._schema_versions[key] = schema_fingerprint(self.connection, key)
+        return self._schema_versions[key]
+
+    def _decoded_chain(self, log_file, log_pos, decode):
+        """
+        按顺序查找覆盖解析范围的缓存段
+
+        Returns:
+            tuple: ([(缓存段, 起始位置)], 缓存是否没有覆盖到范围结束)
+        """
+        files = self.binlogList[self.binlogList.index(log_file):] if log_file in self.binlogList else [log_file]
+        chain = []
+        index, pos = 0, log_pos
+        while True:
+            segment = self._decoded_cache.find(files[index], pos, decode, self._schema_version)
+            if segment is None:
+                return chain, True
+            chain.append((segment, pos))
+            end = self._range_end(files[index])
+            if end is not None and segment['end'] >= end:
+                return chain, False
+            if segment['complete']:
+                index, pos = index + 1, 4
+                if index >= len(files):
+                    return chain, False
+            else:
+                pos = segment['end']
+
+    def _open_decoded_stream(self, log_file, log_pos):
+        """从解码缓存重放，缓存没有覆盖的部分从服务器读取并记录"""
+        decode = self._decode_condition()
+
+        def record(record_file, record_pos):
+            return RecordingStream(self._open_binlog_stream(record_file, record_pos), self._decoded_cache,
+                                   decode, self._schema_version, record_file, record_pos)
+
+        try:
+            chain, tail = self._decoded_chain(log_file, log_pos, decode)
+        except Exception as e:
+            logger.warning(f"查找解码缓存失败: {str(e)}")
+            chain, tail = [], True
+        if not chain:
+            return record(log_file, log_pos)
+        segment, _ = chain[-1]
+        logger.info(f"从解码缓存重放: {log_file}:{log_pos} - {segment['file']}:{segment['end']}, "
+                    f"共 {len(chain)} 段{'，之后从服务器读取' if tail else ''}")
+        return ReplayStream(self._decoded_cache, chain, record if tail else None)
+
+    def _open_binlog_stream(self, log_file, log_pos):
+        """创建BinLogStreamReader，失败时使用fallback字符集重试"""
+        stream_conn_settings = self._stream_connection_settings()
+
+        logger.info(f"创建binlog流: {log_file}:{log_pos}, charset={stream_conn_settings.get('charset')}")
+
+        if self._mirror is not None:
+            stream = self._open_mirror_stream(stream_conn_settings, log_file, log_pos)
+            if stream is not None:
+                return stream
+
+        try:
+            return ExtendedBinLogStreamReader(
+                connection_settings=stream_conn_settings,
+                server_id=self.server_id,
+                log_file=log_file,
+                log_pos=log_pos,
+                only_schemas=self.only_schemas,
+                only_tables=self.only_tables,
+                resume_stream=True,
+                blocking=True,
+                # 添加额外的容错参数
+                fail_on_table_metadata_unavailable=False,
+                ignored_events=self._ignored_events,
+                table_columns=self._table_columns
+            )
+        except Exception as stream_error:
+            logger.error(f"创建BinLogStreamReader失败: {str(stream_error)}")
+            # 尝试使用更基本的字符集配置重试
+            fallback_settings = self.conn_setting.copy()
+            fallback_settings['charset'] = 'utf8'
+            logger.info("尝试使用fallback字符集配置重新创建stream...")
+
+            return ExtendedBinLogStreamReader(
+                connection_settings=fallback_settings,
+                server_id=self.server_id,
+                log_file=log_file,
+                log_pos=log_pos,
+                only_schemas=self.only_schemas,
+                only_tables=self.only_tables,
+                resume_stream=True,
+                blocking=True,
+                fail_on_table_metadata_unavailable=False,
+                ignored_events=self._ignored_events,
+                table_columns=self._table_columns
+            )
+
+    def _stream_connection_settings(self):
+        """复制连接的连接配置"""
+        # 确保BinLogStreamReader使用UTF-8字符集，并增加容错处理
+        stream_conn_settings = self.conn_setting.copy()
+
+        # 添加额外的连接参数以提高编码兼容性
+        stream_conn_settings.update({
+            'use_unicode': True,
+            'charset': 'utf8mb4',
+            'sql_mode': 'TRADITIONAL',
+            'init_command': "SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci"
+        })
+        return stream_conn_settings
+
+    def _range_end(self, log_file):
+        """文件中需要读取到的位置，None表示整个文件"""
+        if self.end_pos and log_file == self.end_file:
+            return self.end_pos
+        if log_file == self.eof_file:
+            return self.eof_pos
+        return None
+
+    def _start_prefetch(self, files):
+        """使用本地缓存时，按处理顺序在后台预取binlog文件"""
+        self._prefetcher = None
+        if self._mirror is None or not self.prefetch_files or not files:
+            return
+        targets = dict((log_file, self._range_end(log_file)) for log_file in files)
+        self._prefetcher = BinlogPrefetcher(self._mirror, self._stream_connection_settings(), self.server_id,
+                                            files, targets, depth=self.prefetch_files,
+                                            bandwidth=int(self.prefetch_bandwidth_mb * 1024 * 1024)).start()
+        logger.info(f"后台预取binlog: 最多领先 {self.prefetch_files} 个文件, "
+                    f"限速 {self.prefetch_bandwidth_mb or '不限制'} MB/秒")
+
+    def _stop_prefetch(self):
+        """停止预取并记录下载与解析的重叠时间"""
+        prefetcher, self._prefetcher = self._prefetcher, None
+        if prefetcher is None:
+            return
+        prefetcher.stop()
+        self.prefetch_stats = prefetcher.stats()
+        logger.info(f"预取统计: 下载 {self.prefetch_stats['download_seconds']:.2f} 秒, "
+                    f"等待下载 {self.prefetch_stats['wait_seconds']:.2f} 秒, "
+                    f"重叠 {self.prefetch_stats['overlap_seconds']:.2f} 秒 "
+                    f"({self.prefetch_stats['overlap_ratio']:.0%})")
+
+    def _open_mirror_stream(self, stream_conn_settings, log_file, log_pos):
+        """下载缺少的部分到本地binlog缓存并从缓存读取，失败时返回None改用复制连接"""
+        try:
+            if self._prefetcher is not None:
+                self._prefetcher.ensure(log_file)
+            else:
+                files = self.binlogList[self.binlogList.index(log_file):] if log_file in self.binlogList \
+                    else [log_file]
+                self._mirror.sync(stream_conn_settings, self.server_id, files, files[-1],
+                                  self._range_end(files[-1]))
+            if not self._mirror.covers(log_file, log_pos):
+                raise ValueError('本地缓存不包含 %s:%s' % (log_file, log_pos))
+            logger.info(f"从本地binlog缓存读取: {self._mirror.directory}, 本次下载 {self._mirror.downloaded} 字节")
+            return MirrorBinLogStreamReader(
+                connection_settings=stream_conn_settings,
+                server_id=self.server_id,
+                log_file=log_file,
+                log_pos=log_pos,
+                only_schemas=self.only_schemas,
+                only_tables=self.only_tables,
+                resume_stream=True,
+                blocking=False,
+                fail_on_table_metadata_unavailable=False,
+                ignored_events=self._ignored_events,
+                table_columns=self._table_columns,
+                mirror=self._mirror,
+                prefetcher=self._prefetcher
+            )
+        except Exception as e:
+            logger.warning(f"本地binlog缓存不可用，改为从服务器读取: {str(e)}")
+            return None
 
-            logger.info(f"使用连接配置: charset={stream_conn_settings.get('charset')}")
+    def _open_raw_source(self, log_file, log_pos):
+        """
+        打开读取原始事件的数据源，使用本地binlog缓存时从缓存读取
 
+        Returns:
+            tuple: (_read_packet函数, 是否带校验和, 关闭函数)
+        """
+        if self._mirror is not None:
             try:
-                stream = BinLogStreamReader(
-                    connection_settings=stream_conn_settings,
-                    server_id=self.server_id,
-                    log_file=self.start_file,
-                    log_pos=self.start_pos,
-                    only_schemas=self.only_schemas,
-                    only_tables=self.only_tables,
-                    resume_stream=True,
-                    blocking=True,
-                    # 添加额外的容错参数
-                    fail_on_table_metadata_unavailable=False
-                )
-            except Exception as stream_error:
-                logger.error(f"创建BinLogStreamReader失败: {str(stream_error)}")
-                # 尝试使用更基本的字符集配置重试
-                fallback_settings = self.conn_setting.copy()
-                fallback_settings['charset'] = 'utf8'
-                logger.info("尝试使用fallback字符集配置重新创建stream...")
-
-                stream = BinLogStreamReader(
-                    connection_settings=fallback_settings,
-                    server_id=self.server_id,
-                    log_file=self.start_file,
-                    log_pos=self.start_pos,
-                    only_schemas=self.only_schemas,
-                    only_tables=self.only_tables,
-                    resume_stream=True,
-                    blocking=True,
-                    fail_on_table_metadata_unavailable=False
-                )
-
-            flag_last_event = False
-            e_start_pos, last_pos = stream.log_pos, stream.log_pos
-
-            # 创建临时文件用于flashback模式
-            # 将IP地址中的点号和端口号组合成安全的文件名
-            safe_host = self.conn_setting['host'].replace('.', '_').replace(':', '_')
-            safe_port = str(self.conn_setting['port'])
-            tmp_file = create_unique_file('binlog_tmp_%s_%s' % (safe_host, safe_port))
-
-            # 在flashback模式下，需要在处理完所有事件后才读取临时文件，所以不能使用temp_open
-            f_tmp = open(tmp_file, "w", encoding="utf-8", errors="ignore")
+                files = self.binlogList[self.binlogList.index(log_file):]
+                self._mirror.sync(self._stream_connection_settings(), self.server_id, files, files[-1],
+                                  self._range_end(files[-1]))
+                if self._mirror.covers(log_file, log_pos):
+                    source = self._mirror.open_source(log_file, log_pos, 'utf8')
+                    return source._read_packet, self._mirror.checksum(log_file), source.close
+            except Exception as e:
+                logger.warning(f"本地binlog缓存不可用，改为从服务器读取: {str(e)}")
+        connection, checksum, close = open_dump_connection(self._stream_connection_settings(), self.server_id,
+                                                           log_file, log_pos)
+        return connection._read_packet, checksum, close
+
+    def _export_binlog(self, callback=None):
+        """按原始字节导出匹配过滤条件的事务，不解码行数据"""
+        start_time = self.start_time if self.start_time.year > 1980 else None
+        stop_time = self.stop_time if self.stop_time.year < 2999 else None
+        logger.info(f"导出原始binlog到 {self.export_binlog}")
+        read_packet, checksum, close = self._open_raw_source(self.start_file, self.start_pos)
+        current_file = self.start_file
+        self._notify_progress(current_file)
+        with BinlogExporter(self.export_binlog, self.only_schemas, self.only_tables, self.sql_type,
+                            self.only_dml, start_time, stop_time) as exporter:
+            try:
+                for event in raw_events(read_packet):
+                    _, event_type, _, _, log_pos, flags = parse_header(event)
+                    if event_type == ROTATE_EVENT:
+                        exporter.feed(event, checksum)
+                        current_file = event[HEADER_SIZE + 8:len(event) - (CHECKSUM_SIZE if checksum else 0)].decode('utf-8', 'ignore')
+                        if flags & LOG_EVENT_ARTIFICIAL_F or log_pos == 0:
+                            continue
+                        if current_file not in self.binlogList:
+                            break
+                        self._notify_progress(current_file)
+                        continue
+                    if log_pos and ((self.end_pos and current_file == self.end_file and log_pos > self.end_pos) or
+                                    (current_file == self.eof_file and log_pos > self.eof_pos)):
+                        break
+                    exporter.feed(event, checksum)
+            finally:
+                close()
+        summary = (f"导出了 {exporter.transactions} 个事务（{exporter.events} 个事件，{exporter.position} 字节），"
+                   f"跳过 {exporter.skipped_transactions} 个事务: {self.export_binlog}")
+        logger.info(summary)
+        self._output('-- ' + summary, callback)
+
+    def _notify_progress(self, file_name):
+        """发送进度（只传递文件名），回调失败不中断解析"""
+        if self.progress_callback:
             try:
+                self.progress_callback(file_name)
+            except Exception as callback_error:
+                logger.warning(f"进度回调执行失败: {str(callback_error)}")
+
+    @staticmethod
+    def _output(sql, callback=None):
+        """输出一条SQL"""
+        if callback:
+            callback(sql)
+        else:
+            print(sql)
+
+    def _write(self, sql, callback=None, parts=None):
+        """
+        按顺序输出一条SQL，开启合并时经过合并器
+
+        Args:
+            parts: 可合并语句的片段，为None时作为普通语句输出
+        """
+        if self._coalescer is None:
+            self._output(sql, callback)
+        elif parts:
+            self._coalescer.add(parts)
+        else:
+            self._coalescer.add_statement(sql)
+
+    def _coalesce_max_bytes(self):
+        """单条合并语句的最大字节数，默认取max_allowed_packet并留出余量"""
+        if self.coalesce_max_bytes:
+            return self.coalesce_max_bytes
+        packet = self.capabilities.max_allowed_packet if self.capabilities is not None else None
+        try:
+            if packet is None:
                 with self.connection.cursor() as cursor:
-                    # 使用安全的事件迭代器，自动处理编码错误
-                    logger.info("开始使用安全事件迭代器处理binlog事件...")
-
-                    # 初始化进度跟踪
-                    current_file_name = self.start_file
-
-                    # 发送初始进度（只传递文件名）
-                    if self.progress_callback:
-                        self.progress_callback(current_file_name)
-
-                    event_count = 0
-                    for binlog_event in self._safe_event_iterator(stream):
-                        event_count += 1
-
-                        # 检查是否切换到新文件 - 使用多种方法检测
-                        new_file_name = None
-
-                        # 方法1：检查packet.log_file属性
-                        if hasattr(binlog_event, 'packet') and hasattr(binlog_event.packet, 'log_file'):
-                            new_file_name = binlog_event.packet.log_file
-
-                        # 方法2：检查RotateEvent（文件轮转事件）
-                        elif isinstance(binlog_event, RotateEvent):
-                            if hasattr(binlog_event, 'next_binlog'):
-                                new_file_name = binlog_event.next_binlog
-                                logger.info(f"检测到RotateEvent，下一个文件: {new_file_name}")
-
-                        # 如果检测到文件切换
-                        if new_file_name and new_file_name != current_file_name:
-                            current_file_name = new_file_name
-                            # logger.info(f"切换到新的binlog文件: {current_file_name}")
-
-                            # 文件切换时更新进度（只传递文件名）
-                            if self.progress_callback:
-                                try:
-                                    self.progress_callback(current_file_name)
-                                except Exception as callback_error:
-                                    logger.warning(f"进度回调执行失败: {str(callback_error)}")
-                                    # 不要因为进度回调失败而中断解析
-
-                        # 每处理2000个事件也发送一次进度更新（即使没有文件切换）
-                        if event_count % 2000 == 0 and self.progress_callback:
-                            try:
-                                self.progress_callback(current_file_name)
-                            except Exception as callback_error:
-                                logger.warning(f"进度回调执行失败: {str(callback_error)}")
-                                # 不要因为进度回调失败而中断解析
-                        try:
-                            # 首先修复事件中的编码问题
-                            try:
-                                self._fix_event_encoding(binlog_event)
-                            except Exception as e:
-                                logger.warning(f"修复事件编码时发生错误，跳过该事件: {str(e)}")
-                                continue
+                    cursor.execute("SELECT @@max_allowed_packet")
+                    packet = int(cursor.fetchone()[0])
+        except Exception as e:
+            logger.warning(f"获取max_allowed_packet失败，使用默认值: {str(e)}")
+            return MAX_BATCH_BYTES
+        return max(min(packet - 1024, MAX_BATCH_BYTES), 1024)
 
-                            if not self.stop_never:
-                                try:
-                                    event_time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
-                                except OSError:
-                                    event_time = datetime.datetime(1980, 1, 1, 0, 0)
-
-                                if (stream.log_file == self.end_file and stream.log_pos == self.end_pos) or \
-                                   (stream.log_file == self.eof_file and stream.log_pos == self.eof_pos):
-                                    flag_last_event = True
-                                elif event_time < self.start_time:
-                                    if not (isinstance(binlog_event, RotateEvent) or isinstance(binlog_event, FormatDescriptionEvent)):
-                                        last_pos = binlog_event.packet.log_pos
-                                    continue
-                                elif (stream.log_file not in self.binlogList) or \
-                                     (self.end_pos and stream.log_file == self.end_file and stream.log_pos > self.end_pos) or \
-                                     (stream.log_file == self.eof_file and stream.log_pos > self.eof_pos) or \
-                                     (event_time >= self.stop_time):
-                                    break
+    def _key_columns(self, schema, table, primary_key=None):
+        """
+        定位行使用的键列
 
-                            if isinstance(binlog_event, QueryEvent) and binlog_event.query == 'BEGIN':
-                                e_start_pos = last_pos
-
-                            if isinstance(binlog_event, QueryEvent) and not self.only_dml:
-                                try:
-                                    sql = concat_sql_from_binlog_event(
-                                        cursor=cursor,
-                                        binlog_event=binlog_event,
-                                        flashback=self.flashback,
-                                        no_pk=self.no_pk
-                                    )
-                                    if sql:
-                                        # 确保SQL是正确编码的字符串
-                                        if isinstance(sql, bytes):
-                                            sql = sql.decode('utf-8', 'ignore')
-                                        if callback:
-                                            callback(sql)
-                                        else:
-                                            print(sql)
-                                except UnicodeDecodeError as e:
-                                    logger.warning(f"处理QueryEvent时发生编码错误，跳过该事件: {str(e)}")
-                                    continue
-                                except Exception as e:
-                                    logger.error(f"处理QueryEvent时发生错误: {str(e)}")
-                                    continue
-
-                            elif is_dml_event(binlog_event) and event_type(binlog_event) in self.sql_type:
-                                for row in binlog_event.rows:
-                                    try:
-                                        sql = concat_sql_from_binlog_event(
-                                            cursor=cursor,
-                                            binlog_event=binlog_event,
-                                            no_pk=self.no_pk,
-                                            row=row,
-                                            flashback=self.flashback,
-                                            e_start_pos=e_start_pos
-                                        )
-                                        if self.flashback:
-                                            # 确保写入文件的内容是正确编码的字符串
-                                            if isinstance(sql, bytes):
-                                                sql = sql.decode('utf-8', 'ignore')
-                                            f_tmp.write(sql + '\n')
-                                        else:
-                                            if callback:
-                                                callback(sql)
-                                            else:
-                                                print(sql)
-                                    except UnicodeDecodeError as e:
-                                        logger.warning(f"处理行数据时发生编码错误，跳过该行: {str(e)}")
-                                        continue
-                                    except Exception as e:
-                                        logger.error(f"处理行数据时发生错误: {str(e)}")
-                                        continue
-
-                            if not (isinstance(binlog_event, RotateEvent) or isinstance(binlog_event, FormatDescriptionEvent)):
-                                last_pos = binlog_event.packet.log_pos
-
-                            if flag_last_event:
-                                break
+        Returns:
+            tuple: 键列名；未开启key_where或表没有键时返回None，按整行匹配
+        """
+        if not self.key_where:
+            return None
+        if self.row_metadata_full and primary_key:
+            # 主键取自表映射事件的可选元数据，不需要查询
+            return primary_key_columns(primary_key)
+        columns = self._key_cache.get(schema, table)
+        if columns is None:
+            # 查询失败时使用表映射事件中的主键
+            columns = primary_key_columns(primary_key)
+        return columns or None
+
+    def _batch_parts(self, cursor, schema, table, primary_key, args, start_pos, end_pos, timestamp):
+        """
+        生成一行可合并语句的片段
 
-                        except UnicodeDecodeError as e:
-                            logger.warning(f"处理binlog事件时发生编码错误，跳过该事件: {str(e)}")
-                            continue
-                        except Exception as e:
-                            logger.error(f"处理binlog事件时发生错误: {str(e)}")
-                            # 对于非编码错误，我们继续处理下一个事件
-                            continue
+        Returns:
+            tuple: (前缀, 已转义的片段, 后缀, 起始位置, 结束位置, 时间)，不可合并时返回None
+        """
+        if not args:
+            return None
+        key_columns = self._key_columns(schema, table, primary_key) or primary_key
+        parts = compose_batch_parts(schema=schema, table=table, primary_key=key_columns, **args)
+        if not parts:
+            return None
+        fragment = render_sql(cursor, parts)
+        return (parts['prefix'], fragment, parts['suffix'], start_pos, end_pos,
+                datetime.datetime.fromtimestamp(timestamp))
+
+    def _process_flashback(self, callback=None):
+        """
+        按从新到旧的顺序逐个文件生成回滚SQL
+
+        每个binlog文件单独暂存并倒序输出，文件之间按从新到旧的顺序处理，
+        因此整体输出仍是全局倒序，且第一个文件处理完后即可开始输出。
+        事务不会跨越binlog文件，所以逐文件倒序与整体倒序等价。
+        """
+        from .binlog_util import get_rollback_start_comment, get_rollback_end_comment
+
+        files = list(reversed(self.binlogList))
+        logger.info(f"flashback模式按倒序处理binlog文件: {files}")
+
+        self._rollback_sql_count = 0
+        self._rollback_batch_counter = 0
+        self._group_rows = 0  # 当前回滚分组已输出的语句数，0表示没有打开的分组
+        self._throttle_seconds = 0.0  # 尚未输出的限速等待时间
+        if self.group_rollback:
+            logger.info(f"回滚SQL分组: {'按原事务' if not self.rollback_group_size else self.rollback_group_size}, "
+                        f"限速: {self.throttle_rows or '-'} 行/秒, {self.throttle_txns or '-'} 分组/秒")
+        self._write(get_rollback_start_comment().rstrip(), callback)
+
+        # 将IP地址中的点号和端口号组合成安全的文件名
+        safe_host = self.conn_setting['host'].replace('.', '_').replace(':', '_')
+        safe_port = str(self.conn_setting['port'])
+        spool_prefix = 'binlog_tmp_%s_%s' % (safe_host, safe_port)
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            spool_prefix = os.path.join(self.spool_dir, spool_prefix)
+        logger.info(f"回滚SQL暂存: 目录={self.spool_dir or os.getcwd()}, "
+                    f"压缩={self.spool_compress}, 上限={self.spool_budget_mb or '不限制'} MB")
+
+        with self.connection.cursor() as cursor:
+            for log_file in files:
+                log_pos = self.start_pos if log_file == self.start_file else 4
+                self._notify_progress(log_file)
+
+                tmp_file = create_unique_file(spool_prefix)
+                with RollbackSpool(tmp_file, compress=self.spool_compress,
+                                   budget=self.spool_budget_mb * 1024 * 1024) as spool:
+                    stream = self._open_stream(log_file, log_pos)
+                    try:
+                        reached_start_time = self._run_stream(stream, cursor, callback,
+                                                              spool=spool, scope_file=log_file)
+                    finally:
+                        stream.close()
+
+                    self._print_rollback_sql(spool, log_file, callback=callback)
+
+                if self.limit_reached:
+                    logger.info(f"回滚SQL达到输出限制，停止处理更早的binlog文件")
+                    break
+                if reached_start_time:
+                    # 当前文件已包含早于开始时间的事件，更早的文件无需再读取
+                    logger.info(f"{log_file} 已到达开始时间 {self.start_time}，跳过更早的binlog文件")
+                    break
+
+        # 只有当有SQL语句时才输出结束注释
+        if self._rollback_sql_count > 0:
+            self._write("", callback)  # 空行分隔
+            self._write(get_rollback_end_comment(), callback)
+
+    def _process_compacted(self, callback=None):
+        """
+        合并窗口内的行变更后输出净变化
 
-                stream.close()
+        正向模式下每行输出从最早前镜像到最终后镜像的一条语句，
+        回滚模式下输出从最终后镜像回到最早前镜像的一条语句，并按倒序输出。
+        合并会打乱事务边界，因此只按语句数和行数计入输出限制。
+        """
+        from .binlog_util import get_rollback_start_comment, get_rollback_end_comment
+
+        with ChangeCompactor(spill_dir=self.spool_dir, max_keys=self.compact_max_keys) as compactor:
+            with self.connection.cursor() as cursor:
+                self._compactor = compactor
+                stream = self._open_stream(self.start_file, self.start_pos)
+                try:
+                    self._run_stream(stream, cursor, callback)
+                finally:
+                    stream.close()
+                    self._compactor = None
+
+                logger.info(f"净变化合并完成: {compactor.row_changes} 行变更合并为 {len(compactor)} 行")
 
                 if self.flashback:
-                    f_tmp.close()  # 关闭文件以便读取
-                    self._print_rollback_sql(filename=tmp_file, callback=callback)
+                    self._write(get_rollback_start_comment().rstrip(), callback)
+
+                for change in compactor.changes(reverse=self.flashback):
+                    before, after = change['before'], change['after']
+                    if self.flashback:
+                        before, after = after, before
+                    no_pk = self.no_pk and not self.flashback
+                    parts = None
+                    if self._coalescer:
+                        parts = self._batch_parts(
+                            cursor, change['schema'], change['table'], change['primary_key'],
+                            net_change_args(before, after, primary_key=change['primary_key'], no_pk=no_pk),
+                            change['start_pos'], change['end_pos'], change['timestamp'])
+                    if parts:
+                        sql = parts_to_sql(parts)
+                    else:
+                        pattern = generate_net_sql_pattern(
+                            change['schema'], change['table'], before, after,
+                            primary_key=change['primary_key'], no_pk=no_pk,
+                            key_columns=self._key_columns(change['schema'], change['table'], change['primary_key']),
+                            changed_only=self.changed_only)
+                        if not pattern:
+                            continue
+                        sql = render_sql(cursor, pattern) + position_comment(
+                            change['start_pos'], change['end_pos'], change['timestamp'])
+                    if not self._match_keywords(sql):
+                        continue
+
+                    self._write(sql, callback, parts)
+                    self.emitted_statements += 1
+                    self.emitted_rows += 1
+                    if self._statement_limit_hit():
+                        self.limit_reached = True
+                        break
+
+                if self.flashback and self.emitted_statements > 0:
+                    self._write("", callback)  # 空行分隔
+                    self._write(get_rollback_end_comment(), callback)
+
+    def _start_rows_query(self, binlog_event, start_pos):
+        """记录一条Rows_query事件中的原始语句，其后的行事件属于该语句"""
+        self._rows_query_seen += 1
+        self._rows_query = {
+            'query': rows_query_text(binlog_event),
+            'start_pos': start_pos,
+            'end_pos': binlog_event.packet.log_pos,
+            'timestamp': binlog_event.timestamp,
+            'rows': 0,
+            'matched': False,  # 是否有通过过滤的行事件
+            'emitted': False,  # 是否已输出该语句生成的行SQL
+        }
+
+    def _track_rows_query(self, binlog_event):
+        """只输出原始语句时，记录属于当前语句的行事件，不生成行SQL"""
+        if self._rows_query is None:
+            return
+        self._rows_query['matched'] = True
+        self._rows_query['end_pos'] = binlog_event.packet.log_pos
+        if self.rows_query_counts:
+            self._rows_query['rows'] += len(binlog_event.rows)
+
+    def _finish_rows_query(self, callback=None, spool=None):
+        """
+        结束当前的原始语句
 
-                logger.info("binlog解析完成")
+        只输出原始语句时在此输出，回滚时注释写在该语句的行SQL之后，倒序输出后位于其上方。
+
+        Returns:
+            bool: 是否达到语句数限制
+        """
+        pending, self._rows_query = self._rows_query, None
+        if pending is None:
+            return False
+
+        if self.rows_query == ROWS_QUERY_ONLY:
+            if not pending['matched']:
+                return False
+            query = pending['query'].strip().rstrip(';')
+            sql = query + ';' + position_comment(pending['start_pos'], pending['end_pos'], pending['timestamp'])
+            if self.rows_query_counts:
+                sql += ' rows %d' % pending['rows']
+            if self._accept_sql(sql):
+                self._write(sql, callback)
+            return self._statement_limit_hit()
+
+        if spool and pending['emitted']:
+            spool.write(rows_query_comment(pending['query']), RECORD_COMMENT)
+        return False
+
+    def _write_json_rows(self, binlog_event, rows, log_file, start_pos, key_columns, absent=None):
+        """
+        按JSON Lines输出一个行事件中的行变更
+
+        Returns:
+            bool: 是否达到了语句数或行数限制
+        """
+        kind = event_type(binlog_event)
+        header = self._json.table_header(
+            binlog_event, key_columns or primary_key_columns(getattr(binlog_event, 'primary_key', None)))
+        for row in rows:
+            line = self._json.encode_row(binlog_event, kind, row, header, log_file, start_pos, absent)
+            # 关键字过滤和输出限制与SQL输出相同，关键字匹配JSON文本
+            if not self._accept_sql(line, is_row=True):
+                continue
+            self._json.add_row(binlog_event.schema, binlog_event.table, header, line)
+            if self._statement_limit_hit():
                 return True
-            finally:
-                # 确保文件被关闭和删除
-                try:
-                    if not f_tmp.closed:
-                        f_tmp.close()
-                except:
-                    pass
+        return False
+
+    def _store_rows(self, binlog_event, rows, log_file, start_pos, key_columns):
+        """将一个行事件中的行变更保存到列式存储"""
+        kind = event_type(binlog_event)
+        columns = column_names(binlog_event)
+        key_columns = key_columns or primary_key_columns(getattr(binlog_event, 'primary_key', None))
+        for row in rows:
+            self.change_store.add(binlog_event.schema, binlog_event.table, kind, row, columns, key_columns,
+                                  binlog_event.timestamp, log_file, start_pos, binlog_event.packet.log_pos)
+
+    def _output_store_summary(self, callback=None):
+        """输出列式存储中按表和类型的变更统计"""
+        store = self.change_store
+        summary = f"保存了 {len(store)} 行变更（约 {store.nbytes() / 1024 / 1024:.1f} MB）"
+        logger.info(summary)
+        self._output(f"-- {summary}，按表和类型统计:", callback)
+        for (table, kind), count in store.group_counts(('table', 'type')):
+            self._output(f"-- {table} {kind}: {count}", callback)
+
+    def _warn_partial_image(self, binlog_event, reason):
+        """每个表只提示一次不完整行镜像的问题"""
+        table = '%s.%s' % (binlog_event.schema, binlog_event.table)
+        if table not in self._partial_image_tables:
+            self._partial_image_tables.add(table)
+            logger.warning(f"{table} 的行镜像不完整（binlog_row_image=MINIMAL/NOBLOB或JSON局部更新），"
+                           f"{reason}")
+
+    def _warn_unknown_schema(self, binlog_event):
+        """每个表只提示一次解码时表结构未知的问题"""
+        table = '%s.%s' % (binlog_event.schema, binlog_event.table)
+        if table not in self._unknown_schema_tables:
+            self._unknown_schema_tables.add(table)
+            logger.warning(f"{table} 的部分行事件解码时表结构未知，列名为占位名，生成的SQL已注释")
+
+    def _add_to_compactor(self, binlog_event, row, e_start_pos, partial_image=False):
+        """将一行变更加入净变化合并器，不完整的行镜像无法按主键合并"""
+        if isinstance(binlog_event, WriteRowsEvent):
+            before, after = None, dict(row.get('values', {}))
+        elif isinstance(binlog_event, DeleteRowsEvent):
+            before, after = dict(row.get('values', {})), None
+        else:
+            before, after = dict(row.get('before_values', {})), dict(row.get('after_values', {}))
+        if partial_image and self.flashback:
+            self._warn_partial_image(binlog_event, '按主键合并时无法检查回滚SQL是否可以重建')
+        primary_key = None if partial_image else getattr(binlog_event, 'primary_key', None)
+        self._compactor.add(binlog_event.schema, binlog_event.table, primary_key,
+                            before, after, e_start_pos, binlog_event.packet.log_pos, binlog_event.timestamp)
+
+    def _run_stream(self, stream, cursor, callback=None, spool=None, scope_file=None):
+        """
+        处理一个binlog流中的事件
+
+        Args:
+            stream: BinLogStreamReader
+            cursor: 用于生成SQL的数据库游标
+            callback: 回调函数，用于处理生成的SQL语句
+            spool: flashback模式下暂存回滚SQL的RollbackSpool
+            scope_file: 只处理该binlog文件，切换到下一个文件时结束
+
+        Returns:
+            bool: 是否遇到了早于开始时间的事件
+        """
+        flag_last_event = False
+        reached_start_time = False
+        e_start_pos, last_pos = stream.log_pos, stream.log_pos
+        # 当前事务的起始位置，用于达到限制时计算续读位置
+        txn_file, txn_start_pos = stream.log_file, stream.log_pos
+
+        # 使用安全的事件迭代器，自动处理编码错误
+        logger.info("开始使用安全事件迭代器处理binlog事件...")
+
+        # 初始化进度跟踪
+        current_file_name = stream.log_file
+        self._notify_progress(current_file_name)
+
+        event_count = 0
+        for binlog_event in self._safe_event_iterator(stream):
+            event_count += 1
+
+            # 检查是否切换到新文件 - 使用多种方法检测
+            new_file_name = None
+
+            # 方法1：检查packet.log_file属性
+            if hasattr(binlog_event, 'packet') and hasattr(binlog_event.packet, 'log_file'):
+                new_file_name = binlog_event.packet.log_file
+
+            # 方法2：检查RotateEvent（文件轮转事件）
+            elif isinstance(binlog_event, RotateEvent):
+                if hasattr(binlog_event, 'next_binlog'):
+                    new_file_name = binlog_event.next_binlog
+                    logger.info(f"检测到RotateEvent，下一个文件: {new_file_name}")
+
+            # 只处理指定文件时，切换到下一个文件即结束
+            if scope_file and new_file_name and new_file_name != scope_file:
+                break
+
+            # 如果检测到文件切换
+            if new_file_name and new_file_name != current_file_name:
+                current_file_name = new_file_name
+                # 文件切换时更新进度
+                self._notify_progress(current_file_name)
+
+            # 每处理2000个事件也发送一次进度更新（即使没有文件切换）
+            if event_count % 2000 == 0:
+                self._notify_progress(current_file_name)
+            try:
+                # 首先修复事件中的编码问题
                 try:
-                    if os.path.exists(tmp_file):
-                        os.remove(tmp_file)
-                except:
-                    pass
+                    self._fix_event_encoding(binlog_event)
+                except Exception as e:
+                    logger.warning(f"修复事件编码时发生错误，跳过该事件: {str(e)}")
+                    continue
 
-        except Exception as e:
-            error_msg = str(e)
-            logger.error(f'处理binlog时发生错误: {error_msg}')
+                if not self.stop_never:
+                    try:
+                        event_time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
+                    except OSError:
+                        event_time = datetime.datetime(1980, 1, 1, 0, 0)
+
+                    if (stream.log_file == self.end_file and stream.log_pos == self.end_pos) or \
+                       (stream.log_file == self.eof_file and stream.log_pos == self.eof_pos):
+                        flag_last_event = True
+                    elif event_time < self.start_time:
+                        if not (isinstance(binlog_event, RotateEvent) or isinstance(binlog_event, FormatDescriptionEvent)):
+                            last_pos = binlog_event.packet.log_pos
+                            reached_start_time = True
+                        continue
+                    elif (stream.log_file not in self.binlogList) or \
+                         (self.end_pos and stream.log_file == self.end_file and stream.log_pos > self.end_pos) or \
+                         (stream.log_file == self.eof_file and stream.log_pos > self.eof_pos) or \
+                         (event_time >= self.stop_time):
+                        break
 
-            # 检查是否是编码错误
-            if 'utf-8' in error_msg.lower() or 'decode' in error_msg.lower() or 'unicode' in error_msg.lower():
-                logger.warning("检测到编码错误，但解析器已处理了部分数据。建议检查数据库字符集设置。")
+                if isinstance(binlog_event, QueryEvent) and is_schema_change(binlog_event.query):
+                    # 表结构可能改变，重新查询键定义；无法确定涉及的表时（如CREATE INDEX）全部重新查询
+                    schema = binlog_event.schema
+                    if isinstance(schema, bytes):
+                        schema = schema.decode('utf-8', 'ignore')
+                    self._key_cache.invalidate(ddl_tables(binlog_event.query, schema))
 
-                # 如果是flashback模式，尝试读取已写入的临时文件
-                if self.flashback:
+                if isinstance(binlog_event, RowsQueryLogEvent) and self.rows_query:
+                    if self._finish_rows_query(callback, spool):
+                        self._stop_at(txn_file, txn_start_pos, self._txn_passed)
+                        break
+                    self._start_rows_query(binlog_event, e_start_pos)
+
+                if self._json is not None and isinstance(binlog_event, (GtidEvent, MariadbGtidEvent)):
+                    self._json.gtid = binlog_event.gtid
+
+                if isinstance(binlog_event, QueryEvent) and binlog_event.query == 'BEGIN':
+                    e_start_pos = last_pos
+                    txn_file, txn_start_pos = stream.log_file, last_pos
+                    self._txn_passed = 0
+
+                if isinstance(binlog_event, XidEvent) or \
+                        (isinstance(binlog_event, QueryEvent) and binlog_event.query == 'COMMIT'):
+                    statement_limit = self.rows_query and self._finish_rows_query(callback, spool)
+                    if self._json is not None:
+                        self._json.commit(getattr(binlog_event, 'xid', None))
+                    if spool:
+                        # 事务边界，倒序输出时用于按事务计数
+                        spool.end_transaction(binlog_event.packet.log_pos)
+                    elif self._coalescer and self.stop_never:
+                        # 持续解析时不等待后续事务，及时输出已合并的语句
+                        self._coalescer.flush()
+                    if self._txn_passed > 0:
+                        self._txn_passed = 0
+                        self.emitted_transactions += 1
+                        if statement_limit or (self.max_transactions and
+                                               self.emitted_transactions >= self.max_transactions):
+                            self._stop_at(stream.log_file, binlog_event.packet.log_pos)
+                            break
+
+                if isinstance(binlog_event, QueryEvent) and not self.only_dml:
                     try:
-                        # 确保临时文件已关闭（如果文件对象存在的话）
+                        sql = concat_sql_from_binlog_event(
+                            cursor=cursor,
+                            binlog_event=binlog_event,
+                            flashback=self.flashback,
+                            no_pk=self.no_pk
+                        )
+                        # 确保SQL是正确编码的字符串
+                        if isinstance(sql, bytes):
+                            sql = sql.decode('utf-8', 'ignore')
+                        if self._accept_sql(sql):
+                            if self._json is not None:
+                                self._json.add_ddl(binlog_event, stream.log_file, last_pos)
+                            else:
+                                self._write(sql, callback)
+                            # DDL自成一个事务
+                            if binlog_event.query not in ('BEGIN', 'COMMIT'):
+                                self._txn_passed = 0
+                                self.emitted_transactions += 1
+                                if self._statement_limit_hit() or (
+                                        self.max_transactions and
+                                        self.emitted_transactions >= self.max_transactions):
+                                    self._stop_at(stream.log_file, binlog_event.packet.log_pos)
+                                    break
+                    except UnicodeDecodeError as e:
+                        logger.warning(f"处理QueryEvent时发生编码错误，跳过该事件: {str(e)}")
+                        continue
+                    except Exception as e:
+                        logger.error(f"处理QueryEvent时发生错误: {str(e)}")
+                        continue
+
+                elif self.rows_query == ROWS_QUERY_ONLY and is_dml_event(binlog_event) and \
+                        event_type(binlog_event) in self.sql_type:
+                    # 只输出原始语句，不解码行数据
+                    self._track_rows_query(binlog_event)
+
+                elif is_dml_event(binlog_event) and event_type(binlog_event) in self.sql_type:
+                    rows = binlog_event.rows
+                    # binlog_row_image为MINIMAL或NOBLOB时行镜像不包含所有列
+                    before_absent, after_absent = row_image_absent_columns(binlog_event)
+                    # JSON局部更新的后镜像中没有完整的文档，同样按不完整的镜像处理
+                    partial_image = bool(before_absent or after_absent) or \
+                        isinstance(binlog_event, PartialUpdateRowsEvent)
+                    if partial_image:
+                        rows = [prune_row_image(row, before_absent, after_absent) for row in rows]
+                    # 解码时表结构未知的列只有占位列名，生成的SQL只作为注释输出
+                    schema_gap = '解码时的表结构未知' if unknown_columns(binlog_event) else None
+                    if schema_gap:
+                        self._warn_unknown_schema(binlog_event)
+
+                    if self._compactor is not None and not schema_gap:
+                        # 合并模式只记录行状态，结束后统一生成SQL
+                        for row in rows:
+                            self._add_to_compactor(binlog_event, row, e_start_pos, partial_image)
+                        rows = ()
+                    else:
+                        key_columns = self._key_columns(binlog_event.schema, binlog_event.table,
+                                                        getattr(binlog_event, 'primary_key', None))
+
+                    if self._json is not None:
+                        # JSON Lines直接编码行数据，不生成SQL
+                        if self._write_json_rows(binlog_event, rows, stream.log_file, e_start_pos, key_columns,
+                                                 (before_absent, after_absent) if partial_image else None):
+                            self._stop_at(txn_file, txn_start_pos, self._txn_passed)
+                        rows = ()
+                    elif self.change_store is not None:
+                        # 只保存到列式存储，不生成SQL
+                        self._store_rows(binlog_event, rows, stream.log_file, e_start_pos, key_columns)
+                        rows = ()
+
+                    for row in rows:
                         try:
-                            if 'f_tmp' in locals() and f_tmp and not f_tmp.closed:
-                                f_tmp.close()
-                        except:
-                            pass
+                            parts = None
+                            image_gap = schema_gap
+                            if partial_image and not image_gap:
+                                image_gap = row_image_gap(
+                                    binlog_event, row, self.flashback, before_absent, after_absent,
+                                    key_columns or primary_key_columns(getattr(binlog_event, 'primary_key', None)))
+                            if self._coalescer and not image_gap:
+                                parts = self._batch_parts(
+                                    cursor, binlog_event.schema, binlog_event.table,
+                                    getattr(binlog_event, 'primary_key', None),
+                                    row_change_args(binlog_event, row=row, flashback=self.flashback,
+                                                    no_pk=self.no_pk),
+                                    e_start_pos, binlog_event.packet.log_pos, binlog_event.timestamp)
+                            if parts:
+                                sql = parts_to_sql(parts)
+                            else:
+                                sql = concat_sql_from_binlog_event(
+                                    cursor=cursor,
+                                    binlog_event=binlog_event,
+                                    no_pk=self.no_pk,
+                                    row=row,
+                                    flashback=self.flashback,
+                                    e_start_pos=e_start_pos,
+                                    key_columns=key_columns,
+                                    changed_only=self.changed_only
+                                )
+                            # 确保SQL是正确编码的字符串
+                            if isinstance(sql, bytes):
+                                sql = sql.decode('utf-8', 'ignore')
+                            if image_gap and sql:
+                                # 无法从不完整的行镜像或未知的表结构生成正确的SQL，注释掉并提示
+                                if not schema_gap:
+                                    self._warn_partial_image(binlog_event, image_gap)
+                                sql = '-- %s: %s' % (image_gap, sql)
+                            if not self._accept_sql(sql, is_row=True):
+                                continue
+                            if self._rows_query and not self._rows_query['emitted']:
+                                # 第一条行SQL之前输出原始语句，回滚时在语句结束后写入暂存文件
+                                self._rows_query['emitted'] = True
+                                if not spool:
+                                    self._write(rows_query_comment(self._rows_query['query']), callback)
+                            if spool and parts:
+                                spool.write(pack_parts(parts), RECORD_PARTS)
+                            elif spool:
+                                spool.write(sql)
+                            else:
+                                self._write(sql, callback, parts)
+                        except SpoolBudgetExceededError:
+                            raise
+                        except UnicodeDecodeError as e:
+                            logger.warning(f"处理行数据时发生编码错误，跳过该行: {str(e)}")
+                            continue
+                        except Exception as e:
+                            logger.error(f"处理行数据时发生错误: {str(e)}")
+                            continue
 
-                        # 尝试读取并输出回滚SQL
-                        if 'tmp_file' in locals() and os.path.exists(tmp_file):
-                            logger.info("尝试读取flashback模式下的临时文件...")
-                            self._print_rollback_sql(filename=tmp_file, callback=callback)
-                            logger.info("flashback模式下的临时文件读取完成")
-                    except Exception as flashback_error:
-                        logger.error(f"读取flashback临时文件时发生错误: {str(flashback_error)}")
+                        if self._statement_limit_hit():
+                            # 在事务中途停止，续读时从事务开头重新读取并跳过已输出的语句
+                            self._stop_at(txn_file, txn_start_pos, self._txn_passed)
+                            break
 
-                # 对于编码错误，我们返回True表示部分成功，而不是抛出异常
-                return True
-            else:
-                # 对于其他类型的错误，仍然抛出异常
-                raise Exception(f'处理binlog时发生错误: {error_msg}')
+                    if self.limit_reached:
+                        break
+
+                if isinstance(binlog_event, RotateEvent):
+                    last_pos = binlog_event.position
+                elif not isinstance(binlog_event, FormatDescriptionEvent):
+                    last_pos = binlog_event.packet.log_pos
+
+                if flag_last_event:
+                    break
+
+            except SpoolBudgetExceededError:
+                raise
+            except UnicodeDecodeError as e:
+                logger.warning(f"处理binlog事件时发生编码错误，跳过该事件: {str(e)}")
+                continue
+            except Exception as e:
+                logger.error(f"处理binlog事件时发生错误: {str(e)}")
+                # 对于非编码错误，我们继续处理下一个事件
+                continue
+
+        if self.rows_query and not self.limit_reached:
+            self._finish_rows_query(callback, spool)
+        self._rows_query = None
+
+        return reached_start_time
 
     def _safe_event_iterator(self, stream):
         """安全的事件迭代器，捕获所有可能的编码错误"""
@@ -417,15 +1383,14 @@ class BinlogParser(object):
 
         logger.info("启动安全事件迭代器...")
 
+        # BinLogStreamReader需要使用iter()来获取迭代器，每个流使用独立的迭代器
+        stream_iterator = iter(stream)
+
         while True:
             try:
                 # 尝试获取下一个事件
                 try:
-                    # BinLogStreamReader需要使用iter()来获取迭代器
-                    if not hasattr(self, '_stream_iterator'):
-                        self._stream_iterator = iter(stream)
-
-                    event = next(self._stream_iterator)
+                    event = next(stream_iterator)
                     event_count += 1
                     consecutive_errors = 0  # 重置连续错误计数
 
@@ -437,6 +1402,9 @@ class BinlogParser(object):
                     # 正常结束
                     logger.info(f"事件流结束，总共处理 {event_count} 个事件，跳过 {skipped_count} 个问题事件")
                     break
+                except PayloadDecompressionError:
+                    # 跳过压缩的事务会导致结果缺失，直接中止
+                    raise
                 except UnicodeDecodeError as e:
                     consecutive_errors += 1
                     skipped_count += 1
@@ -478,6 +1446,8 @@ class BinlogParser(object):
                     logger.warning(f"跳过处理失败的binlog事件 #{event_count}: {str(e)}")
                     continue
 
+            except PayloadDecompressionError:
+                raise
             except Exception as e:
                 logger.error(f"binlog流迭代时发生严重错误: {str(e)}")
                 # 检查是否是编码错误
@@ -485,6 +1455,11 @@ class BinlogParser(object):
                     logger.error("检测到严重的编码错误，建议检查MySQL服务器字符集配置")
                 break
 
+        if getattr(stream, 'payload_count', 0):
+            logger.info(f"解压了 {stream.payload_count} 个压缩的事务")
+        if self._table_columns is not None:
+            logger.info(f"表结构: 使用本地缓存 {self._table_columns.lookups} 次, "
+                        f"查询服务器 {self._table_columns.fetches} 次")
         if skipped_count > 0:
             logger.warning(f"总共跳过了 {skipped_count} 个有问题的binlog事件，成功处理了 {event_count} 个事件")
         else:
@@ -533,8 +1508,8 @@ class BinlogParser(object):
                         except:
                             setattr(event, attr_name, str(attr_value))
 
-            # 修复行数据中的编码问题
-            if hasattr(event, 'rows') and event.rows is not None:
+            # 修复行数据中的编码问题（只输出原始语句时不解码行数据）
+            if self.rows_query != ROWS_QUERY_ONLY and hasattr(event, 'rows') and event.rows is not None:
                 try:
                     for row in event.rows:
                         self._fix_row_encoding(row)
@@ -586,7 +1561,8 @@ class BinlogParser(object):
                         data_dict[key] = value.decode('utf-8', 'ignore')
                     except:
                         data_dict[key] = str(value)
-                elif value is not None and not isinstance(value, (str, int, float, bool, type(None))):
+                elif value is not None and not isinstance(value, (str, int, float, bool, type(None))) and \
+                        not is_expression(value):
                     # 对于其他类型，尝试转换为字符串
                     try:
                         data_dict[key] = str(value)
@@ -596,96 +1572,122 @@ class BinlogParser(object):
         except Exception as e:
             logger.warning(f"修复{dict_name}字典编码时发生错误: {str(e)}")
 
-    def _print_rollback_sql(self, filename, callback=None):
-        """打印回滚SQL"""
-        try:
-            # 导入注释函数
-            from .binlog_util import get_rollback_start_comment, get_rollback_end_comment
-
-            # 首先输出开始注释
-            start_comment = get_rollback_start_comment()
-            if callback:
-                callback(start_comment.rstrip())
-            else:
-                print(start_comment.rstrip())
-
-            with open(filename, "rb") as f_tmp:
-                batch_size = 1000
-                i = 0
-                sql_count = 0  # 记录SQL语句数量
-
-                for line in reversed_lines(f_tmp):
-                    sql = line.rstrip()
-
-                    # 只输出非空的SQL语句，不添加单独的注释
-                    if sql and sql.strip():
-                        sql_count += 1
-                        if callback:
-                            callback(sql)
-                        else:
-                            print(sql)
-
-                        if i >= batch_size:
-                            i = 0
-                            if self.back_interval:
-                                sleep_sql = 'SELECT SLEEP(%s);' % self.back_interval
-                                if callback:
-                                    callback(sleep_sql)
-                                else:
-                                    print(sleep_sql)
-                        else:
-                            i += 1
-
-                # 输出结束注释
-                if sql_count > 0:  # 只有当有SQL语句时才输出结束注释
-                    end_comment = get_rollback_end_comment()
-                    if callback:
-                        callback("")  # 空行分隔
-                        callback(end_comment)
-                    else:
-                        print("")  # 空行分隔
-                        print(end_comment)
-        except UnicodeDecodeError as e:
-            logger.error(f"读取临时文件时发生UTF-8解码错误: {str(e)}")
-            # 尝试使用ignore模式重新读取
-            try:
-                # 导入注释函数
-                from .binlog_util import get_rollback_start_comment, get_rollback_end_comment
+    def _print_rollback_sql(self, spool, log_file, callback=None):
+        """
+        倒序输出一个暂存文件中的回滚SQL，并处理分组、限速和输出限制
 
-                # 首先输出开始注释
-                start_comment = get_rollback_start_comment()
-                if callback:
-                    callback(start_comment.rstrip())
+        分组模式下每组用BEGIN/COMMIT包裹，默认与原事务一一对应（倒序），
+        达到语句数或行数限制时会先输出完当前事务，避免只回滚半个事务。
+        达到限制时下一页的结束位置为未输出完的事务的结束位置，并跳过其中已输出的语句。
+        """
+        by_transaction = self.group_rollback and not self.rollback_group_size
+        txn_lines = 0  # 当前事务已输出的语句数
+        txn_skipped = 0  # 当前事务中翻页续读时跳过的语句数
+        txn_end = self._range_end(log_file)  # 当前事务的结束位置，最后一个事务可能没有结束标记
+        stop_pending = False
+
+        for kind, sql in spool.reversed_records():
+            # 倒序读取时，事务结束标记出现在事务的语句之前
+            if kind == RECORD_TXN_END:
+                if txn_lines > 0:
+                    txn_lines = 0
+                    self.emitted_transactions += 1
+                    if by_transaction:
+                        self._close_rollback_group(callback)
+                    if stop_pending or (self.max_transactions and
+                                        self.emitted_transactions >= self.max_transactions):
+                        # 下一页从这个更早的事务开始回滚
+                        self._stop_at(log_file, int(sql) if sql else None, reverse=True)
+                        break
+                txn_skipped = 0
+                txn_end = int(sql) if sql else None
+                continue
+
+            if stop_pending and not by_transaction:
+                # 已达到限制，下一页从当前事务剩余的语句开始
+                if kind != RECORD_COMMENT:
+                    self._stop_at(log_file, txn_end, txn_skipped + txn_lines, reverse=True)
+                    break
+                continue
+
+            if kind == RECORD_COMMENT:
+                if self._skip_remaining == 0:
+                    self._write(sql, callback)
+                continue
+
+            if self._skip_remaining > 0:
+                # 上一页已输出的回滚语句
+                self._skip_remaining -= 1
+                txn_skipped += 1
+                continue
+
+            parts = None
+            if kind == RECORD_PARTS:
+                parts = unpack_parts(sql)
+                sql = parts_to_sql(parts)
+            self._emit_rollback_statement(sql, callback, parts)
+            txn_lines += 1
+
+            if self._statement_limit_hit():
+                stop_pending = True
+
+        # 事务不会跨越binlog文件，文件结束即最早的事务结束
+        if txn_lines > 0:
+            self.emitted_transactions += 1
+            if not self.limit_reached and (stop_pending or (self.max_transactions and
+                                                            self.emitted_transactions >= self.max_transactions)):
+                # 下一页从更早的文件开始；已经是第一个文件时没有下一页
+                index = self.binlogList.index(log_file)
+                if index > 0:
+                    self._stop_at(self.binlogList[index - 1], None, reverse=True)
                 else:
-                    print(start_comment.rstrip())
-
-                with open(filename, "r", encoding="utf-8", errors="ignore") as f_tmp:
-                    lines = f_tmp.readlines()
-                    sql_count = 0  # 记录SQL语句数量
-
-                    for line in reversed(lines):
-                        sql = line.rstrip()
-
-                        # 只输出非空的SQL语句，不添加单独的注释
-                        if sql and sql.strip():
-                            sql_count += 1
-                            if callback:
-                                callback(sql)
-                            else:
-                                print(sql)
-
-                    # 输出结束注释
-                    if sql_count > 0:  # 只有当有SQL语句时才输出结束注释
-                        end_comment = get_rollback_end_comment()
-                        if callback:
-                            callback("")  # 空行分隔
-                            callback(end_comment)
-                        else:
-                            print("")  # 空行分隔
-                            print(end_comment)
-            except Exception as e2:
-                logger.error(f"使用ignore模式读取临时文件也失败: {str(e2)}")
-                raise e
+                    self.limit_reached = True
+        self._close_rollback_group(callback)
+        if self._coalescer:
+            # 合并语句不跨越binlog文件，每条语句的位置注释都在同一个文件内
+            self._coalescer.flush()
+
+    def _emit_rollback_statement(self, sql, callback=None, parts=None):
+        """输出一条回滚SQL，按需打开分组或插入旧式的回滚间隔"""
+        if self.group_rollback:
+            if self._group_rows == 0:
+                self._write('BEGIN;', callback)
+            self._write(sql, callback, parts)
+            self._group_rows += 1
+            if self.rollback_group_size and self._group_rows >= self.rollback_group_size:
+                self._close_rollback_group(callback)
+        else:
+            self._write(sql, callback, parts)
+            if self._rollback_batch_counter >= 1000:
+                self._rollback_batch_counter = 0
+                if self.back_interval:
+                    self._write('SELECT SLEEP(%s);' % self.back_interval, callback)
+            else:
+                self._rollback_batch_counter += 1
+
+        self._rollback_sql_count += 1
+        self.emitted_statements += 1
+        self.emitted_rows += 1
+
+    def _close_rollback_group(self, callback=None):
+        """结束当前回滚分组，并根据限速累计等待时间"""
+        if not self.group_rollback or self._group_rows == 0:
+            return
+        self._write('COMMIT;', callback)
+
+        # 同时设置两种限速时取更严格的一个
+        wait = 0.0
+        if self.throttle_rows:
+            wait = float(self._group_rows) / self.throttle_rows
+        if self.throttle_txns:
+            wait = max(wait, 1.0 / self.throttle_txns)
+        self._throttle_seconds += wait
+        self._group_rows = 0
+
+        # 累计满1秒再输出SLEEP，避免频繁插入等待语句
+        if self._throttle_seconds >= 1:
+            self._write('SELECT SLEEP(%.2f);' % self._throttle_seconds, callback)
+            self._throttle_seconds = 0.0
 
     def test_connection(self):
         """测试数据库连接"""
@@ -694,8 +1696,8 @@ class BinlogParser(object):
             conn_settings = self.conn_setting.copy()
             if 'charset' not in conn_settings:
                 conn_settings['charset'] = 'utf8mb4'
-            connection = pymysql.connect(**conn_settings)
-            connection.close()
+            with get_pool(conn_settings).connection() as connection:
+                connection.ping(reconnect=False)
             return True, "连接成功"
         except Exception as e:
             return False, f"连接失败: {str(e)}"
@@ -703,17 +1705,20 @@ class BinlogParser(object):
     def get_binlog_files(self):
         """获取可用的binlog文件列表"""
         try:
-            with self.connection.cursor() as cursor:
-                cursor.execute("SHOW MASTER LOGS")
-                return [row[0] for row in cursor.fetchall()]
+            return server_metadata_cache.get(self.conn_setting, self.connection).binlog_files
         except Exception as e:
             raise Exception(f'获取binlog文件列表失败: {str(e)}')
 
+    def close(self):
+        """将数据库连接归还连接池"""
+        connection, self.connection = getattr(self, 'connection', None), None
+        if connection is not None and getattr(self, '_pool', None) is not None:
+            self._pool.release(connection)
+
     def __del__(self):
         """析构函数"""
         try:
-            if hasattr(self, 'connection') and self.connection:
-                self.connection.close()
+            self.close()
         except:
             # 忽略关闭连接时的错误
             pass
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pymysql
+from pymysql.protocol import MysqlPacket
+from pymysqlreplication import BinLogStreamReader
+from pymysqlreplication.binlogstream import MYSQL_EXPECTED_ERROR_CODES
+from pymysqlreplication.constants.BINLOG import TABLE_MAP_EVENT, ROTATE_EVENT, FORMAT_DESCRIPTION_EVENT
+from pymysqlreplication.event import QueryEvent, RotateEvent
+from pymysqlreplication.packet import BinLogPacketWrapper
+from .partial_json import PARTIAL_UPDATE_ROWS_EVENT, PartialUpdateRowsEvent
+from .schema_history import ddl_tables
+from .table_map_metadata import TableMapMetadataEvent
+from .transaction_payload import TRANSACTION_PAYLOAD_EVENT, TransactionPayloadEvent
+
+# pymysqlreplication未实现的事件: 事件类型 -> 事件类
+EXTRA_EVENTS = {
+    PARTIAL_UPDATE_ROWS_EVENT: PartialUpdateRowsEvent,
+    TRANSACTION_PAYLOAD_EVENT: TransactionPayloadEvent,
+}
+
+# 后台线程预先解压并拆分的载荷内事件数
+PAYLOAD_PREFETCH_EVENTS = 64
+
+# BinLogStreamReader的构造参数中，构造事件包装时需要的过滤参数及默认值
+_WRAPPER_OPTIONS = (
+    ('only_tables', None),
+    ('ignored_tables', None),
+    ('only_schemas', None),
+    ('ignored_schemas', None),
+    ('freeze_schema', False),
+    ('fail_on_table_metadata_unavailable', False),
+    ('ignore_decode_errors', False),
+    ('verify_checksum', False),
+)
+
+
+class ExtendedPacketWrapper(BinLogPacketWrapper):
+    """
+    使用扩展事件映射的BinLogPacketWrapper
+
+    事件映射是子类自己的副本，增加了额外的事件类，TABLE_MAP_EVENT替换为读取可选元数据的版本，
+    pymysqlreplication的BinLogPacketWrapper本身不受影响。
+    """
+    _BinLogPacketWrapper__event_map = dict(BinLogPacketWrapper._BinLogPacketWrapper__event_map)
+    _BinLogPacketWrapper__event_map.update(EXTRA_EVENTS)
+    _BinLogPacketWrapper__event_map[TABLE_MAP_EVENT] = TableMapMetadataEvent
+
+
+class ExtendedBinLogStreamReader(BinLogStreamReader):
+    """
+    支持额外事件类型的BinLogStreamReader
+
+    事件通过ExtendedPacketWrapper构造，额外的事件类只对本实例生效。
+    压缩的事务（TRANSACTION_PAYLOAD_EVENT）由后台线程按块解压并拆分事件，
+    与事件对象的解析重叠进行；其中的事件与普通事件一样逐个返回，位置为载荷事件的结束位置。
+    指定table_columns时（SchemaHistory或TableColumnCache），表的列定义从其中
+    按事件位置获取，不再逐表查询information_schema。
+
+    fetchone()按pymysqlreplication 0.46的实现改写，连接状态仍使用父类的私有属性，
+    依赖固定版本（见pyproject.toml）。
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.table_columns = kwargs.pop('table_columns', None)
+        self._wrapper_options = [kwargs.get(name, default) for name, default in _WRAPPER_OPTIONS]
+        super(ExtendedBinLogStreamReader, self).__init__(*args, **kwargs)
+        self._payload_events = None
+        self.payload_count = 0  # 解压的事务载荷数
+
+    def _allowed_event_list(self, only_events, ignored_events, filter_non_implemented_events):
+        events = super(ExtendedBinLogStreamReader, self)._allowed_event_list(
+            only_events, ignored_events, filter_non_implemented_events)
+        if only_events is None:
+            events = events.union(EXTRA_EVENTS.values())
+        # 表映射事件总是需要解析，否则无法解码行事件
+        self._allowed_events = events.union([TableMapMetadataEvent])
+        self._allowed_events_in_packet = self._allowed_events.union([RotateEvent])
+        return self._allowed_events
+
+    @property
+    def use_checksum(self):
+        """复制连接上的事件是否带CRC32校验和"""
+        return self._BinLogStreamReader__use_checksum
+
+    def connect_stream(self):
+        """
+        打开复制连接，之后可以直接从_stream_connection读取原始事件包
+
+        Returns:
+            bool: 事件是否带校验和
+        """
+        self._BinLogStreamReader__connect_to_stream()
+        return self.use_checksum
+
+    def _BinLogStreamReader__connect_to_ctl(self):
+        BinLogStreamReader._BinLogStreamReader__connect_to_ctl(self)
+        if self.table_columns is None:
+            return
+        fetch = self._ctl_connection._get_table_information
+
+        def get_table_information(schema, table):
+            # TableMapEvent在读取时构造，此时的位置即事件所在位置
+            return self.table_columns.columns(schema, table, self.log_file, self.log_pos, fetch)
+
+        self._ctl_connection._get_table_information = get_table_information
+
+    def _record_ddl(self, event):
+        """记录DDL的位置和语句，之后的事件使用新的表结构"""
+        schema = event.schema
+        if isinstance(schema, bytes):
+            schema = schema.decode('utf-8', 'ignore')
+        for table_schema, table in ddl_tables(event.query, schema):
+            if table_schema:
+                self.table_columns.record_ddl(table_schema, table, self.log_file, event.packet.log_pos, event.query)
+
+    def _wrap_packet(self, packet, use_checksum, verify_checksum=True):
+        """用本实例的事件映射和过滤参数构造事件"""
+        options = list(self._wrapper_options)
+        if not verify_checksum:
+            options[-1] = False
+        return ExtendedPacketWrapper(packet, self.table_map, self._ctl_connection, self.mysql_version,
+                                     use_checksum, self._allowed_events_in_packet, *options)
+
+    def fetchone(self):
+        while True:
+            if self._payload_events is not None:
+                event = next(self._payload_events, None)
+                if event is not None:
+                    return event
+                self._payload_events = None
+
+            event = self._fetch_event()
+            if self.table_columns is not None and isinstance(event, QueryEvent):
+                self._record_ddl(event)
+            if not isinstance(event, TransactionPayloadEvent):
+                return event
+            self.payload_count += 1
+            self._payload_events = self._unpack_payload(event)
+
+    def _fetch_event(self):
+        """读取下一个事件，与BinLogStreamReader.fetchone()相同，但使用ExtendedPacketWrapper构造事件"""
+        while True:
+            if self.end_log_pos and self.is_past_end_log_pos:
+                return None
+            if not self._BinLogStreamReader__connected_stream:
+                self._BinLogStreamReader__connect_to_stream()
+            if not self._BinLogStreamReader__connected_ctl:
+                self._BinLogStreamReader__connect_to_ctl()
+
+            try:
+                pkt = self._stream_connection._read_packet()
+            except pymysql.OperationalError as error:
+                code, message = error.args
+                if code in MYSQL_EXPECTED_ERROR_CODES:
+                    self._stream_connection.close()
+                    self._BinLogStreamReader__connected_stream = False
+                    continue
+                raise
+
+            if pkt.is_eof_packet():
+                self.close()
+                return None
+            if not pkt.is_ok_packet():
+                continue
+
+            binlog_event = self._wrap_packet(pkt, self.use_checksum)
+
+            if binlog_event.event_type == ROTATE_EVENT:
+                self.log_pos = binlog_event.event.position
+                self.log_file = binlog_event.event.next_binlog
+                # 表ID在服务器重启后会复用，真正的文件切换（时间戳非0）时清空表映射
+                if binlog_event.timestamp != 0:
+                    self.table_map = {}
+            elif binlog_event.log_pos:
+                self.log_pos = binlog_event.log_pos
+
+            if self.end_log_pos and self.log_pos >= self.end_log_pos:
+                self.is_past_end_log_pos = True
+
+            # 必须在RotateEvent清空table_map之后检查
+            if self.skip_to_timestamp and binlog_event.timestamp < self.skip_to_timestamp:
+                continue
+
+            if binlog_event.event_type == TABLE_MAP_EVENT and binlog_event.event is not None:
+                self.table_map[binlog_event.event.table_id] = binlog_event.event.get_table()
+
+            if binlog_event.event is None or binlog_event.event.__class__ not in self._allowed_events:
+                continue
+
+            if binlog_event.event_type == FORMAT_DESCRIPTION_EVENT:
+                self.mysql_version = binlog_event.event.mysql_version
+
+            return binlog_event.event
+
+    def close(self):
+        if self._payload_events is not None:
+            # 停止解压载荷的后台线程
+            self._payload_events.close()
+            self._payload_events = None
+        super(ExtendedBinLogStreamReader, self).close()
+
+    def _unpack_payload(self, payload_event):
+        """逐个解析载荷中的事件，处理方式与_fetch_event中的普通事件相同"""
+        for data in payload_event.embedded_events(PAYLOAD_PREFETCH_EVENTS):
+            # 载荷中的事件没有校验和，前面补一个OK字节以符合网络包格式
+            packet = MysqlPacket(b'\x00' + data, self._ctl_connection.encoding)
+            binlog_event = self._wrap_packet(packet, False, verify_checksum=False)
+            # 载荷中的事件没有独立的位置，使用载荷事件的结束位置
+            binlog_event.log_pos = payload_event.packet.log_pos
+
+            if binlog_event.event_type == TABLE_MAP_EVENT and binlog_event.event is not None:
+                self.table_map[binlog_event.event.table_id] = binlog_event.event.get_table()
+
+            if binlog_event.event is None or binlog_event.event.__class__ not in self._allowed_events:
+                continue
+            yield binlog_event.event
+
+
+def open_dump_connection(connection_settings, server_id, log_file, log_pos):
+    """
+    打开复制连接读取原始事件包，不解析事件
+
+    Returns:
+        tuple: (连接, 事件是否带校验和, 关闭函数)
+    """
+    reader = ExtendedBinLogStreamReader(connection_settings=connection_settings, server_id=server_id,
+                                        log_file=log_file, log_pos=log_pos, resume_stream=True, blocking=False)
+    try:
+        checksum = reader.connect_stream()
+    except Exception:
+        reader.close()
+        raise
+    return reader._stream_connection, checksum, reader.close
@@ -5,6 +5,7 @@ import os
 import sys
 import datetime
 from contextlib import contextmanager
+from pymysqlreplication.bitmap import BitGet
 from pymysqlreplication.event import QueryEvent
 from pymysqlreplication.row_event import (
     WriteRowsEvent,
@@ -17,6 +18,9 @@ if sys.version > '3':
 else:
     PY3PLUS = False
 
+# pymysqlreplication为无法对应到表结构的列生成的占位列名前缀（__dropped_col_N__）
+UNKNOWN_COLUMN_PREFIX = '__dropped_col_'
+
 
 def is_valid_datetime(string):
     """验证日期时间格式是否正确"""
@@ -123,8 +127,65 @@ def event_type(event):
     return t
 
 
-def concat_sql_from_binlog_event(cursor, binlog_event, row=None, e_start_pos=None, flashback=False, no_pk=False):
-    """从binlog事件生成SQL语句"""
+def render_sql(cursor, pattern):
+    """用游标转义SQL模板中的值，返回字符串"""
+    sql = ''
+    try:
+        sql = cursor.mogrify(pattern['template'], pattern['values'])
+        # 确保SQL是字符串类型，处理可能的bytes返回值
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', 'ignore')
+    except UnicodeDecodeError:
+        # 如果解码失败，使用ignore模式重试
+        if isinstance(sql, bytes):
+            sql = sql.decode('utf-8', 'ignore')
+        else:
+            # 如果不是bytes类型，转换为字符串
+            sql = str(sql)
+    return sql
+
+
+def position_comment(start_pos, end_pos, timestamp):
+    """生成SQL末尾的位置注释"""
+    time = datetime.datetime.fromtimestamp(timestamp)
+    return ' #start %s end %s time %s' % (start_pos, end_pos, time)
+
+
+def rows_query_text(binlog_event):
+    """
+    获取Rows_query事件中的原始语句
+
+    语句长度只用1个字节记录，超过255字节时实际语句仍完整写在事件中，
+    pymysqlreplication只读取了前面的部分，这里读取剩余的字节补全。
+    """
+    query = binlog_event.query
+    if getattr(binlog_event, '_query_completed', False):
+        return query
+    binlog_event._query_completed = True
+    try:
+        remaining = binlog_event.event_size - 1 - binlog_event.query_length
+        if remaining > 0:
+            data = query.encode('utf-8') + binlog_event.packet.read(remaining)
+            query = data.decode('utf-8', 'ignore')
+    except Exception:
+        pass
+    binlog_event.query = query
+    return query
+
+
+def rows_query_comment(query):
+    """将原始语句格式化为SQL注释"""
+    return '-- 原始语句: %s' % query.strip().replace('\n', '\n-- ')
+
+
+def concat_sql_from_binlog_event(cursor, binlog_event, row=None, e_start_pos=None, flashback=False, no_pk=False,
+                                 key_columns=None, changed_only=False):
+    """
+    从binlog事件生成SQL语句
+
+    key_columns为定位行的键列，为空时按整行匹配；
+    changed_only时UPDATE只SET值有变化的列，没有变化的UPDATE返回空字符串。
+    """
     if flashback and no_pk:
         raise ValueError('only one of flashback or no_pk can be True')
 
@@ -135,21 +196,12 @@ def concat_sql_from_binlog_event(cursor, binlog_event, row=None, e_start_pos=Non
     sql = ''
     if isinstance(binlog_event, WriteRowsEvent) or isinstance(binlog_event, UpdateRowsEvent) \
             or isinstance(binlog_event, DeleteRowsEvent):
-        pattern = generate_sql_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk)
-        try:
-            sql = cursor.mogrify(pattern['template'], pattern['values'])
-            # 确保SQL是字符串类型，处理可能的bytes返回值
-            if isinstance(sql, bytes):
-                sql = sql.decode('utf-8', 'ignore')
-        except UnicodeDecodeError:
-            # 如果解码失败，使用ignore模式重试
-            if isinstance(sql, bytes):
-                sql = sql.decode('utf-8', 'ignore')
-            else:
-                # 如果不是bytes类型，转换为字符串
-                sql = str(sql)
-        time = datetime.datetime.fromtimestamp(binlog_event.timestamp)
-        sql += ' #start %s end %s time %s' % (e_start_pos, binlog_event.packet.log_pos, time)
+        pattern = generate_sql_pattern(binlog_event, row=row, flashback=flashback, no_pk=no_pk,
+                                       key_columns=key_columns, changed_only=changed_only)
+        if not pattern['template']:
+            return ''
+        sql = render_sql(cursor, pattern)
+        sql += position_comment(e_start_pos, binlog_event.packet.log_pos, binlog_event.timestamp)
 
     elif flashback is False and isinstance(binlog_event, QueryEvent) and binlog_event.query != 'BEGIN' \
             and binlog_event.query != 'COMMIT':
@@ -162,72 +214,305 @@ def concat_sql_from_binlog_event(cursor, binlog_event, row=None, e_start_pos=Non
     return sql
 
 
-def generate_sql_pattern(binlog_event, row=None, flashback=False, no_pk=False):
-    """生成SQL模板和值"""
+def is_expression(value):
+    """列值是否为需要生成SQL表达式的局部更新（如JSON diff）"""
+    return hasattr(value, 'sql_expression')
+
+
+def key_where_values(where_values, key_columns):
+    """
+    只保留WHERE条件中的键列
+
+    Returns:
+        dict: 键列的值；没有键列、或键值缺失或为NULL时返回None，此时应按整行匹配
+    """
+    if not key_columns or not where_values:
+        return None
+    if any(where_values.get(col) is None for col in key_columns):
+        return None
+    return dict((col, where_values[col]) for col in key_columns)
+
+
+def changed_values(set_values, where_values):
+    """只保留与原值不同的列"""
+    missing = object()
+    return dict((k, v) for k, v in set_values.items() if where_values.get(k, missing) != v)
+
+
+def compose_sql_pattern(kind, schema, table, values=None, set_values=None, where_values=None, key_columns=None,
+                        changed_only=False):
+    """
+    生成单行SQL模板和值
+
+    Args:
+        kind: 'INSERT'、'DELETE' 或 'UPDATE'
+        schema: 数据库名
+        table: 表名
+        values: INSERT的列值
+        set_values: UPDATE的SET列值
+        where_values: DELETE/UPDATE的WHERE条件列值
+        key_columns: 主键或非空唯一索引的列，WHERE只使用这些列；为空时按整行匹配并加LIMIT 1
+        changed_only: UPDATE只SET值有变化的列，所有列都没有变化时返回空模板
+    """
+    schema = fix_object(schema)
+    table = fix_object(table)
     template = ''
-    values = []
+    params = []
+    limit = ' LIMIT 1'
+    if kind == 'UPDATE' and changed_only:
+        set_values = changed_values(set_values or {}, where_values or {})
+        if not set_values:
+            return {'template': '', 'values': []}
+    if kind in ('DELETE', 'UPDATE'):
+        key_values = key_where_values(where_values, key_columns)
+        if key_values is not None:
+            where_values, limit = key_values, ''
+
+    if kind == 'INSERT':
+        values = values or {}
+        template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
+            schema, table,
+            ', '.join(map(lambda key: '`%s`' % fix_object(key), values.keys())),
+            ', '.join(['%s'] * len(values))
+        )
+        params = list(values.values())
+    elif kind == 'DELETE':
+        where_values = where_values or {}
+        template = 'DELETE FROM `{0}`.`{1}` WHERE {2}{3};'.format(
+            schema, table,
+            ' AND '.join(map(compare_items, where_values.items())), limit
+        )
+        params = list(where_values.values())
+    elif kind == 'UPDATE':
+        set_values = set_values or {}
+        # 局部更新的列没有完整的值，不能作为WHERE条件
+        where_values = dict((k, v) for k, v in (where_values or {}).items() if not is_expression(v))
+        set_items = []
+        for k, v in set_values.items():
+            column = '`%s`' % fix_object(k)
+            if is_expression(v):
+                expression, expression_params = v.sql_expression(column)
+                set_items.append('%s=%s' % (column, expression))
+                params.extend(expression_params)
+            else:
+                set_items.append('%s=%%s' % column)
+                params.append(v)
+        template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3}{4};'.format(
+            schema, table,
+            ', '.join(set_items),
+            ' AND '.join(map(compare_items, where_values.items())), limit
+        )
+        params += list(where_values.values())
+
+    return {'template': template, 'values': list(map(fix_object, params))}
+
 
+def row_change_args(binlog_event, row=None, flashback=False, no_pk=False):
+    """
+    获取一行变更对应的语句类型和列值
+
+    Returns:
+        dict: kind, values, set_values, where_values，事件类型不支持时返回None
+    """
     # 确保row不为None并且有正确的结构
     if row is None:
         row = {'values': {}, 'before_values': {}, 'after_values': {}}
 
-    # 处理schema和table可能是bytes类型的情况
-    schema = fix_object(binlog_event.schema)
-    table = fix_object(binlog_event.table)
-
     if flashback is True:
         if isinstance(binlog_event, WriteRowsEvent):
-            row_values = row.get('values', {})
-            template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
-                schema, table,
-                ' AND '.join(map(compare_items, row_values.items()))
-            )
-            values = map(fix_object, row_values.values())
+            return {'kind': 'DELETE', 'where_values': row.get('values', {})}
         elif isinstance(binlog_event, DeleteRowsEvent):
-            row_values = row.get('values', {})
-            template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
-                schema, table,
-                ', '.join(map(lambda key: '`%s`' % fix_object(key), row_values.keys())),
-                ', '.join(['%s'] * len(row_values))
-            )
-            values = map(fix_object, row_values.values())
+            return {'kind': 'INSERT', 'values': row.get('values', {})}
         elif isinstance(binlog_event, UpdateRowsEvent):
-            before_values = row.get('before_values', {})
-            after_values = row.get('after_values', {})
-            template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
-                schema, table,
-                ', '.join(['`%s`=%%s' % fix_object(x) for x in before_values.keys()]),
-                ' AND '.join(map(compare_items, after_values.items())))
-            values = map(fix_object, list(before_values.values())+list(after_values.values()))
+            before, after = row.get('before_values', {}), row.get('after_values', {})
+            # 不完整的镜像中，后镜像只包含被修改的列，未修改的列（如主键）取前镜像的值
+            return {'kind': 'UPDATE',
+                    'set_values': dict((k, v) for k, v in before.items() if k in after) or before,
+                    'where_values': dict(before, **after)}
     else:
         if isinstance(binlog_event, WriteRowsEvent):
             row_values = row.get('values', {})
             if no_pk:
                 if hasattr(binlog_event, 'primary_key') and binlog_event.primary_key:
                     row_values.pop(binlog_event.primary_key, None)
-            template = 'INSERT INTO `{0}`.`{1}`({2}) VALUES ({3});'.format(
-                schema, table,
-                ', '.join(map(lambda key: '`%s`' % fix_object(key), row_values.keys())),
-                ', '.join(['%s'] * len(row_values))
-            )
-            values = map(fix_object, row_values.values())
+            return {'kind': 'INSERT', 'values': row_values}
         elif isinstance(binlog_event, DeleteRowsEvent):
-            row_values = row.get('values', {})
-            template = 'DELETE FROM `{0}`.`{1}` WHERE {2} LIMIT 1;'.format(
-                schema, table,
-                ' AND '.join(map(compare_items, row_values.items())))
-            values = map(fix_object, row_values.values())
+            return {'kind': 'DELETE', 'where_values': row.get('values', {})}
         elif isinstance(binlog_event, UpdateRowsEvent):
-            before_values = row.get('before_values', {})
-            after_values = row.get('after_values', {})
-            template = 'UPDATE `{0}`.`{1}` SET {2} WHERE {3} LIMIT 1;'.format(
-                schema, table,
-                ', '.join(['`%s`=%%s' % fix_object(k) for k in after_values.keys()]),
-                ' AND '.join(map(compare_items, before_values.items()))
-            )
-            values = map(fix_object, list(after_values.values())+list(before_values.values()))
-
-    return {'template': template, 'values': list(values)}
+            return {'kind': 'UPDATE', 'set_values': row.get('after_values', {}),
+                    'where_values': row.get('before_values', {})}
+    return None
+
+
+def unknown_columns(binlog_event):
+    """行事件中只有占位列名的列：解码时表结构未知，或表结构与事件中的列不一致"""
+    return [column.name for column in getattr(binlog_event, 'columns', None) or ()
+            if str(column.name).startswith(UNKNOWN_COLUMN_PREFIX)]
+
+
+def absent_columns(binlog_event, bitmap):
+    """根据列存在位图获取行镜像中缺失的列名"""
+    columns = getattr(binlog_event, 'columns', None)
+    if not bitmap or not columns:
+        return frozenset()
+    return frozenset(fix_object(column.name) for i, column in enumerate(columns)
+                     if i < len(bitmap) * 8 and not BitGet(bitmap, i))
+
+
+def row_image_absent_columns(binlog_event):
+    """
+    获取事件中前镜像和后镜像缺失的列（binlog_row_image为MINIMAL或NOBLOB时）
+
+    缺失的列在行数据中的值为None，与NULL无法区分，需要根据位图去掉。
+
+    Returns:
+        tuple: (前镜像缺失的列, 后镜像缺失的列)，完整镜像时都为空集合
+    """
+    bitmap = getattr(binlog_event, 'columns_present_bitmap', None)
+    if isinstance(binlog_event, UpdateRowsEvent):
+        return (absent_columns(binlog_event, bitmap),
+                absent_columns(binlog_event, getattr(binlog_event, 'columns_present_bitmap2', None)))
+    if isinstance(binlog_event, WriteRowsEvent):
+        return frozenset(), absent_columns(binlog_event, bitmap)
+    return absent_columns(binlog_event, bitmap), frozenset()
+
+
+def prune_row_image(row, before_absent, after_absent):
+    """去掉行数据中缺失的列，返回新的行数据"""
+    pruned = dict(row)
+    if 'before_values' in row:
+        pruned['before_values'] = dict((k, v) for k, v in row['before_values'].items() if k not in before_absent)
+        pruned['after_values'] = dict((k, v) for k, v in row['after_values'].items() if k not in after_absent)
+    else:
+        absent = before_absent or after_absent
+        pruned['values'] = dict((k, v) for k, v in row.get('values', {}).items() if k not in absent)
+    return pruned
+
+
+def row_image_gap(binlog_event, row, flashback, before_absent, after_absent, key_columns=None):
+    """
+    检查不完整的行镜像能否生成正确的SQL
+
+    Args:
+        row: 已去掉缺失列的行数据
+        key_columns: 定位行的键列
+
+    Returns:
+        str: 无法正确生成时的原因，可以生成时返回None
+    """
+    diff_columns = [k for k, v in row.get('after_values', {}).items() if is_expression(v)]
+    if not before_absent and not after_absent and not diff_columns:
+        return None
+
+    def where_gap(where_values, partial):
+        if not partial or key_where_values(where_values, key_columns) is not None:
+            return None
+        return 'WHERE条件不完整且没有可用的键'
+
+    if isinstance(binlog_event, WriteRowsEvent):
+        return where_gap(row.get('values', {}), True) if flashback else None
+    if isinstance(binlog_event, DeleteRowsEvent):
+        if flashback:
+            return '前镜像不完整，缺少列 %s' % ', '.join(sorted(before_absent))
+        return where_gap(row.get('values', {}), True)
+    if isinstance(binlog_event, UpdateRowsEvent):
+        before, after = row.get('before_values', {}), row.get('after_values', {})
+        if not flashback:
+            return where_gap(before, bool(before_absent))
+        missing = [k for k in after if k not in before]
+        if missing:
+            return '前镜像缺少被修改的列 %s' % ', '.join(sorted(missing))
+        return where_gap(dict(before, **after), bool(before_absent & after_absent) or bool(diff_columns))
+    return None
+
+
+def generate_sql_pattern(binlog_event, row=None, flashback=False, no_pk=False, key_columns=None, changed_only=False):
+    """生成SQL模板和值"""
+    args = row_change_args(binlog_event, row=row, flashback=flashback, no_pk=no_pk)
+    if not args:
+        return {'template': '', 'values': []}
+    return compose_sql_pattern(schema=binlog_event.schema, table=binlog_event.table, key_columns=key_columns,
+                               changed_only=changed_only, **args)
+
+
+def net_change_args(before, after, primary_key=None, no_pk=False):
+    """
+    根据一行的起始状态和最终状态获取净变化的语句类型和列值
+
+    Args:
+        before: 起始行值，None表示该行原本不存在
+        after: 最终行值，None表示该行最终不存在
+        primary_key: 主键列名（字符串或元组），用于no_pk
+        no_pk: 生成不包含主键的insert语句
+
+    Returns:
+        dict或None: 起始状态与最终状态相同时返回None
+    """
+    if before is None and after is None:
+        return None
+    if before is None:
+        values = dict(after)
+        if no_pk and primary_key:
+            for key in (primary_key if isinstance(primary_key, (tuple, list)) else (primary_key,)):
+                values.pop(key, None)
+        return {'kind': 'INSERT', 'values': values}
+    if after is None:
+        return {'kind': 'DELETE', 'where_values': before}
+    if before == after:
+        return None
+    return {'kind': 'UPDATE', 'set_values': after, 'where_values': before}
+
+
+def generate_net_sql_pattern(schema, table, before, after, primary_key=None, no_pk=False, key_columns=None,
+                             changed_only=False):
+    """根据一行的起始状态和最终状态生成净变化SQL模板，状态相同时返回None"""
+    args = net_change_args(before, after, primary_key=primary_key, no_pk=no_pk)
+    if not args:
+        return None
+    return compose_sql_pattern(schema=schema, table=table, key_columns=key_columns, changed_only=changed_only,
+                               **args)
+
+
+def compose_batch_parts(kind, schema, table, values=None, set_values=None, where_values=None, primary_key=None):
+    """
+    生成可合并语句的前缀、单行片段模板和后缀
+
+    INSERT合并为多值INSERT，按主键的DELETE合并为 WHERE pk IN (...)。
+    单行时 前缀 + 片段 + 后缀 本身就是一条完整的语句。
+
+    Returns:
+        dict: prefix, template, values, suffix；语句不可合并时返回None
+    """
+    schema = fix_object(schema)
+    table = fix_object(table)
+
+    if kind == 'INSERT' and values:
+        return {
+            'prefix': 'INSERT INTO `{0}`.`{1}`({2}) VALUES '.format(
+                schema, table, ', '.join(map(lambda key: '`%s`' % fix_object(key), values.keys()))),
+            'template': '({0})'.format(', '.join(['%s'] * len(values))),
+            'values': list(map(fix_object, values.values())),
+            'suffix': ';'
+        }
+
+    if kind == 'DELETE' and where_values and primary_key:
+        pk_columns = primary_key if isinstance(primary_key, (tuple, list)) else (primary_key,)
+        if key_where_values(where_values, pk_columns) is None:
+            return None
+        pk_values = [fix_object(where_values[col]) for col in pk_columns]
+        if len(pk_columns) == 1:
+            column_list, template = '`%s`' % fix_object(pk_columns[0]), '%s'
+        else:
+            column_list = '({0})'.format(', '.join('`%s`' % fix_object(col) for col in pk_columns))
+            template = '({0})'.format(', '.join(['%s'] * len(pk_columns)))
+        return {
+            'prefix': 'DELETE FROM `{0}`.`{1}` WHERE {2} IN ('.format(schema, table, column_list),
+            'template': template,
+            'values': pk_values,
+            'suffix': ');'
+        }
+
+    return None
 
 
 def reversed_lines(fin):
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+from .binlog_util import create_unique_file
+from .value_codec import dumps, loads
+from .logger import get_logger
+
+# 获取logger实例
+logger = get_logger("ChangeCompactor")
+
+# 状态字段下标
+FIRST_SEQ, LAST_SEQ, BEFORE, AFTER, START_POS, END_POS, TIMESTAMP, COUNT, SCHEMA, TABLE, PRIMARY_KEY = range(11)
+
+
+def primary_key_columns(primary_key):
+    """将主键定义统一为列名元组"""
+    if not primary_key:
+        return ()
+    if isinstance(primary_key, (tuple, list)):
+        return tuple(primary_key)
+    return (primary_key,)
+
+
+class ChangeCompactor(object):
+    """
+    按主键合并行变更，只保留窗口内每行的净变化
+
+    每行记录窗口内最早的前镜像和最后的后镜像，None表示该行不存在。
+    状态数量超过上限时溢出到磁盘上的SQLite文件，最终按首次出现的顺序输出。
+    没有主键的表无法合并，每行变更单独保留。
+    """
+
+    def __init__(self, spill_dir=None, max_keys=500000):
+        """
+        初始化合并器
+
+        Args:
+            spill_dir: 溢出文件目录，默认为当前工作目录
+            max_keys: 内存中最多保留的行状态数
+        """
+        self.spill_dir = spill_dir
+        self.max_keys = max_keys
+        self._states = {}
+        self._seq = 0
+        self._db = None
+        self._db_file = None
+        self.row_changes = 0  # 输入的行变更数
+
+    def add(self, schema, table, primary_key, before, after, start_pos, end_pos, timestamp):
+        """
+        添加一行变更
+
+        Args:
+            primary_key: 主键列名（字符串或元组），None表示没有主键
+            before: 前镜像，INSERT时为None
+            after: 后镜像，DELETE时为None
+        """
+        self.row_changes += 1
+        pk_columns = primary_key_columns(primary_key)
+        image = before if before is not None else after
+        if not pk_columns or any(col not in image for col in pk_columns):
+            self._merge(('#', self._seq), schema, table, primary_key, before, after, start_pos, end_pos, timestamp)
+            return
+
+        before_key = tuple(before[col] for col in pk_columns) if before is not None else None
+        after_key = tuple(after[col] for col in pk_columns) if after is not None else None
+        if before is not None and after is not None and before_key != after_key:
+            # 主键被修改，拆分为旧主键的删除和新主键的插入
+            self._merge((schema, table, before_key), schema, table, primary_key, before, None,
+                        start_pos, end_pos, timestamp)
+            self._merge((schema, table, after_key), schema, table, primary_key, None, after,
+                        start_pos, end_pos, timestamp)
+        else:
+            self._merge((schema, table, before_key or after_key), schema, table, primary_key, before, after,
+                        start_pos, end_pos, timestamp)
+
+    def _merge(self, key, schema, table, primary_key, before, after, start_pos, end_pos, timestamp):
+        """合并到内存中的行状态"""
+        self._seq += 1
+        state = self._states.get(key)
+        if state is None:
+            self._states[key] = [self._seq, self._seq, before, after, start_pos, end_pos, timestamp, 1,
+                                 schema, table, primary_key]
+            if len(self._states) >= self.max_keys:
+                self._spill()
+        else:
+            state[LAST_SEQ] = self._seq
+            state[AFTER] = after
+            state[END_POS] = end_pos
+            state[TIMESTAMP] = timestamp
+            state[COUNT] += 1
+
+    def _open_db(self):
+        """创建溢出文件"""
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        self._db_file = create_unique_file(os.path.join(self.spill_dir or '', 'binlog_compact.db'))
+        self._db = sqlite3.connect(self._db_file)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE changes (k TEXT PRIMARY KEY, seq INTEGER, state TEXT)')
+        self._db.execute('CREATE INDEX changes_seq ON changes (seq)')
+        logger.info(f"行状态超过 {self.max_keys}，溢出到磁盘: {self._db_file}")
+
+    def _spill(self):
+        """将内存中的行状态合并写入溢出文件"""
+        if self._db is None:
+            self._open_db()
+        cursor = self._db.cursor()
+        for key, state in self._states.items():
+            k = dumps(key)
+            row = cursor.execute('SELECT state FROM changes WHERE k = ?', (k,)).fetchone()
+            if row:
+                # 磁盘中的状态总是更早，保留其前镜像，使用内存中的后镜像
+                old = loads(row[0])
+                old[LAST_SEQ] = state[LAST_SEQ]
+                old[AFTER] = state[AFTER]
+                old[END_POS] = state[END_POS]
+                old[TIMESTAMP] = state[TIMESTAMP]
+                old[COUNT] += state[COUNT]
+                state = old
+            cursor.execute('INSERT OR REPLACE INTO changes (k, seq, state) VALUES (?, ?, ?)',
+                           (k, state[FIRST_SEQ], dumps(state)))
+        self._db.commit()
+        self._states = {}
+
+    def __len__(self):
+        """当前行状态数（溢出后为近似值）"""
+        if self._db is None:
+            return len(self._states)
+        return self._db.execute('SELECT COUNT(*) FROM changes').fetchone()[0] + len(self._states)
+
+    def changes(self, reverse=False):
+        """
+        按首次出现的顺序生成每行的净变化
+
+        Args:
+            reverse: 是否倒序输出（用于回滚）
+
+        Yields:
+            dict: schema, table, primary_key, before, after, start_pos, end_pos, timestamp, count
+        """
+        if self._db is not None:
+            self._spill()
+            order = 'DESC' if reverse else 'ASC'
+            states = (loads(row[0]) for row in
+                      self._db.execute('SELECT state FROM changes ORDER BY seq %s' % order))
+        else:
+            states = sorted(self._states.values(), key=lambda s: s[FIRST_SEQ], reverse=reverse)
+
+        for state in states:
+            yield {
+                'schema': state[SCHEMA],
+                'table': state[TABLE],
+                'primary_key': state[PRIMARY_KEY],
+                'before': state[BEFORE],
+                'after': state[AFTER],
+                'start_pos': state[START_POS],
+                'end_pos': state[END_POS],
+                'timestamp': state[TIMESTAMP],
+                'count': state[COUNT],
+            }
+
+    def close(self):
+        """释放内存和溢出文件"""
+        self._states = {}
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._db_file and os.path.exists(self._db_file):
+            try:
+                os.remove(self._db_file)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
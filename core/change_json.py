@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import base64
+import decimal
+import datetime
+from pymysqlreplication.constants import FIELD_TYPE
+from .logger import get_logger
+
+# 获取logger实例
+logger = get_logger("ChangeJson")
+
+# 列类型编号 -> 名称（同一编号有多个名称时取先定义的）
+FIELD_TYPE_NAMES = {}
+for _name, _value in vars(FIELD_TYPE).items():
+    if _name.isupper() and isinstance(_value, int):
+        FIELD_TYPE_NAMES.setdefault(_value, _name)
+
+_SEPARATORS = (',', ':')
+
+
+def _time_text(delta):
+    """TIME列的值（timedelta）按MySQL的格式输出，可以超过24小时或为负数"""
+    sign = '-' if delta < datetime.timedelta(0) else ''
+    delta = abs(delta)
+    seconds = delta.days * 86400 + delta.seconds
+    text = '%s%02d:%02d:%02d' % (sign, seconds // 3600, seconds // 60 % 60, seconds % 60)
+    if delta.microseconds:
+        text += '.%06d' % delta.microseconds
+    return text
+
+
+def _json_default(value):
+    """JSON没有对应类型的值：DECIMAL保留精度输出为字符串，时间为ISO格式，二进制为base64，SET为列表"""
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return _time_text(value)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+
+def _json_value(value):
+    """递归转换，用于JSON列中出现非字符串键等json无法直接处理的值"""
+    if isinstance(value, dict):
+        return dict((k.decode('utf-8', 'ignore') if isinstance(k, bytes) else str(k), _json_value(v))
+                    for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return _json_default(value)
+
+
+def column_names(binlog_event):
+    """行事件中表的列名"""
+    return tuple(column.name.decode('utf-8', 'ignore') if isinstance(column.name, bytes) else column.name
+                 for column in getattr(binlog_event, 'columns', None) or ())
+
+
+def row_images(kind, row):
+    """
+    行变更的前镜像和后镜像
+
+    Returns:
+        tuple: (before, after)，INSERT没有前镜像，DELETE没有后镜像，为None
+    """
+    if kind == 'UPDATE':
+        return row.get('before_values', {}), row.get('after_values', {})
+    if kind == 'INSERT':
+        return None, row.get('values', {})
+    return row.get('values', {}), None
+
+
+def dumps(record):
+    """将一条记录编码为一行JSON"""
+    try:
+        return json.dumps(record, ensure_ascii=False, separators=_SEPARATORS, default=_json_default)
+    except (TypeError, ValueError):
+        return json.dumps(_json_value(record), ensure_ascii=False, separators=_SEPARATORS)
+
+
+class JsonChangeWriter(object):
+    """
+    按JSON Lines输出行变更，每行一个JSON对象
+
+    每张表第一次输出行变更前输出一条表头记录（type为table），包含列名、列类型和键列，
+    列定义变化（DDL之后）时重新输出；行变更记录中的before/after/pk为按表头列顺序排列的数组。
+    值保留原有类型：整数、浮点数、字符串和NULL直接输出，DECIMAL输出为字符串以保留精度，
+    时间类型为ISO格式，二进制为base64。
+    行变更在事务提交时才知道xid，因此一个事务的记录先编码缓存，提交时补上xid后输出。
+    """
+
+    def __init__(self, emit):
+        """
+        Args:
+            emit: 输出一行的函数
+        """
+        self.emit = emit
+        self.gtid = None
+        self.rows = 0          # 输出的行变更数
+        self.transactions = 0  # 输出的事务数
+        self._headers = {}     # (库名, 表名) -> 已输出的表头
+        self._pending = []     # 当前事务的 (行, 是否需要补xid)
+
+    @staticmethod
+    def table_header(binlog_event, key_columns):
+        """
+        表的列定义
+
+        Returns:
+            tuple: (列名, 列类型名, 键列)
+        """
+        types = tuple(FIELD_TYPE_NAMES.get(getattr(column, 'type', None))
+                      for column in getattr(binlog_event, 'columns', None) or ())
+        return column_names(binlog_event), types, tuple(key_columns or ())
+
+    def encode_row(self, binlog_event, kind, row, header, log_file, start_pos, absent=None):
+        """
+        编码一行变更，不含xid
+
+        Args:
+            kind: INSERT、UPDATE或DELETE
+            header: table_header()的结果
+            start_pos: 事务的起始位置
+            absent: (前镜像缺失的列, 后镜像缺失的列)，binlog_row_image不是FULL时
+        """
+        names, _, key_columns = header
+        record = {'type': kind.lower(), 'schema': binlog_event.schema, 'table': binlog_event.table}
+        before, after = row_images(kind, row)
+        if before is not None:
+            record['before'] = [before.get(name) for name in names]
+        if after is not None:
+            record['after'] = [after.get(name) for name in names]
+        if key_columns:
+            image = after if before is None else before
+            record['pk'] = [image.get(name) for name in key_columns]
+        if absent and (absent[0] or absent[1]):
+            # 缺失的列在数组中为null，单独列出以便与NULL区分
+            record['absent'] = {'before': sorted(absent[0]), 'after': sorted(absent[1])}
+        record.update(timestamp=binlog_event.timestamp, file=log_file, pos=start_pos,
+                      end=binlog_event.packet.log_pos, gtid=self.gtid)
+        return dumps(record)
+
+    def add_row(self, schema, table, header, line):
+        """加入一行已编码的变更，表头变化时先输出表头"""
+        key = (schema, table)
+        if self._headers.get(key) != header:
+            self._headers[key] = header
+            names, types, key_columns = header
+            self._pending.append((dumps({'type': 'table', 'schema': schema, 'table': table, 'columns': names,
+                                         'types': types, 'pk': key_columns}), False))
+        self._pending.append((line, True))
+        self.rows += 1
+
+    def add_ddl(self, binlog_event, log_file, start_pos):
+        """输出一条DDL，DDL自成一个事务"""
+        self.flush()
+        self.emit(dumps({'type': 'ddl', 'schema': binlog_event.schema, 'query': binlog_event.query,
+                         'timestamp': binlog_event.timestamp, 'file': log_file, 'pos': start_pos,
+                         'end': binlog_event.packet.log_pos, 'gtid': self.gtid}))
+        self.transactions += 1
+        self.gtid = None
+
+    def commit(self, xid=None):
+        """事务提交，补上xid后输出缓存的记录"""
+        if any(with_xid for _, with_xid in self._pending):
+            self.transactions += 1
+        self.flush(xid)
+        self.gtid = None
+
+    def flush(self, xid=None):
+        """输出缓存的记录，未提交时xid为null"""
+        suffix = ',"xid":%s}' % json.dumps(xid)
+        for line, with_xid in self._pending:
+            self.emit(line[:-1] + suffix if with_xid else line)
+        self._pending = []
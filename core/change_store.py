@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import array
+import bisect
+import datetime
+from collections import Counter
+from .change_json import row_images, dumps
+from .logger import get_logger
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+# 获取logger实例
+logger = get_logger("ChangeStore")
+
+CHANGE_TYPES = ('INSERT', 'UPDATE', 'DELETE')
+_TYPE_CODES = dict((name, code) for code, name in enumerate(CHANGE_TYPES))
+
+# 每个字段一个数组: 字段名 -> (array类型码, numpy类型)
+FIELDS = (
+    ('table_id', 'I', 'uint32'),
+    ('type', 'B', 'uint8'),
+    ('timestamp', 'q', 'int64'),
+    ('file_id', 'I', 'uint32'),
+    ('start_pos', 'q', 'int64'),
+    ('end_pos', 'q', 'int64'),
+    ('block_id', 'I', 'uint32'),
+    ('block_row', 'I', 'uint32'),
+)
+GROUP_FIELDS = ('table', 'type', 'file', 'time')
+EXPORT_COLUMNS = ('schema', 'table', 'type', 'time', 'file', 'start_pos', 'end_pos', 'pk', 'before', 'after')
+
+
+def numpy_available():
+    """是否可以使用NumPy进行向量化过滤和分组"""
+    return numpy is not None
+
+
+def arrow_available():
+    """是否可以导出Arrow IPC文件"""
+    return pyarrow is not None
+
+
+class _Column(object):
+    """
+    一列值
+
+    全部为整数或浮点数时保存在array中，每个值8字节，NULL用另外的字节掩码标记；
+    出现其他类型的值后转为列表。
+    """
+
+    __slots__ = ('values', 'nulls')
+
+    def __init__(self):
+        self.values = None
+        self.nulls = None
+
+    def append(self, value):
+        values = self.values
+        if values is None:
+            values = self.values = array.array('d' if type(value) is float else 'q')
+        if isinstance(values, list):
+            values.append(value)
+            return
+        if value is None:
+            if self.nulls is None:
+                self.nulls = bytearray(len(values))
+            values.append(0)
+            self.nulls.append(1)
+            return
+        if type(value) is float and values.typecode == 'q' and len(self.nulls or ()) == len(values) and \
+                all(self.nulls or ()):
+            # 之前的值全部为NULL，改为浮点数列
+            values = self.values = array.array('d', values)
+        try:
+            if type(value) is not (int if values.typecode == 'q' else float):
+                raise TypeError
+            values.append(value)
+        except (TypeError, OverflowError):
+            self._to_list()
+            self.values.append(value)
+            return
+        if self.nulls is not None:
+            self.nulls.append(0)
+
+    def _to_list(self):
+        nulls = self.nulls
+        self.values = [None if nulls is not None and nulls[i] else value for i, value in enumerate(self.values)]
+        self.nulls = None
+
+    def __getitem__(self, index):
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        return self.values[index]
+
+    def nbytes(self):
+        if isinstance(self.values, array.array):
+            size = self.values.itemsize * len(self.values)
+        else:
+            size = 8 * len(self.values or ())
+        return size + len(self.nulls or ())
+
+
+class _Image(object):
+    """一个列块中的前镜像或后镜像，只保存有该镜像的行"""
+
+    __slots__ = ('rows', 'columns')
+
+    def __init__(self, width):
+        self.rows = array.array('I')  # 块内的行号，递增
+        self.columns = [_Column() for _ in range(width)]
+
+    def append(self, block_row, names, values):
+        self.rows.append(block_row)
+        for column, name in zip(self.columns, names):
+            column.append(values.get(name))
+
+    def get(self, block_row, names):
+        i = bisect.bisect_left(self.rows, block_row)
+        if i == len(self.rows) or self.rows[i] != block_row:
+            return None
+        return [column[i] for column in self.columns]
+
+
+class _ColumnBlock(object):
+    """一张表在一种列定义下的行数据，按列保存"""
+
+    __slots__ = ('table_id', 'names', 'key_columns', 'rows', 'pk', 'before', 'after')
+
+    def __init__(self, table_id, names, key_columns, keep_values):
+        self.table_id = table_id
+        self.names = names
+        self.key_columns = key_columns
+        self.rows = 0
+        self.pk = [_Column() for _ in key_columns]
+        self.before = _Image(len(names)) if keep_values else None
+        self.after = _Image(len(names)) if keep_values else None
+
+    def append(self, before, after):
+        """添加一行，返回块内的行号"""
+        row = self.rows
+        image = after if before is None else before
+        for column, name in zip(self.pk, self.key_columns):
+            column.append(image.get(name))
+        if self.before is not None:
+            if before is not None:
+                self.before.append(row, self.names, before)
+            if after is not None:
+                self.after.append(row, self.names, after)
+        self.rows += 1
+        return row
+
+    def nbytes(self):
+        size = sum(column.nbytes() for column in self.pk)
+        for image in (self.before, self.after):
+            if image is not None:
+                size += len(image.rows) * image.rows.itemsize + sum(column.nbytes() for column in image.columns)
+        return size
+
+
+class ChangeStore(object):
+    """
+    内存中的列式行变更存储
+
+    每个字段（表、类型、时间、文件、位置）一个紧凑数组，表名和文件名只保存一次编号；
+    行数据按表和列定义分成列块，整数和浮点数列用array保存，键列单独保存。
+    安装了NumPy时过滤和分组是向量化的，否则逐行计算；结果可以导出为CSV、NPZ（需要NumPy）
+    或Arrow IPC（需要pyarrow）。
+    """
+
+    def __init__(self, keep_values=True):
+        """
+        Args:
+            keep_values: 是否保存前后镜像的列值，为False时只保存键列
+        """
+        self.keep_values = keep_values
+        self.tables = []        # 编号 -> (库名, 表名)
+        self.files = []         # 编号 -> binlog文件名
+        self._table_ids = {}
+        self._file_ids = {}
+        self._blocks = []       # 编号 -> _ColumnBlock
+        self._block_ids = {}    # (表编号, 列名, 键列) -> 块编号
+        self._fields = dict((name, array.array(typecode)) for name, typecode, _ in FIELDS)
+        self._cache = (None, {})  # (变更数, 字段名 -> numpy数组)
+
+    def __len__(self):
+        return len(self._fields['type'])
+
+    @staticmethod
+    def _intern(key, items, ids):
+        item_id = ids.get(key)
+        if item_id is None:
+            item_id = ids[key] = len(items)
+            items.append(key)
+        return item_id
+
+    def add(self, schema, table, kind, row, columns, key_columns, timestamp, log_file, start_pos, end_pos):
+        """
+        添加一行变更
+
+        Args:
+            kind: INSERT、UPDATE或DELETE
+            row: pymysqlreplication的行数据
+            columns: 表的列名
+            key_columns: 键列名
+            start_pos, end_pos: 事务的起始位置和事件的结束位置
+        """
+        table_id = self._intern((schema, table), self.tables, self._table_ids)
+        columns, key_columns = tuple(columns), tuple(key_columns or ())
+        block_key = (table_id, columns, key_columns)
+        block_id = self._block_ids.get(block_key)
+        if block_id is None:
+            block_id = self._block_ids[block_key] = len(self._blocks)
+            self._blocks.append(_ColumnBlock(table_id, columns, key_columns, self.keep_values))
+        before, after = row_images(kind, row)
+        block_row = self._blocks[block_id].append(before, after)
+
+        fields = self._fields
+        fields['table_id'].append(table_id)
+        fields['type'].append(_TYPE_CODES[kind])
+        fields['timestamp'].append(timestamp)
+        fields['file_id'].append(self._intern(log_file, self.files, self._file_ids))
+        fields['start_pos'].append(start_pos or 0)
+        fields['end_pos'].append(end_pos or 0)
+        fields['block_id'].append(block_id)
+        fields['block_row'].append(block_row)
+
+    def nbytes(self):
+        """占用的内存（不含Python对象的开销）"""
+        size = sum(values.itemsize * len(values) for values in self._fields.values())
+        return size + sum(block.nbytes() for block in self._blocks)
+
+    def field(self, name):
+        """
+        一个字段的全部值
+
+        Returns:
+            numpy.ndarray（安装了NumPy时）或array.array
+        """
+        values = self._fields[name]
+        if numpy is None:
+            return values
+        count, arrays = self._cache
+        if count != len(self):
+            arrays = {}
+            self._cache = (len(self), arrays)
+        if name not in arrays:
+            dtype = dict((field, dtype) for field, _, dtype in FIELDS)[name]
+            # 复制一份，array继续追加时不受numpy视图的限制
+            arrays[name] = numpy.frombuffer(values, dtype=dtype).copy() if values else numpy.zeros(0, dtype)
+        return arrays[name]
+
+    def _table_id_set(self, schemas, tables):
+        return set(table_id for table_id, (schema, table) in enumerate(self.tables)
+                   if (not schemas or schema in schemas) and (not tables or table in tables))
+
+    def select(self, schemas=None, tables=None, types=None, start_time=None, stop_time=None):
+        """
+        按库表、类型和时间范围选出变更
+
+        Args:
+            types: 变更类型列表，如 ['INSERT', 'DELETE']
+            start_time, stop_time: datetime，包含开始时间，不包含结束时间
+
+        Returns:
+            变更编号（numpy数组或列表），按变更顺序
+        """
+        table_ids = self._table_id_set(schemas, tables) if (schemas or tables) else None
+        type_codes = set(_TYPE_CODES[t.upper()] for t in types) if types else None
+        start_ts = int(start_time.timestamp()) if start_time else None
+        stop_ts = int(stop_time.timestamp()) if stop_time else None
+
+        if numpy is not None:
+            mask = numpy.ones(len(self), dtype=bool)
+            if table_ids is not None:
+                mask &= numpy.isin(self.field('table_id'), list(table_ids))
+            if type_codes is not None:
+                mask &= numpy.isin(self.field('type'), list(type_codes))
+            if start_ts is not None:
+                mask &= self.field('timestamp') >= start_ts
+            if stop_ts is not None:
+                mask &= self.field('timestamp') < stop_ts
+            return numpy.flatnonzero(mask)
+
+        fields = self._fields
+        return [i for i in range(len(self))
+                if (table_ids is None or fields['table_id'][i] in table_ids) and
+                (type_codes is None or fields['type'][i] in type_codes) and
+                (start_ts is None or fields['timestamp'][i] >= start_ts) and
+                (stop_ts is None or fields['timestamp'][i] < stop_ts)]
+
+    def _group_key(self, name, interval):
+        if name == 'table':
+            return self.field('table_id')
+        if name == 'type':
+            return self.field('type')
+        if name == 'file':
+            return self.field('file_id')
+        if name == 'time':
+            timestamps = self.field('timestamp')
+            if numpy is not None:
+                return timestamps // interval * interval
+            return array.array('q', (timestamp // interval * interval for timestamp in timestamps))
+        raise ValueError('不支持的分组字段: %s，可选 %s' % (name, ', '.join(GROUP_FIELDS)))
+
+    def _group_label(self, name, value):
+        if name == 'table':
+            return '%s.%s' % self.tables[value]
+        if name == 'type':
+            return CHANGE_TYPES[value]
+        if name == 'file':
+            return self.files[value]
+        return datetime.datetime.fromtimestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+
+    def group_counts(self, by=('table', 'type'), interval=60, selection=None):
+        """
+        按字段分组计数
+
+        Args:
+            by: 分组字段，table、type、file或time
+            interval: 按time分组时的时间间隔（秒）
+            selection: select()的结果，None表示全部
+
+        Returns:
+            list: [(分组标签元组, 数量)]，按数量从多到少
+        """
+        if not len(self) or (selection is not None and not len(selection)):
+            return []
+        keys = [self._group_key(name, interval) for name in by]
+        if numpy is not None:
+            stacked = numpy.stack(keys, axis=1).astype('int64')
+            if selection is not None:
+                stacked = stacked[selection]
+            groups, counts = numpy.unique(stacked, axis=0, return_counts=True)
+            result = [(tuple(int(v) for v in group), int(count)) for group, count in zip(groups, counts)]
+        else:
+            indices = range(len(self)) if selection is None else selection
+            result = Counter(tuple(key[i] for key in keys) for i in indices).items()
+        result = sorted(result, key=lambda item: (-item[1], item[0]))
+        return [(tuple(self._group_label(name, value) for name, value in zip(by, group)), count)
+                for group, count in result]
+
+    def change(self, index):
+        """
+        读取一行变更
+
+        Returns:
+            dict: schema, table, type, timestamp, file, start_pos, end_pos, columns, pk, before, after
+        """
+        fields = self._fields
+        block = self._blocks[fields['block_id'][index]]
+        block_row = fields['block_row'][index]
+        schema, table = self.tables[fields['table_id'][index]]
+        change = {
+            'schema': schema, 'table': table, 'type': CHANGE_TYPES[fields['type'][index]],
+            'timestamp': fields['timestamp'][index], 'file': self.files[fields['file_id'][index]],
+            'start_pos': fields['start_pos'][index], 'end_pos': fields['end_pos'][index],
+            'columns': block.names, 'pk': [column[block_row] for column in block.pk],
+            'before': None, 'after': None,
+        }
+        if block.before is not None:
+            change['before'] = block.before.get(block_row, block.names)
+            change['after'] = block.after.get(block_row, block.names)
+        return change
+
+    def iter_changes(self, selection=None):
+        """按顺序读取变更"""
+        for index in (range(len(self)) if selection is None else selection):
+            yield self.change(int(index))
+
+    def _export_rows(self, selection):
+        for change in self.iter_changes(selection):
+            yield (change['schema'], change['table'], change['type'],
+                   datetime.datetime.fromtimestamp(change['timestamp']).strftime('%Y-%m-%d %H:%M:%S'),
+                   change['file'], change['start_pos'], change['end_pos'], dumps(change['pk']),
+                   self._image_text(change, 'before'), self._image_text(change, 'after'))
+
+    @staticmethod
+    def _image_text(change, image):
+        """镜像按 {列名: 值} 编码为JSON，没有该镜像时为空"""
+        values = change[image]
+        return dumps(dict(zip(change['columns'], values))) if values is not None else ''
+
+    def to_csv(self, path, selection=None):
+        """导出为CSV，键和镜像为JSON文本"""
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            writer.writerows(self._export_rows(selection))
+
+    def to_npz(self, path, selection=None):
+        """导出为NumPy的NPZ文件，每个字段一个数组，表名和文件名为字符串数组"""
+        if numpy is None:
+            raise RuntimeError('导出NPZ需要安装numpy')
+        arrays = dict((name, self.field(name) if selection is None else self.field(name)[selection])
+                      for name in ('table_id', 'type', 'timestamp', 'file_id', 'start_pos', 'end_pos'))
+        arrays['tables'] = numpy.array(['%s.%s' % table for table in self.tables], dtype=str)
+        arrays['files'] = numpy.array(self.files, dtype=str)
+        arrays['types'] = numpy.array(CHANGE_TYPES, dtype=str)
+        arrays['pk'] = numpy.array([dumps(change['pk']) for change in self.iter_changes(selection)], dtype=str)
+        numpy.savez_compressed(path, **arrays)
+
+    def to_arrow(self, path, selection=None):
+        """导出为Arrow IPC文件，库表、类型和文件名为字典编码"""
+        if pyarrow is None:
+            raise RuntimeError('导出Arrow需要安装pyarrow')
+
+        def field(name):
+            values = self.field(name)
+            if selection is not None:
+                values = values[selection] if numpy is not None else [values[i] for i in selection]
+            return pyarrow.array(values)
+
+        table_ids = field('table_id')
+        changes = list(self.iter_changes(selection))
+        columns = {
+            'schema': pyarrow.DictionaryArray.from_arrays(table_ids, [schema for schema, _ in self.tables]),
+            'table': pyarrow.DictionaryArray.from_arrays(table_ids, [table for _, table in self.tables]),
+            'type': pyarrow.DictionaryArray.from_arrays(field('type'), list(CHANGE_TYPES)),
+            'time': field('timestamp').cast(pyarrow.timestamp('s')),
+            'file': pyarrow.DictionaryArray.from_arrays(field('file_id'), self.files),
+            'start_pos': field('start_pos'),
+            'end_pos': field('end_pos'),
+            'pk': pyarrow.array([dumps(change['pk']) for change in changes], pyarrow.string()),
+            'before': pyarrow.array([self._image_text(change, 'before') or None for change in changes],
+                                    pyarrow.string()),
+            'after': pyarrow.array([self._image_text(change, 'after') or None for change in changes],
+                                   pyarrow.string()),
+        }
+        table = pyarrow.table(columns)
+        with pyarrow.OSFile(path, 'wb') as sink:
+            with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    def export(self, path, selection=None):
+        """按扩展名导出: .csv、.npz、.arrow/.feather"""
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.npz':
+            self.to_npz(path, selection)
+        elif extension in ('.arrow', '.feather', '.ipc'):
+            self.to_arrow(path, selection)
+        else:
+            self.to_csv(path, selection)
+        logger.info(f"导出 {len(self) if selection is None else len(selection)} 行变更到 {path}")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from contextlib import contextmanager
+import pymysql
+from .logger import get_logger
+
+# 获取logger实例
+logger = get_logger("ConnectionPool")
+
+DEFAULT_MAX_IDLE = 4             # 每个连接配置最多保留的空闲连接数
+DEFAULT_IDLE_TIMEOUT = 300.0     # 空闲超过该时间（秒）的连接直接关闭
+DEFAULT_CHECK_INTERVAL = 30.0    # 空闲超过该时间（秒）的连接取出时先ping检查
+
+# 决定连接身份的配置项，其他配置（如connect_timeout）不影响复用
+_IDENTITY_KEYS = ('host', 'port', 'user', 'passwd', 'password', 'charset', 'database', 'db')
+
+
+class ConnectionPool(object):
+    """
+    单个连接配置的pymysql连接池
+
+    空闲连接按后进先出复用，取出时丢弃超过空闲时间的连接，
+    空闲较久的连接先ping确认可用；归还时回滚未结束的事务，失败则关闭。
+    """
+
+    def __init__(self, connection_settings, max_idle=DEFAULT_MAX_IDLE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 check_interval=DEFAULT_CHECK_INTERVAL):
+        self.connection_settings = dict(connection_settings)
+        self.connection_settings.setdefault('charset', 'utf8mb4')
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._idle = []  # [(连接, 归还时间)]
+        self._lock = threading.Lock()
+        self.created = 0  # 新建连接数
+        self.reused = 0   # 复用连接数
+
+    def acquire(self):
+        """取出一个可用连接，没有空闲连接时新建"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, released_at = self._idle.pop()
+            idle = time.time() - released_at
+            if idle > self.idle_timeout:
+                self._close(connection)
+                continue
+            if idle > self.check_interval:
+                try:
+                    connection.ping(reconnect=False)
+                except Exception:
+                    self._close(connection)
+                    continue
+            self.reused += 1
+            return connection
+
+        self.created += 1
+        return pymysql.connect(**self.connection_settings)
+
+    def release(self, connection):
+        """归还连接"""
+        if connection is None or not connection.open:
+            return
+        try:
+            connection.rollback()
+        except Exception:
+            self._close(connection)
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((connection, time.time()))
+                return
+        self._close(connection)
+
+    @contextmanager
+    def connection(self):
+        """with语句中使用一个连接，结束后归还"""
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(connection_settings):
+    """获取连接配置对应的连接池，同一配置共享一个连接池"""
+    settings = dict(connection_settings)
+    settings.setdefault('charset', 'utf8mb4')
+    key = tuple((name, str(settings.get(name))) for name in _IDENTITY_KEYS)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(connection_settings)
+        return pool
+
+
+def close_all_pools():
+    """关闭所有连接池中的空闲连接"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
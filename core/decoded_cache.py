@@ -0,0 +1,594 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from collections import namedtuple
+from pymysqlreplication.event import (
+    BinLogEvent, QueryEvent, XidEvent, RotateEvent, FormatDescriptionEvent, RowsQueryLogEvent,
+    GtidEvent, MariadbGtidEvent,
+)
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+from .binlog_util import rows_query_text
+from .partial_json import PartialUpdateRowsEvent
+from .table_metadata import fetch_columns
+from .value_codec import pack, pack_column, unpack
+from .logger import get_logger
+
+# 获取logger实例
+logger = get_logger("DecodedCache")
+
+INDEX_FILE = 'index.json'
+SEGMENT_MAGIC = b'B2SDEC2\n'    # 缓存段文件头，之后是长度前缀的JSON段信息
+SEGMENT_FORMAT = 2               # 缓存段格式版本，旧格式的缓存段加载索引时删除
+BLOCK_EVENTS = 2000              # 每个列式块中的事件数
+BLOCK_HEADER = struct.Struct('<I')
+
+# 表结构来源，决定缓存中的行数据是否依赖服务器当前的表结构
+SCHEMA_BINLOG = 'binlog'         # 列定义取自表映射事件（binlog_row_metadata=FULL）
+SCHEMA_HISTORY = 'history'       # 按位置取自本地表结构历史
+SCHEMA_SERVER = 'server'         # 取自服务器当前的表结构
+
+# 事件类型，按子类在前的顺序匹配
+_EVENT_KINDS = (
+    ('partial_update', PartialUpdateRowsEvent),
+    ('write', WriteRowsEvent),
+    ('update', UpdateRowsEvent),
+    ('delete', DeleteRowsEvent),
+    ('query', QueryEvent),
+    ('xid', XidEvent),
+    ('gtid', GtidEvent),
+    ('mariadb_gtid', MariadbGtidEvent),
+    ('rotate', RotateEvent),
+    ('rows_query', RowsQueryLogEvent),
+    ('format', FormatDescriptionEvent),
+)
+_KIND_CLASSES = dict(_EVENT_KINDS)
+_ROWS_KINDS = ('partial_update', 'write', 'update', 'delete')
+
+ReplayColumn = namedtuple('ReplayColumn', ['name', 'type'])
+
+
+class ReplayPacket(object):
+    """重放事件的packet，只提供位置"""
+
+    def __init__(self, log_pos):
+        self.log_pos = log_pos
+
+
+def _event_kind(event):
+    for kind, cls in _EVENT_KINDS:
+        if isinstance(event, cls):
+            return kind
+    return 'other'
+
+
+def _text(value):
+    return value.decode('utf-8', 'ignore') if isinstance(value, bytes) else value
+
+
+def _encode_rows(rows):
+    """
+    将行数据转为列式：每个部分（values或before_values/after_values）只保存一次列名，
+    每列的值保存为一个列表，整数列为定长数组。各行列名不一致时按原样保存。
+    结果只包含JSON类型的数据。
+    """
+    if not rows:
+        return ['rows', []]
+    sections = list(rows[0])
+    names = dict((section, list(rows[0][section])) for section in sections)
+    for row in rows:
+        if list(row) != sections or any(list(row[section]) != names[section] for section in sections):
+            return ['rows', pack(rows)]
+    columns = dict((section, [pack_column([row[section][name] for row in rows]) for name in names[section]])
+                   for section in sections)
+    return ['columns', len(rows), sections, pack([names[section] for section in sections]), columns]
+
+
+def _decode_rows(data):
+    if data[0] == 'rows':
+        return unpack(data[1])
+    _, count, sections, names, columns = data
+    names = unpack(names)
+    rows = [dict((section, {}) for section in sections) for _ in range(count)]
+    for section, section_names in zip(sections, names):
+        for name, values in zip(section_names, columns[section]):
+            for row, value in zip(rows, unpack(values)):
+                row[section][name] = value
+    return rows
+
+
+class SegmentWriter(object):
+    """
+    记录一个binlog文件中一段范围的解码结果
+
+    文件以段信息（binlog文件、起始位置、解码条件）开头，读取时先核对段信息。
+    事件按BLOCK_EVENTS个一块转为列式（类型、时间戳、位置等各为一列，表信息按块去重，
+    行数据按列保存），编码为JSON后用zlib压缩，按长度前缀追加写入；不使用pickle，
+    读取缓存文件不会执行其中的任何代码。
+    """
+
+    def __init__(self, path, log_file, start_pos, decode):
+        self.path = path
+        self.log_file = log_file
+        self.start_pos = start_pos
+        self.end_pos = start_pos
+        self.complete = False
+        self.failed = False
+        self.events = 0
+        self.tables = set()
+        self._pending = []
+        self._file = open(path, 'wb')
+        header = json.dumps(segment_header(log_file, start_pos, decode)).encode('utf-8')
+        self._file.write(SEGMENT_MAGIC + BLOCK_HEADER.pack(len(header)) + header)
+
+    def add(self, event):
+        """记录一个事件，返回是否到达文件结束（轮换事件）"""
+        log_pos = event.packet.log_pos
+        kind = _event_kind(event)
+        if self.failed or not log_pos or (kind == 'rotate' and not event.timestamp):
+            # 服务器生成的虚拟事件不在文件中，重放时重新生成
+            return False
+        record = {'kind': kind, 'timestamp': event.timestamp, 'log_pos': log_pos}
+        if kind == 'query':
+            record['schema'] = _text(event.schema)
+            record['text'] = _text(event.query)
+        elif kind == 'rows_query':
+            record['text'] = rows_query_text(event)
+        elif kind == 'rotate':
+            record['text'] = _text(event.next_binlog)
+            record['number'] = event.position
+        elif kind == 'xid':
+            record['number'] = event.xid
+        elif kind == 'gtid':
+            record['text'] = event.sid.hex()
+            record['number'] = event.gno
+        elif kind == 'mariadb_gtid':
+            record['text'] = event.gtid
+        elif kind in _ROWS_KINDS:
+            schema, table = _text(event.schema), _text(event.table)
+            primary_key = getattr(event, 'primary_key', None)
+            if isinstance(primary_key, list):
+                primary_key = tuple(primary_key)
+            columns = getattr(event, 'columns', None) or ()
+            record['table'] = (schema, table, primary_key, tuple(_text(column.name) for column in columns),
+                               tuple(getattr(column, 'type', None) for column in columns))
+            record['bitmap'] = (getattr(event, 'columns_present_bitmap', None),
+                                getattr(event, 'columns_present_bitmap2', None))
+            try:
+                record['rows'] = _encode_rows(event.rows)
+            except (TypeError, ValueError) as e:
+                # 行数据中有无法编码的值，放弃这一段缓存
+                logger.warning(f"解码缓存无法编码事件，不保存该段: {str(e)}")
+                self.failed = True
+                self._pending = []
+                return False
+            self.tables.add((schema, table))
+        self._pending.append(record)
+        self.events += 1
+        self.end_pos = max(self.end_pos, log_pos)
+        if len(self._pending) >= BLOCK_EVENTS:
+            self._flush()
+        if kind == 'rotate':
+            self.complete = True
+        return self.complete
+
+    def _flush(self):
+        if not self._pending:
+            return
+        tables, table_ids = [], {}
+        block = dict((name, []) for name in ('kind', 'timestamp', 'log_pos', 'schema', 'text', 'number',
+                                             'table', 'bitmap', 'rows'))
+        for record in self._pending:
+            table = record.get('table')
+            if table is not None and table not in table_ids:
+                table_ids[table] = len(tables)
+                tables.append(table)
+            for name in block:
+                if name == 'table':
+                    block[name].append(table_ids[table] if table is not None else None)
+                else:
+                    block[name].append(record.get(name))
+        block['tables'] = tables
+        self._pending = []
+        try:
+            for name in ('timestamp', 'log_pos', 'number'):
+                block[name] = pack_column(block[name])
+            block['bitmap'] = pack(block['bitmap'])
+            block['tables'] = pack(tables)
+            data = zlib.compress(json.dumps(block, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 1)
+        except (TypeError, ValueError) as e:
+            # 行数据中有无法编码的值，放弃这一段缓存
+            logger.warning(f"解码缓存无法编码事件，不保存该段: {str(e)}")
+            self.failed = True
+            return
+        self._file.write(BLOCK_HEADER.pack(len(data)))
+        self._file.write(data)
+
+    def close(self):
+        """写入剩余的事件，返回文件大小"""
+        self._flush()
+        self._file.close()
+        return os.path.getsize(self.path)
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def segment_header(log_file, start_pos, decode):
+    """缓存段文件开头的段信息，按JSON规范化以便与文件中读取的比较"""
+    return json.loads(json.dumps({'format': SEGMENT_FORMAT, 'file': log_file, 'start': start_pos, 'decode': decode}))
+
+
+def _read_header(f):
+    if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+        return None
+    size = f.read(BLOCK_HEADER.size)
+    if len(size) < BLOCK_HEADER.size:
+        return None
+    try:
+        return json.loads(f.read(BLOCK_HEADER.unpack(size)[0]).decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def segment_matches(path, expected):
+    """缓存段文件的段信息是否与索引中的一致，只读取文件头"""
+    try:
+        with open(path, 'rb') as f:
+            return _read_header(f) == expected
+    except OSError:
+        return False
+
+
+def read_segment(path, expected, from_pos=None):
+    """
+    读取一段解码结果，跳过结束位置不超过from_pos的事件
+
+    Args:
+        expected: segment_header()，与文件中的段信息不一致时不读取
+
+    Returns:
+        iterator: 重建的事件对象，类型与pymysqlreplication的事件相同
+    """
+    with open(path, 'rb') as f:
+        if _read_header(f) != expected:
+            raise ValueError('解码缓存段与索引不一致: %s' % path)
+        while True:
+            header = f.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                break
+            block = json.loads(zlib.decompress(f.read(BLOCK_HEADER.unpack(header)[0])).decode('utf-8'))
+            tables = [_table_key(table) for table in unpack(block['tables'])]
+            bitmaps = unpack(block['bitmap'])
+            for name in ('timestamp', 'log_pos', 'number'):
+                block[name] = unpack(block[name])
+            for i, log_pos in enumerate(block['log_pos']):
+                if from_pos is not None and log_pos <= from_pos:
+                    continue
+                yield _replay_event(block['kind'][i], block['timestamp'][i], log_pos, block['schema'][i],
+                                    block['text'][i], block['number'][i],
+                                    tables[block['table'][i]] if block['table'][i] is not None else None,
+                                    bitmaps[i], block['rows'][i])
+
+
+def _table_key(table):
+    """JSON中的表信息转回元组，键列为列表时同样转为元组"""
+    return tuple(tuple(item) if isinstance(item, list) else item for item in table)
+
+
+def _replay_event(kind, timestamp, log_pos, schema, text, number, table, bitmap, rows):
+    cls = _KIND_CLASSES.get(kind, BinLogEvent)
+    event = cls.__new__(cls)
+    event.timestamp = timestamp
+    event.packet = ReplayPacket(log_pos)
+    if kind == 'query':
+        event.schema, event.query = schema, text
+    elif kind == 'rows_query':
+        event.query = text
+        event._query_completed = True
+    elif kind == 'rotate':
+        event.next_binlog, event.position = text, number
+    elif kind == 'xid':
+        event.xid = number
+    elif kind == 'gtid':
+        event.sid, event.gno = bytes.fromhex(text), number
+    elif kind == 'mariadb_gtid':
+        event.gtid = text
+    elif kind in _ROWS_KINDS:
+        event.schema, event.table, event.primary_key = table[0], table[1], table[2]
+        # 早期的缓存段没有保存列类型
+        types = table[4] if len(table) > 4 else (None,) * len(table[3])
+        event.columns = [ReplayColumn(name, column_type) for name, column_type in zip(table[3], types)]
+        event.columns_present_bitmap, event.columns_present_bitmap2 = bitmap or (None, None)
+        event._RowsEvent__rows = _decode_rows(rows)
+    return event
+
+
+def artificial_rotate(log_file, log_pos):
+    """与服务器在流开始和切换文件时发送的虚拟轮换事件相同"""
+    return _replay_event('rotate', 0, 0, None, log_file, log_pos, None, None, None)
+
+
+def schema_fingerprint(connection, tables):
+    """服务器上这些表当前的列定义摘要，表结构变化后摘要不同"""
+    if not tables:
+        return ''
+    schemas = sorted(set(schema for schema, _ in tables))
+    names = sorted(set(table for _, table in tables))
+    columns = fetch_columns(connection, schemas, names)
+    digest = hashlib.sha1()
+    for key in sorted(tables):
+        digest.update(repr((key, [(c['COLUMN_NAME'], c['COLUMN_TYPE']) for c in columns.get(key, ())])).encode())
+    return digest.hexdigest()
+
+
+class DecodedEventCache(object):
+    """
+    按范围保存的解码结果
+
+    每段记录服务器上一个binlog文件中[start, end]范围内解码后的事件，索引中保存
+    文件、范围、解码条件（stream级别的库表过滤、是否包含Rows_query事件）和表结构版本。
+    关键字、SQL类型、回滚等过滤条件只作用于解码之后，修改这些条件重新解析时
+    直接从缓存重放，不再下载和解码。
+    """
+
+    def __init__(self, directory, server_key):
+        self.directory = os.path.join(directory, server_key)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._segments = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+                segments = json.load(f)
+        except (OSError, ValueError):
+            return []
+        current = []
+        for segment in segments:
+            if segment.get('format') == SEGMENT_FORMAT:
+                if os.path.exists(self._path(segment['name'])):
+                    current.append(segment)
+                continue
+            # 旧格式的缓存段不再读取
+            try:
+                os.remove(self._path(segment['name']))
+            except OSError:
+                pass
+        return current
+
+    def _save_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self._segments, f)
+        os.replace(path + '.tmp', path)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def compatible(segment, decode):
+        """缓存的解码条件是否包含本次需要的事件"""
+        recorded = segment['decode']
+        for name in ('schemas', 'tables'):
+            if recorded[name] is not None and (decode[name] is None or not set(decode[name]) <= set(recorded[name])):
+                return False
+        if decode['rows_query'] and not recorded['rows_query']:
+            return False
+        return recorded['schema_source'] == decode['schema_source']
+
+    def find(self, log_file, log_pos, decode, schema_version):
+        """
+        查找包含log_pos之后事件的缓存段
+
+        Args:
+            decode: 本次的解码条件
+            schema_version: 函数 schema_version(tables)，返回这些表当前的表结构版本
+        """
+        with self._lock:
+            candidates = [segment for segment in self._segments
+                          if segment['file'] == log_file and segment['start'] <= log_pos < segment['end'] and
+                          self.compatible(segment, decode)]
+        for segment in sorted(candidates, key=lambda s: s['end'], reverse=True):
+            if segment['schema_version'] != schema_version([tuple(t) for t in segment['tables']]):
+                continue
+            if not segment_matches(self._path(segment['name']), self._header(segment)):
+                logger.warning(f"解码缓存段与索引不一致，已删除: {segment['name']}")
+                self._remove(segment)
+                continue
+            return segment
+        return None
+
+    @staticmethod
+    def _header(segment):
+        return segment_header(segment['file'], segment['start'], segment['decode'])
+
+    def _remove(self, segment):
+        with self._lock:
+            self._segments = [s for s in self._segments if s is not segment]
+            self._save_index()
+        try:
+            os.remove(self._path(segment['name']))
+        except OSError:
+            pass
+
+    def writer(self, log_file, start_pos, decode):
+        name = '%s_%d_%d.seg' % (os.path.basename(log_file), start_pos, int(time.time() * 1000000))
+        return SegmentWriter(self._path(name), log_file, start_pos, decode)
+
+    def add(self, writer, decode, schema_version):
+        """保存一段解码结果，删除被它包含的旧缓存段"""
+        size = writer.close()
+        if writer.failed or writer.end_pos <= writer.start_pos:
+            writer.discard()
+            return
+        segment = {
+            'name': os.path.basename(writer.path), 'file': writer.log_file,
+            'start': writer.start_pos, 'end': writer.end_pos, 'complete': writer.complete,
+            'events': writer.events, 'size': size, 'tables': sorted(writer.tables),
+            'decode': decode, 'schema_version': schema_version, 'created': time.time(),
+            'format': SEGMENT_FORMAT,
+        }
+        with self._lock:
+            replaced = [s for s in self._segments
+                        if s['file'] == segment['file'] and s['decode'] == decode and
+                        s['schema_version'] == schema_version and
+                        segment['start'] <= s['start'] and s['end'] <= segment['end']]
+            self._segments = [s for s in self._segments if s not in replaced] + [segment]
+            self._save_index()
+        for old in replaced:
+            try:
+                os.remove(self._path(old['name']))
+            except OSError:
+                pass
+        logger.info(f"保存解码缓存: {segment['file']}:{segment['start']}-{segment['end']}, "
+                    f"{segment['events']} 个事件, {size} 字节")
+
+    def read(self, segment, from_pos=None):
+        return read_segment(self._path(segment['name']), self._header(segment), from_pos)
+
+
+class RecordingStream(object):
+    """
+    包装BinLogStreamReader，返回事件的同时按文件记录解码结果，关闭时保存
+
+    第一段从请求的起始位置开始，之后的每段从轮换事件指向的位置开始；
+    不使用读取事件前stream的位置，stream跳过的事件不会改变段的起始位置。
+    """
+
+    def __init__(self, stream, cache, decode, schema_version, log_file, log_pos):
+        """
+        Args:
+            stream: 从log_file:log_pos开始读取的BinLogStreamReader
+            log_file, log_pos: stream请求的起始位置
+        """
+        self.stream = stream
+        self.cache = cache
+        self.decode = decode
+        self.schema_version = schema_version
+        self._writer = None
+        self._start = (log_file, log_pos or 4)  # 下一段的起始位置
+
+    @property
+    def log_file(self):
+        return self.stream.log_file
+
+    @property
+    def log_pos(self):
+        return self.stream.log_pos
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        event = self.stream.fetchone()
+        if event is None:
+            raise StopIteration
+        if self._writer is None:
+            self._writer = self.cache.writer(self._start[0], self._start[1], self.decode)
+        if self._writer.add(event):
+            # 文件结束，之后的事件属于轮换事件指向的下一个文件
+            self._start = (_text(event.next_binlog), event.position)
+            self._save()
+        return event
+
+    def _save(self):
+        writer, self._writer = self._writer, None
+        try:
+            self.cache.add(writer, self.decode, self.schema_version(writer.tables))
+        except Exception as e:
+            writer.discard()
+            logger.warning(f"保存解码缓存失败: {str(e)}")
+
+    def close(self):
+        if self._writer is not None:
+            self._save()
+        self.stream.close()
+
+
+class ReplayStream(object):
+    """
+    按顺序重放缓存段，接口与BinLogStreamReader相同
+
+    每个文件开始时与服务器一样先返回虚拟轮换事件；缓存没有覆盖到需要的位置时，
+    调用tail(log_file, log_pos)打开复制连接继续读取剩余部分。
+    """
+
+    def __init__(self, cache, chain, tail=None):
+        """
+        Args:
+            chain: [(缓存段, 起始位置)]
+            tail: 缓存结束后继续读取的函数，返回BinLogStreamReader；None表示缓存已覆盖全部范围
+        """
+        self.cache = cache
+        self.chain = chain
+        self.tail = tail
+        self.replayed = 0
+        self.log_file, self.log_pos = chain[0][0]['file'], chain[0][1]
+        self._stream = None
+        self._events = self._replay()
+
+    def _replay(self):
+        current = None
+        for segment, log_pos in self.chain:
+            if segment['file'] != current:
+                current = segment['file']
+                yield artificial_rotate(current, log_pos)
+            for event in self.cache.read(segment, log_pos):
+                yield event
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._stream is None:
+            try:
+                event = next(self._events)
+            except StopIteration:
+                if self.tail is None:
+                    raise
+                self._stream = iter(self.tail(self.log_file, self.log_pos))
+            else:
+                if isinstance(event, RotateEvent):
+                    self.log_file, self.log_pos = event.next_binlog, event.position
+                else:
+                    self.log_pos = event.packet.log_pos or self.log_pos
+                self.replayed += 1
+                return event
+        event = next(self._stream)
+        self.log_file, self.log_pos = self._stream.log_file, self._stream.log_pos
+        return event
+
+    def close(self):
+        self._events.close()
+        if self._stream is not None:
+            self._stream.close()
+        logger.info(f"从解码缓存重放了 {self.replayed} 个事件")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_decoded_cache(host, port, directory=None):
+    """获取连接对应的解码缓存，同一进程内共享"""
+    directory = os.path.abspath(directory or 'decoded_cache')
+    server_key = '%s_%s' % (str(host).replace('.', '_').replace(':', '_'), port)
+    key = (directory, server_key)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = DecodedEventCache(directory, server_key)
+        return _caches[key]
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+class OutputLimits(object):
+    """关键字过滤和输出限制"""
+
+    def __init__(self, keywords=None, max_statements=0, max_transactions=0, max_rows=0, skip_statements=0):
+        """
+        Args:
+            keywords: SQL关键字过滤列表（匹配任意一个即输出）
+            max_statements: 最多输出的SQL语句数，0表示不限制
+            max_transactions: 最多输出的事务数，0表示不限制
+            max_rows: 最多输出的行变更数，0表示不限制
+            skip_statements: 从起始位置开始跳过的已输出语句数（用于翻页续读）
+        """
+        self.keywords = [kw.upper() for kw in keywords if kw] if keywords else []
+        self.max_statements = max_statements or 0
+        self.max_transactions = max_transactions or 0
+        self.max_rows = max_rows or 0
+        self.skip_statements = skip_statements or 0
+
+
+class RollbackOptions(object):
+    """回滚SQL的暂存、分组和限速"""
+
+    def __init__(self, spool_dir=None, spool_budget_mb=0, spool_compress=True, group_rollback=True,
+                 rollback_group_size=0, throttle_rows=0, throttle_txns=0):
+        """
+        Args:
+            spool_dir: 回滚SQL暂存文件目录，默认为当前工作目录
+            spool_budget_mb: 回滚SQL暂存文件的磁盘占用上限（MB），0表示不限制
+            spool_compress: 回滚SQL暂存文件是否压缩
+            group_rollback: 回滚SQL是否用BEGIN/COMMIT分组输出
+            rollback_group_size: 回滚分组的语句数，0表示按原事务分组
+            throttle_rows: 回滚限速（行/秒），0表示不限速
+            throttle_txns: 回滚限速（分组/秒），0表示不限速
+        """
+        self.spool_dir = spool_dir or None
+        self.spool_budget_mb = spool_budget_mb or 0
+        self.spool_compress = spool_compress
+        self.group_rollback = group_rollback
+        self.rollback_group_size = rollback_group_size or 0
+        self.throttle_rows = throttle_rows or 0
+        self.throttle_txns = throttle_txns or 0
+
+
+class SqlOptions(object):
+    """生成SQL的方式"""
+
+    def __init__(self, compact=False, compact_max_keys=500000, coalesce=False, coalesce_max_bytes=0, key_where=False,
+                 changed_only=False, rows_query=None, rows_query_counts=False):
+        """
+        Args:
+            compact: 按主键合并窗口内的行变更，只输出每行的净变化
+            compact_max_keys: 合并时内存中最多保留的行状态数，超过后溢出到磁盘
+            coalesce: 将连续的同表INSERT合并为多值INSERT，按主键的DELETE合并为 WHERE pk IN (...)
+            coalesce_max_bytes: 单条合并语句的最大字节数，0表示根据max_allowed_packet自动计算
+            key_where: UPDATE/DELETE的WHERE只使用主键或非空唯一索引，表没有键时按整行匹配；默认按整行匹配
+            changed_only: UPDATE只SET值有变化的列
+            rows_query: 原始语句输出模式，ROWS_QUERY_ONLY或ROWS_QUERY_ANNOTATE，需要binlog_rows_query_log_events=ON
+            rows_query_counts: 只输出原始语句时统计每条语句影响的行数（需要解码行数据）
+        """
+        self.compact = compact
+        self.compact_max_keys = compact_max_keys
+        self.coalesce = coalesce
+        self.coalesce_max_bytes = coalesce_max_bytes or 0
+        self.key_where = key_where
+        self.changed_only = changed_only
+        self.rows_query = rows_query or None
+        self.rows_query_counts = rows_query_counts
+
+
+class MetadataOptions(object):
+    """表结构的来源"""
+
+    def __init__(self, schema_history=False, schema_history_dir=None, prewarm_metadata=True):
+        """
+        Args:
+            schema_history: 使用本地表结构历史解码行事件，按事件位置取当时的表结构
+            schema_history_dir: 表结构历史文件目录，默认为当前工作目录
+            prewarm_metadata: 解析前用一次批量查询读取过滤条件匹配的所有表的列定义和键定义
+        """
+        self.schema_history = schema_history
+        self.schema_history_dir = schema_history_dir or None
+        self.prewarm_metadata = prewarm_metadata
+
+
+class CacheOptions(object):
+    """本地binlog缓存、预取和解码缓存"""
+
+    def __init__(self, mirror=False, mirror_dir=None, mirror_budget_mb=0, prefetch_files=2, prefetch_bandwidth_mb=0,
+                 decoded_cache=False, decoded_cache_dir=None):
+        """
+        Args:
+            mirror: 将binlog原始事件缓存到本地，再次解析同一范围时从本地读取（持续解析时不使用）
+            mirror_dir: 本地binlog缓存目录，默认为当前工作目录下的binlog_mirror
+            mirror_budget_mb: 本地binlog缓存的磁盘占用上限（MB），0表示不限制
+            prefetch_files: 使用本地缓存时，解析当前文件的同时最多预先下载的文件数，0表示解析前一次下载全部
+            prefetch_bandwidth_mb: 预取的下载限速（MB/秒），0表示不限速
+            decoded_cache: 按范围保存解码后的事件，只修改关键字、SQL类型、回滚等条件重新解析时直接从缓存重放
+            decoded_cache_dir: 解码缓存目录，默认为当前工作目录下的decoded_cache
+        """
+        self.mirror = mirror
+        self.mirror_dir = mirror_dir
+        self.mirror_budget_mb = mirror_budget_mb
+        self.prefetch_files = prefetch_files or 0
+        self.prefetch_bandwidth_mb = prefetch_bandwidth_mb or 0
+        self.decoded_cache = decoded_cache
+        self.decoded_cache_dir = decoded_cache_dir
+
+
+class OutputOptions(object):
+    """SQL以外的输出方式，都不指定时输出SQL"""
+
+    def __init__(self, export_binlog=None, json_lines=False, change_store=None):
+        """
+        Args:
+            export_binlog: 导出文件路径，指定时不生成SQL，将匹配过滤条件的事务按原始字节写入新的binlog文件
+            json_lines: 按JSON Lines输出行变更（每行一个JSON对象），不生成SQL
+            change_store: ChangeStore，指定时行变更保存到内存中的列式存储用于统计和导出，不生成SQL，
+                不使用关键字过滤和输出限制
+        """
+        self.export_binlog = export_binlog or None
+        self.json_lines = json_lines
+        self.change_store = change_store
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import struct
+from pymysqlreplication.bitmap import BitCount, BitGet
+from pymysqlreplication.constants import BINLOG, FIELD_TYPE
+from pymysqlreplication.packet import parse_json
+from pymysqlreplication.row_event import UpdateRowsEvent
+
+PARTIAL_UPDATE_ROWS_EVENT = 0x27  # MySQL 8.0 binlog_row_value_options=PARTIAL_JSON
+PARTIAL_JSON_UPDATES = 1          # value_options中表示包含JSON局部更新的位
+
+# JSON diff操作类型
+JSON_DIFF_REPLACE = 0
+JSON_DIFF_INSERT = 1
+JSON_DIFF_REMOVE = 2
+
+
+def json_text(value):
+    """将解析后的JSON值转换为JSON文本，bytes按UTF-8解码"""
+    def normalize(v):
+        if isinstance(v, bytes):
+            return v.decode('utf-8', 'ignore')
+        if isinstance(v, dict):
+            return dict((normalize(k), normalize(item)) for k, item in v.items())
+        if isinstance(v, (list, tuple)):
+            return [normalize(item) for item in v]
+        return v
+    return json.dumps(normalize(value), ensure_ascii=False, default=str)
+
+
+def read_packed_integer(data, pos):
+    """读取长度编码的整数，返回 (值, 新位置)"""
+    first = data[pos]
+    if first < 251:
+        return first, pos + 1
+    if first == 252:
+        return struct.unpack_from('<H', data, pos + 1)[0], pos + 3
+    if first == 253:
+        return struct.unpack_from('<I', data[pos + 1:pos + 4] + b'\x00')[0], pos + 4
+    return struct.unpack_from('<Q', data, pos + 1)[0], pos + 9
+
+
+class JsonPartialUpdate(object):
+    """
+    JSON列的局部更新
+
+    保存binlog中的JSON diff列表，生成SQL时转换为在原值上依次执行的
+    JSON_REPLACE/JSON_INSERT/JSON_REMOVE表达式，不需要还原完整的文档。
+    """
+
+    def __init__(self, diffs):
+        """
+        Args:
+            diffs: [(操作类型, 路径, 值)]，JSON_DIFF_REMOVE的值为None
+        """
+        self.diffs = diffs
+
+    @classmethod
+    def parse(cls, data):
+        """解析二进制的JSON diff列表"""
+        diffs = []
+        pos = 0
+        while pos < len(data):
+            operation = data[pos]
+            path_length, pos = read_packed_integer(data, pos + 1)
+            path = data[pos:pos + path_length].decode('utf-8', 'ignore')
+            pos += path_length
+            value = None
+            if operation != JSON_DIFF_REMOVE:
+                value_length, pos = read_packed_integer(data, pos)
+                value_data = data[pos:pos + value_length]
+                pos += value_length
+                value = parse_json(value_data[0], value_data[1:]) if value_data else None
+            diffs.append((operation, path, value))
+        return cls(diffs)
+
+    def sql_expression(self, column):
+        """
+        生成SET子句中的表达式
+
+        Args:
+            column: 已加反引号的列名
+
+        Returns:
+            tuple: (表达式模板, 参数列表)
+        """
+        expression = column
+        params = []
+        for operation, path, value in self.diffs:
+            if operation == JSON_DIFF_REMOVE:
+                expression = 'JSON_REMOVE(%s, %%s)' % expression
+                params.append(path)
+                continue
+            if operation == JSON_DIFF_REPLACE:
+                function = 'JSON_REPLACE'
+            elif path.endswith(']'):
+                function = 'JSON_ARRAY_INSERT'
+            else:
+                function = 'JSON_INSERT'
+            expression = '%s(%s, %%s, CAST(%%s AS JSON))' % (function, expression)
+            params.extend([path, json_text(value)])
+        return expression, params
+
+    def __repr__(self):
+        return 'JsonPartialUpdate(%r)' % (self.diffs,)
+
+
+class PartialUpdateRowsEvent(UpdateRowsEvent):
+    """
+    PARTIAL_UPDATE_ROWS_EVENT
+
+    格式与UPDATE_ROWS_EVENT_V2相同，每行在前镜像之后多一个value_options，
+    包含JSON局部更新时还有一个位图，标记后镜像中哪些JSON列是diff而不是完整的值。
+    """
+
+    def __init__(self, from_packet, event_size, table_map, ctl_connection, **kwargs):
+        # 事件头按UPDATE_ROWS_EVENT_V2解析（包括扩展数据部分）
+        event_type = from_packet.event_type
+        from_packet.event_type = BINLOG.UPDATE_ROWS_EVENT_V2
+        try:
+            super(PartialUpdateRowsEvent, self).__init__(from_packet, event_size, table_map,
+                                                         ctl_connection, **kwargs)
+        finally:
+            from_packet.event_type = event_type
+        self.event_type = event_type
+
+    def _fetch_one_row(self):
+        row = {}
+        row["before_values"] = self._read_column_data(self.columns_present_bitmap)
+
+        partial_bits = None
+        value_options = self.packet.read_length_coded_binary()
+        if value_options & PARTIAL_JSON_UPDATES:
+            json_columns = sum(1 for i, column in enumerate(self.columns)
+                               if column.type == FIELD_TYPE.JSON and BitGet(self.columns_present_bitmap2, i))
+            partial_bits = self.packet.read((json_columns + 7) // 8)
+
+        row["after_values"] = self._read_partial_column_data(self.columns_present_bitmap2, partial_bits)
+        return row
+
+    def _read_partial_column_data(self, cols_bitmap, partial_bits):
+        """读取后镜像，局部更新的JSON列读取为JsonPartialUpdate"""
+        if partial_bits is None:
+            return self._read_column_data(cols_bitmap)
+
+        values = {}
+        null_bitmap = self.packet.read((BitCount(cols_bitmap) + 7) / 8)
+        null_bitmap_index = 0
+        json_index = 0
+        for i, column in enumerate(self.columns):
+            if not BitGet(cols_bitmap, i):
+                values[column.name] = None
+                continue
+
+            partial = False
+            if column.type == FIELD_TYPE.JSON:
+                partial = bool(BitGet(partial_bits, json_index))
+                json_index += 1
+
+            if partial and not self._is_null(null_bitmap, null_bitmap_index):
+                length = self.packet.read_uint32()
+                values[column.name] = JsonPartialUpdate.parse(self.packet.read(length))
+            else:
+                values[column.name] = self._RowsEvent__read_values_name(
+                    column, null_bitmap, null_bitmap_index, cols_bitmap,
+                    column.unsigned, column.zerofill, column.fixed_binary_length, i)
+            null_bitmap_index += 1
+        return values
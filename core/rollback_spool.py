@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import zlib
+import struct
+
+# 记录头: 类型(1字节) + 长度(4字节)
+RECORD_HEADER = struct.Struct('<BI')
+# 块索引项: 块在数据文件中的偏移(8字节) + 块长度(4字节)
+BLOCK_ENTRY = struct.Struct('<QI')
+
+RECORD_STATEMENT = 0  # SQL语句
+RECORD_TXN_END = 1    # 事务结束标记
+RECORD_PARTS = 2      # 可合并语句的片段
+RECORD_COMMENT = 3    # 注释，不计入语句数
+
+DEFAULT_BLOCK_SIZE = 256 * 1024  # 每个块压缩前的大小
+
+
+class SpoolBudgetExceededError(OSError):
+    """回滚SQL暂存文件超出磁盘预算"""
+
+
+class RollbackSpool(object):
+    """
+    回滚SQL暂存文件
+
+    记录为长度前缀的二进制格式，按块缓存，每个块独立压缩后写入数据文件，
+    索引文件记录每个块的偏移和长度。倒序读取时通过内存映射按索引从后往前
+    逐块解压，块内记录倒序输出，不需要逐字符处理，且每条记录单独解码，
+    不会截断多字节字符。
+    """
+
+    def __init__(self, filename, compress=True, budget=0, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        初始化暂存文件
+
+        Args:
+            filename: 数据文件路径，索引文件为 filename + '.idx'
+            compress: 是否使用zlib压缩块
+            budget: 数据和索引文件的磁盘占用上限（字节），0表示不限制
+            block_size: 每个块压缩前的大小
+        """
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self.compress = compress
+        self.budget = budget or 0
+        self.block_size = block_size
+        self._data = open(self.filename, 'wb')
+        self._index = open(self.index_filename, 'wb')
+        self._block = bytearray()
+        self._offset = 0
+        self._block_count = 0
+        self.count = 0  # 记录总数（包括事务结束标记）
+        self.raw_size = 0  # 压缩前的总字节数
+
+    def _append(self, kind, payload):
+        """追加一条记录到当前块"""
+        self._block += RECORD_HEADER.pack(kind, len(payload))
+        self._block += payload
+        self.count += 1
+        self.raw_size += RECORD_HEADER.size + len(payload)
+        if len(self._block) >= self.block_size:
+            self._flush_block()
+
+    def _flush_block(self):
+        """压缩并写出当前块"""
+        if not self._block:
+            return
+        data = zlib.compress(bytes(self._block), 1) if self.compress else bytes(self._block)
+        if self.budget and self.size + len(data) + BLOCK_ENTRY.size > self.budget:
+            raise SpoolBudgetExceededError(
+                '回滚SQL暂存文件超出磁盘预算: 上限 %.1f MB, 暂存目录 %s' %
+                (self.budget / (1024 * 1024), os.path.dirname(os.path.abspath(self.filename))))
+        self._data.write(data)
+        self._index.write(BLOCK_ENTRY.pack(self._offset, len(data)))
+        self._offset += len(data)
+        self._block_count += 1
+        self._block = bytearray()
+
+    def write(self, sql, kind=RECORD_STATEMENT):
+        """写入一条SQL语句"""
+        if isinstance(sql, str):
+            sql = sql.encode('utf-8', 'ignore')
+        self._append(kind, sql)
+
+    def end_transaction(self, log_pos=None):
+        """
+        写入事务结束标记
+
+        Args:
+            log_pos: 事务的结束位置，倒序输出达到限制时用作下一页的结束位置
+        """
+        self._append(RECORD_TXN_END, b'%d' % log_pos if log_pos else b'')
+
+    @property
+    def size(self):
+        """数据和索引文件已写入的字节数"""
+        return self._offset + self._block_count * BLOCK_ENTRY.size
+
+    def close(self):
+        """结束写入"""
+        try:
+            if not self._data.closed:
+                self._flush_block()
+        finally:
+            for f in (self._data, self._index):
+                if not f.closed:
+                    f.close()
+
+    def _read_block(self, block):
+        """解析一个块中的记录"""
+        if self.compress:
+            block = zlib.decompress(block)
+        records = []
+        pos = 0
+        while pos < len(block):
+            kind, length = RECORD_HEADER.unpack_from(block, pos)
+            pos += RECORD_HEADER.size
+            records.append((kind, block[pos:pos + length]))
+            pos += length
+        return records
+
+    def reversed_records(self):
+        """
+        倒序生成记录
+
+        Yields:
+            tuple: (记录类型, SQL文本)，事务结束标记的文本为事务的结束位置（未记录时为空字符串）
+        """
+        self.close()
+        if self.count == 0:
+            return
+
+        with open(self.filename, 'rb') as f_data, open(self.index_filename, 'rb') as f_index:
+            data = mmap.mmap(f_data.fileno(), 0, access=mmap.ACCESS_READ)
+            index = mmap.mmap(f_index.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for i in range(self._block_count - 1, -1, -1):
+                    offset, length = BLOCK_ENTRY.unpack_from(index, i * BLOCK_ENTRY.size)
+                    for kind, payload in reversed(self._read_block(data[offset:offset + length])):
+                        yield kind, payload.decode('utf-8', 'ignore')
+            finally:
+                index.close()
+                data.close()
+
+    def remove(self):
+        """关闭并删除暂存文件"""
+        try:
+            self.close()
+        except OSError:
+            pass
+        for path in (self.filename, self.index_filename):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.remove()
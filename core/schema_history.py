@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import sqlite3
+import bisect
+import threading
+from .logger import get_logger
+from .table_metadata import COLUMN_FIELDS, fetch_columns
+
+# 获取logger实例
+logger = get_logger("SchemaHistory")
+
+_NAME = r'(?:`[^`]+`|[\w$]+)'
+_TABLE_NAME = r'(%s(?:\s*\.\s*%s)?)' % (_NAME, _NAME)
+_DDL_TABLES = [
+    re.compile(r'^\s*ALTER\s+(?:ONLINE\s+|IGNORE\s+)*TABLE\s+' + _TABLE_NAME, re.IGNORECASE),
+    re.compile(r'^\s*CREATE\s+(?:TEMPORARY\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?' + _TABLE_NAME, re.IGNORECASE),
+    re.compile(r'^\s*TRUNCATE\s+(?:TABLE\s+)?' + _TABLE_NAME, re.IGNORECASE),
+]
+_DROP_TABLES = re.compile(r'^\s*DROP\s+(?:TEMPORARY\s+)?TABLES?\s+(?:IF\s+EXISTS\s+)?(.+)$',
+                          re.IGNORECASE | re.DOTALL)
+_RENAME_TABLES = re.compile(r'^\s*RENAME\s+TABLES?\s+(.+)$', re.IGNORECASE | re.DOTALL)
+_ALTER_TABLE = re.compile(r'^\s*ALTER\s+(?:ONLINE\s+|IGNORE\s+)*TABLE\s+%s\s*(.*)$' % _TABLE_NAME,
+                          re.IGNORECASE | re.DOTALL)
+_TRUNCATE_TABLE = re.compile(r'^\s*TRUNCATE\s', re.IGNORECASE)
+
+# ALTER TABLE中可以撤销的子句
+_ADD_PRIMARY_KEY = re.compile(r'^ADD\s+(?:CONSTRAINT\s+(?:%s\s+)?)?PRIMARY\s+KEY\b[^(]*\((.*)\)' % _NAME,
+                              re.IGNORECASE | re.DOTALL)
+_KEEP_COLUMNS = re.compile(
+    r'^(?:ADD\s+(?:CONSTRAINT|UNIQUE|INDEX|KEY|FULLTEXT|SPATIAL|FOREIGN|CHECK)\b'
+    r'|DROP\s+(?:INDEX|KEY|FOREIGN\s+KEY|CHECK|CONSTRAINT)\b'
+    r'|ALTER\s+(?:INDEX|CHECK|CONSTRAINT)\b'
+    r'|ALTER\s+(?:COLUMN\s+)?%s\s+(?:SET|DROP)\s'
+    r'|RENAME\s+(?:INDEX|KEY)\b'
+    r'|(?:ENGINE|AUTO_INCREMENT|COMMENT|ROW_FORMAT|ALGORITHM|LOCK|KEY_BLOCK_SIZE|STATS_\w+|PACK_KEYS|CHECKSUM'
+    r'|MAX_ROWS|MIN_ROWS|AVG_ROW_LENGTH|(?:DEFAULT\s+)?(?:CHARSET|CHARACTER\s+SET|COLLATE))\b'
+    r'|(?:ENABLE|DISABLE)\s+KEYS\b|FORCE\s*$|ORDER\s+BY\b)' % _NAME, re.IGNORECASE)
+_ADD_COLUMN = re.compile(r'^ADD\s+(?:COLUMN\s+)?(\(.*\)|%s)' % _NAME, re.IGNORECASE | re.DOTALL)
+_RENAME_COLUMN = re.compile(r'^RENAME\s+COLUMN\s+(%s)\s+TO\s+(%s)\s*$' % (_NAME, _NAME), re.IGNORECASE)
+
+# 无法确定某个位置的表结构时返回的列定义：序号与事件中的任何列都不对应，
+# pymysqlreplication按事件中的列类型解码，列名为占位名 __dropped_col_N__
+UNKNOWN_COLUMNS = [dict(dict.fromkeys(COLUMN_FIELDS), COLUMN_TYPE='', COLUMN_KEY='', DATA_TYPE='',
+                        ORDINAL_POSITION=0)]
+
+
+def _split_name(name, default_schema):
+    """解析 `db`.`table` 形式的表名"""
+    parts = [p.strip().strip('`') for p in re.split(r'\s*\.\s*(?=(?:[^`]*`[^`]*`)*[^`]*$)', name.strip())]
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return default_schema, parts[0]
+
+
+def ddl_tables(query, default_schema=None):
+    """
+    获取DDL语句修改的表
+
+    Returns:
+        list: [(schema, table)]，不是表结构变更时为空列表
+    """
+    if not query:
+        return []
+    # 去掉注释（如DROP TABLE末尾的 /* generated by server */）
+    query = re.sub(r'/\*.*?\*/', ' ', query, flags=re.DOTALL)
+    for pattern in _DDL_TABLES:
+        match = pattern.match(query)
+        if match:
+            return [_split_name(match.group(1), default_schema)]
+    match = _DROP_TABLES.match(query)
+    if match:
+        names = re.findall(_TABLE_NAME, re.sub(r'\b(RESTRICT|CASCADE)\b', '', match.group(1), flags=re.IGNORECASE))
+        return [_split_name(name, default_schema) for name in names]
+    match = _RENAME_TABLES.match(query)
+    if match:
+        names = re.findall(_TABLE_NAME, re.sub(r'\bTO\b', ' ', match.group(1), flags=re.IGNORECASE))
+        return [_split_name(name, default_schema) for name in names]
+    return []
+
+
+def _split_clauses(text):
+    """按顶层的逗号拆分子句，括号和引号中的逗号不拆分"""
+    clauses, depth, quote, start = [], 0, None, 0
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '\'"`':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            clauses.append(text[start:i].strip())
+            start = i + 1
+    clauses.append(text[start:].strip())
+    return [clause for clause in clauses if clause]
+
+
+def _column_name(name):
+    return name.strip().strip('`')
+
+
+def revert_ddl(columns, query):
+    """
+    由DDL之后的列定义还原DDL之前的列定义
+
+    只能还原不丢失信息的变更：增加列、重命名列、增加主键、索引和表选项的变更、TRUNCATE。
+    删除列、修改列定义等无法从变更后的结构还原。
+
+    Returns:
+        list: DDL之前的列定义，无法还原时返回None
+    """
+    if not query:
+        return None
+    query = re.sub(r'/\*.*?\*/', ' ', query, flags=re.DOTALL).strip().rstrip(';')
+    if _TRUNCATE_TABLE.match(query):
+        return columns
+    match = _ALTER_TABLE.match(query)
+    if not match:
+        return None
+    columns = [dict(column) for column in columns]
+    # 子句按顺序执行，倒序撤销
+    for clause in reversed(_split_clauses(match.group(2))):
+        primary_key = _ADD_PRIMARY_KEY.match(clause)
+        if primary_key:
+            names = set(_column_name(re.split(r'[\s(]', part.strip(), 1)[0])
+                        for part in _split_clauses(primary_key.group(1)))
+            for column in columns:
+                if column['COLUMN_NAME'] in names and column.get('COLUMN_KEY') == 'PRI':
+                    column['COLUMN_KEY'] = ''
+            continue
+        if _KEEP_COLUMNS.match(clause):
+            continue
+        rename = _RENAME_COLUMN.match(clause)
+        if rename:
+            old, new = _column_name(rename.group(1)), _column_name(rename.group(2))
+            renamed = [column for column in columns if column['COLUMN_NAME'] == new]
+            if not renamed:
+                return None
+            renamed[0]['COLUMN_NAME'] = old
+            continue
+        added = _ADD_COLUMN.match(clause)
+        if not added:
+            return None
+        target = added.group(1)
+        if target.startswith('('):
+            names = [re.match(_NAME, part) for part in _split_clauses(target[1:-1])]
+            if not all(names):
+                return None
+            names = [_column_name(name.group(0)) for name in names]
+        else:
+            names = [_column_name(target)]
+        if any(name not in [column['COLUMN_NAME'] for column in columns] for name in names):
+            return None
+        columns = [column for column in columns if column['COLUMN_NAME'] not in names]
+    for ordinal, column in enumerate(columns, 1):
+        column['ORDINAL_POSITION'] = ordinal
+    return columns
+
+
+def position_key(log_file, log_pos):
+    """将binlog位置转换为可比较的键"""
+    try:
+        sequence = int(str(log_file).rsplit('.', 1)[-1])
+    except ValueError:
+        sequence = 0
+    return sequence, int(log_pos or 0)
+
+
+class SchemaHistory(object):
+    """
+    本地表结构历史
+
+    按binlog位置记录每个表的列定义版本，保存在本地SQLite文件中，
+    多次解析之间共享。首次使用时用一次批量查询写入当前的表结构，
+    之后解析行事件时按事件位置取当时有效的版本，不再逐表查询information_schema。
+    在binlog中遇到DDL时记录该表的结构变更位置和语句，DDL之后的事件第一次用到该表时
+    读取一次新的表结构，作为从DDL位置开始有效的版本；DDL之前的事件用DDL之后的版本
+    撤销该DDL得到当时的结构，无法撤销时（如删除列）返回UNKNOWN_COLUMNS。
+    """
+
+    def __init__(self, filename):
+        """
+        初始化表结构历史
+
+        Args:
+            filename: SQLite文件路径
+        """
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS versions ('
+                         'db TEXT, tbl TEXT, file_seq INTEGER, pos INTEGER, columns TEXT, '
+                         'PRIMARY KEY (db, tbl, file_seq, pos))')
+        self._db.execute('CREATE TABLE IF NOT EXISTS ddl ('
+                         'db TEXT, tbl TEXT, file_seq INTEGER, pos INTEGER, query TEXT, '
+                         'PRIMARY KEY (db, tbl, file_seq, pos))')
+        if 'query' not in [row[1] for row in self._db.execute('PRAGMA table_info(ddl)')]:
+            # 早期的文件没有记录DDL语句，这些DDL之前的结构无法还原
+            self._db.execute('ALTER TABLE ddl ADD COLUMN query TEXT')
+        self._db.commit()
+        self._versions = {}  # (db, tbl) -> ([位置键], [列定义])
+        self._ddl = {}       # (db, tbl) -> [位置键]
+        self._ddl_queries = {}  # (db, tbl) -> {位置键: DDL语句}
+        self._unknown = set()   # 已提示过无法还原的 (db, tbl, DDL位置键)
+        self.seeded = False
+        self.lookups = 0     # 本地查找次数
+        self.fetches = 0     # 查询服务器的次数
+
+    def _load(self, key):
+        """从SQLite加载一个表的版本和DDL位置"""
+        if key in self._versions:
+            return
+        positions, columns = [], []
+        for file_seq, pos, data in self._db.execute(
+                'SELECT file_seq, pos, columns FROM versions WHERE db = ? AND tbl = ? ORDER BY file_seq, pos', key):
+            positions.append((file_seq, pos))
+            columns.append(json.loads(data))
+        self._versions[key] = (positions, columns)
+        rows = list(self._db.execute(
+            'SELECT file_seq, pos, query FROM ddl WHERE db = ? AND tbl = ? ORDER BY file_seq, pos', key))
+        self._ddl[key] = [(file_seq, pos) for file_seq, pos, _ in rows]
+        self._ddl_queries[key] = dict(((file_seq, pos), query) for file_seq, pos, query in rows)
+
+    def _add_version(self, key, position, columns):
+        """记录一个表结构版本，与前一个版本相同时不重复记录"""
+        self._load(key)
+        positions, versions = self._versions[key]
+        index = bisect.bisect_right(positions, position)
+        if index > 0 and versions[index - 1] == columns:
+            return
+        positions.insert(index, position)
+        versions.insert(index, columns)
+        self._db.execute('INSERT OR REPLACE INTO versions (db, tbl, file_seq, pos, columns) VALUES (?, ?, ?, ?, ?)',
+                         key + position + (json.dumps(columns, ensure_ascii=False),))
+
+    def seed(self, connection, log_file, log_pos, schemas=None, tables=None):
+        """
+        用一次批量查询记录当前的表结构
+
+        Args:
+            connection: pymysql数据库连接
+            log_file, log_pos: 当前的binlog位置，表结构从该位置起有效
+            schemas: 只记录这些数据库，None表示所有非系统库
+            tables: 只记录这些表名
+
+        Returns:
+            list: 记录的表 [(schema, table)]
+        """
+        tables = fetch_columns(connection, schemas, tables)
+        position = position_key(log_file, log_pos)
+        with self._lock:
+            for key, columns in tables.items():
+                self._add_version(key, self._latest_ddl(key, position), columns)
+            self._db.commit()
+            self.seeded = True
+        logger.info(f"表结构历史: 记录了 {len(tables)} 个表的当前结构 ({self.filename})")
+        return list(tables)
+
+    def _latest_ddl(self, key, position):
+        """当前表结构的生效位置：不晚于position的最后一次DDL，没有DDL时为position本身"""
+        self._load(key)
+        ddl = self._ddl[key]
+        index = bisect.bisect_right(ddl, position)
+        if index > 0 and index == len(ddl):
+            return ddl[index - 1]
+        return position
+
+    def record_ddl(self, schema, table, log_file, log_pos, query=None):
+        """记录表结构变更的位置和语句，该位置之后的事件使用新的表结构"""
+        key = (schema, table)
+        position = position_key(log_file, log_pos)
+        with self._lock:
+            self._load(key)
+            ddl = self._ddl[key]
+            if position in ddl and self._ddl_queries[key].get(position) == query:
+                return
+            if position not in ddl:
+                bisect.insort(ddl, position)
+            self._ddl_queries[key][position] = query
+            self._db.execute('INSERT OR REPLACE INTO ddl (db, tbl, file_seq, pos, query) VALUES (?, ?, ?, ?, ?)',
+                             key + position + (query,))
+            self._db.commit()
+        logger.info(f"表结构历史: {schema}.{table} 在 {log_file}:{log_pos} 发生结构变更")
+
+    def columns(self, schema, table, log_file, log_pos, fetch):
+        """
+        获取表在指定位置有效的列定义
+
+        该位置之后有已知版本时，依次撤销两者之间的DDL得到当时的结构；
+        之后没有已知版本时，以服务器上的当前结构为准。
+
+        Args:
+            fetch: 本地没有有效版本时查询服务器的函数 fetch(schema, table)
+
+        Returns:
+            list: 与information_schema.columns查询结果相同格式的列定义；
+                无法确定当时的结构时为UNKNOWN_COLUMNS
+        """
+        key = (schema, table)
+        position = position_key(log_file, log_pos)
+        with self._lock:
+            self._load(key)
+            self.lookups += 1
+            positions, versions = self._versions[key]
+            ddl = self._ddl[key]
+            index = bisect.bisect_right(positions, position)
+            ddl_index = bisect.bisect_right(ddl, position)
+            last_ddl = ddl[ddl_index - 1] if ddl_index > 0 else None
+
+            if index > 0 and (last_ddl is None or positions[index - 1] >= last_ddl):
+                # 前一个版本之后没有DDL
+                return versions[index - 1]
+            if index < len(versions):
+                later_version = versions[index]
+                later_ddl = ddl[ddl_index:bisect.bisect_right(ddl, positions[index])]
+            else:
+                later_version = None
+                later_ddl = ddl[ddl_index:]
+            queries = [self._ddl_queries[key].get(ddl_pos) for ddl_pos in later_ddl]
+
+        if later_version is None:
+            # 本地没有之后的版本，查询一次服务器的当前结构
+            result = fetch(schema, table) or []
+            later_version = [dict((field, row.get(field)) for field in COLUMN_FIELDS) for row in result]
+            with self._lock:
+                self.fetches += 1
+                if later_version and not later_ddl:
+                    # 最后一次DDL之后的结构，从该DDL开始有效
+                    self._add_version(key, last_ddl or position, later_version)
+                    self._db.commit()
+            if not later_ddl:
+                return later_version or result
+        if not later_ddl:
+            return later_version
+
+        columns = later_version or None
+        for query in reversed(queries):
+            if columns is None:
+                break
+            columns = revert_ddl(columns, query)
+        if columns is None:
+            if (schema, table, later_ddl[-1]) not in self._unknown:
+                self._unknown.add((schema, table, later_ddl[-1]))
+                logger.warning(f"表结构历史: 无法还原 {schema}.{table} 在 {log_file}:{log_pos} 的表结构"
+                               f"（之后的DDL无法撤销），这些行按未知的表结构解码")
+            return UNKNOWN_COLUMNS
+        with self._lock:
+            self._add_version(key, last_ddl or position, columns)
+            self._db.commit()
+        return columns
+
+    def close(self):
+        """关闭SQLite文件"""
+        with self._lock:
+            self._db.close()
+
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def get_schema_history(host, port, directory=None):
+    """获取连接对应的表结构历史，同一进程内共享"""
+    safe_host = str(host).replace('.', '_').replace(':', '_')
+    filename = 'schema_history_%s_%s.db' % (safe_host, port)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, filename)
+    filename = os.path.abspath(filename)
+    with _histories_lock:
+        if filename not in _histories:
+            _histories[filename] = SchemaHistory(filename)
+        return _histories[filename]
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import pymysql
+from .logger import get_logger
+from .connection_pool import get_pool
+
+# 获取logger实例
+logger = get_logger("ServerMetadata")
+
+DEFAULT_TTL = 10.0  # 缓存有效期（秒）
+
+
+class ServerMetadata(object):
+    """一次查询得到的binlog文件列表、当前写入位置和server_id"""
+
+    def __init__(self, binlogs, master_file, master_pos, server_id):
+        """
+        Args:
+            binlogs: [(文件名, 文件大小)]
+            master_file, master_pos: SHOW MASTER STATUS的当前位置
+            server_id: 服务器的server_id
+        """
+        self.binlogs = binlogs
+        self.master_file = master_file
+        self.master_pos = master_pos
+        self.server_id = server_id
+        self.fetched_at = time.time()
+
+    @property
+    def binlog_files(self):
+        return [name for name, _ in self.binlogs]
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at
+
+    @classmethod
+    def query(cls, connection):
+        """从服务器读取"""
+        master_file, master_pos = query_master_status(connection)
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW MASTER LOGS")
+            binlogs = [(row[0], row[1] if len(row) > 1 else None) for row in cursor.fetchall()]
+
+            cursor.execute("SELECT @@server_id")
+            result = cursor.fetchone()
+            server_id = result[0] if result else None
+        return cls(binlogs, master_file, master_pos, server_id)
+
+
+def query_master_status(connection):
+    """
+    读取服务器当前的写入位置，不经过缓存
+
+    Returns:
+        tuple: (文件名, 位置)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW MASTER STATUS")
+        result = cursor.fetchone()
+    if not result:
+        raise ValueError('无法获取MASTER STATUS')
+    return result[0], result[1]
+
+
+def query_server_uuid(connection):
+    """
+    读取服务器的server_uuid，不经过缓存
+
+    Returns:
+        str: 没有该变量（如MariaDB）时为None
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT @@server_uuid")
+            result = cursor.fetchone()
+    except pymysql.MySQLError:
+        return None
+    return result[0] if result else None
+
+
+def _cache_key(connection_settings):
+    return (connection_settings.get('host'), connection_settings.get('port'), connection_settings.get('user'))
+
+
+class ServerMetadataCache(object):
+    """
+    按连接缓存的服务器元数据
+
+    获取文件列表、测试连接和开始解析都从这里读取，有效期内不再重复查询；
+    refresh_async() 在后台线程中刷新，下一次读取时直接使用。
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._refreshing = {}  # 正在后台刷新的连接 -> threading.Event
+        self._lock = threading.Lock()
+
+    def get(self, connection_settings, connection=None, refresh=False):
+        """
+        获取服务器元数据，缓存过期时同步刷新
+
+        Args:
+            connection: 用于查询的已有连接，为None时从连接池取出
+            refresh: 忽略缓存重新查询
+        """
+        key = _cache_key(connection_settings)
+        with self._lock:
+            entry = self._entries.get(key)
+            pending = self._refreshing.get(key)
+        if pending is not None and not refresh and (entry is None or entry.age >= self.ttl):
+            # 等待正在进行的后台刷新，不重复查询
+            pending.wait(self.ttl)
+            with self._lock:
+                entry = self._entries.get(key)
+        if entry is not None and not refresh and entry.age < self.ttl:
+            return entry
+        return self._refresh(key, connection_settings, connection)
+
+    def _refresh(self, key, connection_settings, connection=None):
+        if connection is None:
+            with get_pool(connection_settings).connection() as pooled:
+                entry = ServerMetadata.query(pooled)
+        else:
+            entry = ServerMetadata.query(connection)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def refresh_async(self, connection_settings):
+        """在后台线程中刷新，同一连接同时只有一个刷新"""
+        key = _cache_key(connection_settings)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            done = self._refreshing[key] = threading.Event()
+
+        def run():
+            try:
+                self._refresh(key, connection_settings)
+            except Exception as e:
+                logger.warning(f"后台刷新服务器元数据失败: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.pop(key, None)
+                done.set()
+
+        threading.Thread(target=run, name='server-metadata-refresh', daemon=True).start()
+
+    def invalidate(self, connection_settings=None):
+        """清除缓存，None表示全部"""
+        with self._lock:
+            if connection_settings is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(_cache_key(connection_settings), None)
+
+
+server_metadata_cache = ServerMetadataCache()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import threading
+import pymysql
+from .logger import get_logger
+
+# 获取logger实例
+logger = get_logger("ServerProbe")
+
+# 探测的服务器变量，不存在的变量（旧版本或MariaDB）值为None
+PROBE_VARIABLES = (
+    'version', 'version_comment', 'log_bin', 'binlog_format', 'binlog_row_image', 'binlog_row_metadata',
+    'binlog_checksum', 'gtid_mode', 'binlog_transaction_compression', 'binlog_rows_query_log_events',
+    'binlog_row_value_options', 'max_allowed_packet',
+)
+
+_REPLICATION_PRIVILEGES = ('REPLICATION SLAVE', 'REPLICATION CLIENT')
+
+CAPABILITIES_TTL = 60.0  # 探测结果的有效期（秒），服务器变量和权限可能在运行期间修改
+
+
+class ServerCapabilities(object):
+    """
+    服务器能力探测结果
+
+    用一次SHOW GLOBAL VARIABLES和一次SHOW GRANTS获取版本、binlog格式、行镜像、
+    行元数据、校验和、GTID、事务压缩和权限，解析器据此选择解析策略。
+    """
+
+    def __init__(self, variables, grants=None):
+        """
+        Args:
+            variables: {变量名: 值}
+            grants: SHOW GRANTS的结果，无法获取时为None
+        """
+        self.variables = dict((name, variables.get(name)) for name in PROBE_VARIABLES)
+        self.grants = grants
+        self.probed_at = time.time()
+
+    @classmethod
+    def probe(cls, connection):
+        """探测服务器"""
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW GLOBAL VARIABLES WHERE Variable_name IN (%s)" %
+                           ', '.join(['%s'] * len(PROBE_VARIABLES)), PROBE_VARIABLES)
+            variables = dict((str(name).lower(), value) for name, value in cursor.fetchall())
+            try:
+                cursor.execute("SHOW GRANTS")
+                grants = [row[0] for row in cursor.fetchall()]
+            except pymysql.MySQLError as e:
+                logger.warning(f"无法获取当前用户的权限: {str(e)}")
+                grants = None
+        return cls(variables, grants)
+
+    @property
+    def age(self):
+        return time.time() - self.probed_at
+
+    def _value(self, name):
+        value = self.variables.get(name)
+        return str(value).upper() if value is not None else None
+
+    @property
+    def version(self):
+        """版本号元组，如 (8, 0, 36)"""
+        numbers = re.findall(r'\d+', str(self.variables.get('version') or ''))[:3]
+        return tuple(int(n) for n in numbers) + (0,) * (3 - len(numbers))
+
+    @property
+    def is_mariadb(self):
+        text = '%s %s' % (self.variables.get('version'), self.variables.get('version_comment'))
+        return 'mariadb' in text.lower()
+
+    @property
+    def binlog_enabled(self):
+        return self._value('log_bin') in ('ON', '1')
+
+    @property
+    def row_format(self):
+        """binlog_format=ROW，只有ROW格式才有行事件"""
+        return self._value('binlog_format') == 'ROW'
+
+    @property
+    def full_row_image(self):
+        """binlog_row_image=FULL，未设置该变量的旧版本总是完整镜像"""
+        return self._value('binlog_row_image') in (None, 'FULL')
+
+    @property
+    def row_metadata_full(self):
+        """binlog_row_metadata=FULL（MySQL 8.0.1+），表映射事件自带列定义"""
+        return self._value('binlog_row_metadata') == 'FULL'
+
+    @property
+    def checksum(self):
+        return self._value('binlog_checksum') not in (None, 'NONE')
+
+    @property
+    def gtid(self):
+        return self._value('gtid_mode') in ('ON', 'ON_PERMISSIVE')
+
+    @property
+    def transaction_compression(self):
+        return self._value('binlog_transaction_compression') in ('ON', '1')
+
+    @property
+    def rows_query_events(self):
+        return self._value('binlog_rows_query_log_events') in ('ON', '1')
+
+    @property
+    def partial_json(self):
+        return self._value('binlog_row_value_options') == 'PARTIAL_JSON'
+
+    @property
+    def max_allowed_packet(self):
+        try:
+            return int(self.variables.get('max_allowed_packet'))
+        except (TypeError, ValueError):
+            return None
+
+    @property
+    def can_replicate(self):
+        """
+        是否有读取binlog所需的权限
+
+        Returns:
+            bool: 无法获取权限信息（如通过角色授权）时为None
+        """
+        if self.grants is None:
+            return None
+        text = ' '.join(grant.upper() for grant in self.grants if ' ON *.* ' in grant.upper())
+        if 'ALL PRIVILEGES' in text:
+            return True
+        return all(privilege in text for privilege in _REPLICATION_PRIVILEGES)
+
+    def summary(self):
+        """探测结果的一行摘要"""
+        return ('%s %s, binlog_format=%s, row_image=%s, row_metadata=%s, checksum=%s, gtid=%s, compression=%s' % (
+            'MariaDB' if self.is_mariadb else 'MySQL', self.variables.get('version'),
+            self.variables.get('binlog_format'), self.variables.get('binlog_row_image'),
+            self.variables.get('binlog_row_metadata'), self.variables.get('binlog_checksum'),
+            self.variables.get('gtid_mode'), self.variables.get('binlog_transaction_compression')))
+
+
+_capabilities = {}
+_capabilities_lock = threading.Lock()
+
+
+def get_server_capabilities(connection, connection_settings, refresh=False):
+    """
+    获取服务器能力，同一连接和用户在有效期内只探测一次
+
+    SHOW GRANTS的结果与用户有关，缓存按 (host, port, user) 区分。
+
+    Args:
+        connection_settings: 连接配置，用于区分缓存
+        refresh: 忽略缓存重新探测
+    """
+    key = (connection_settings.get('host'), connection_settings.get('port'), connection_settings.get('user'))
+    with _capabilities_lock:
+        capabilities = _capabilities.get(key)
+    if not refresh and capabilities is not None and capabilities.age < CAPABILITIES_TTL:
+        return capabilities
+    capabilities = ServerCapabilities.probe(connection)
+    with _capabilities_lock:
+        _capabilities[key] = capabilities
+    logger.info(f"服务器探测: {capabilities.summary()}")
+    return capabilities
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+DEFAULT_MAX_BYTES = 1024 * 1024  # 单条合并语句的默认上限
+MAX_BATCH_BYTES = 4 * 1024 * 1024  # 根据max_allowed_packet自动计算时的上限
+PARTS_SEPARATOR = '\x00'  # 暂存文件中片段的分隔符，转义后的SQL中不会出现
+
+
+def pack_parts(parts):
+    """将可合并语句的片段打包为字符串，用于写入暂存文件"""
+    return PARTS_SEPARATOR.join(str(part) for part in parts)
+
+
+def unpack_parts(text):
+    """解析pack_parts打包的片段"""
+    return tuple(text.split(PARTS_SEPARATOR))
+
+
+def parts_to_sql(parts):
+    """将单行的片段拼接为完整语句"""
+    prefix, fragment, suffix, start_pos, end_pos, time = parts
+    return '%s%s%s #start %s end %s time %s' % (prefix, fragment, suffix, start_pos, end_pos, time)
+
+
+class SqlCoalescer(object):
+    """
+    合并连续的同表同类型语句
+
+    连续的、前缀相同的行语句合并为一条语句输出（多值INSERT或 DELETE ... IN），
+    单条语句的字节数不超过max_bytes。其他语句在输出前先输出已缓存的合并语句，
+    以保持原有顺序。合并语句的位置注释覆盖批次中所有行的位置范围。
+    """
+
+    def __init__(self, emit, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        初始化合并器
+
+        Args:
+            emit: 输出一条SQL的函数
+            max_bytes: 单条合并语句的最大字节数，应小于服务器的max_allowed_packet
+        """
+        self.emit = emit
+        self.max_bytes = max_bytes
+        self._prefix = None
+        self._suffix = ''
+        self._fragments = []
+        self._size = 0
+        self._start_pos = None
+        self._end_pos = None
+        self._time = None
+        self.batches = 0  # 输出的合并语句数
+        self.rows = 0     # 合并的行数
+
+    def add(self, parts):
+        """
+        添加一行可合并的语句
+
+        Args:
+            parts: (前缀, 已转义的片段, 后缀, 起始位置, 结束位置, 时间)
+        """
+        prefix, fragment, suffix, start_pos, end_pos, time = parts
+        fragment_size = len(fragment.encode('utf-8')) + 2
+        if self._prefix is not None and (
+                prefix != self._prefix or
+                self._size + fragment_size > self.max_bytes):
+            self.flush()
+
+        if self._prefix is None:
+            self._prefix, self._suffix = prefix, suffix
+            self._size = len(prefix.encode('utf-8')) + len(suffix) + 64
+            self._start_pos, self._end_pos, self._time = start_pos, end_pos, time
+
+        self._fragments.append(fragment)
+        self._size += fragment_size
+        # 回滚时行是倒序加入的，位置注释取整个批次的范围
+        if int(start_pos) < int(self._start_pos):
+            self._start_pos = start_pos
+        if int(end_pos) > int(self._end_pos):
+            self._end_pos, self._time = end_pos, time
+        self.rows += 1
+
+    def add_statement(self, sql):
+        """添加一条不可合并的语句"""
+        self.flush()
+        self.emit(sql)
+
+    def flush(self):
+        """输出已缓存的合并语句"""
+        if self._prefix is None:
+            return
+        self.emit('%s%s%s #start %s end %s time %s' % (
+            self._prefix, ', '.join(self._fragments), self._suffix,
+            self._start_pos, self._end_pos, self._time))
+        self.batches += 1
+        self._prefix = None
+        self._fragments = []
+        self._size = 0
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import re
+from .logger import get_logger
+from .table_metadata import table_filter
+
+# 获取logger实例
+logger = get_logger("TableKeys")
+
+# 会改变表结构或索引的DDL
+DDL_PATTERN = re.compile(r'^\s*(ALTER|CREATE|DROP|RENAME|TRUNCATE)\b', re.IGNORECASE)
+
+
+def is_schema_change(query):
+    """判断QueryEvent中的语句是否可能改变表的键定义"""
+    return bool(query) and bool(DDL_PATTERN.match(query))
+
+
+class TableKeyCache(object):
+    """
+    表的行定位键缓存
+
+    每个表只查询一次information_schema，优先使用主键，
+    没有主键时使用列数最少的、所有列都非空的唯一索引，都没有时为空元组。
+    缓存与数据库连接绑定，遇到DDL时清空。
+    """
+
+    def __init__(self, connection):
+        """
+        初始化缓存
+
+        Args:
+            connection: pymysql数据库连接
+        """
+        self.connection = connection
+        self._keys = {}
+        self.lookups = 0  # 查询information_schema的次数
+
+    def get(self, schema, table):
+        """
+        获取表的定位键列
+
+        Returns:
+            tuple: 键列名，没有可用的键时为空元组；查询失败时返回None
+        """
+        key = (schema, table)
+        if key in self._keys:
+            return self._keys[key]
+
+        try:
+            columns = self._load(schema, table)
+        except Exception as e:
+            logger.warning(f"查询 {schema}.{table} 的键定义失败: {str(e)}")
+            return None
+        self._keys[key] = columns
+        return columns
+
+    def _load(self, schema, table):
+        """从information_schema读取表的主键或非空唯一索引"""
+        self.lookups += 1
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT INDEX_NAME, COLUMN_NAME, NULLABLE FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND NON_UNIQUE = 0 "
+                "ORDER BY INDEX_NAME, SEQ_IN_INDEX", (schema, table))
+            rows = cursor.fetchall()
+        columns = self._choose_key(rows)
+        if not columns:
+            logger.info(f"{schema}.{table} 没有主键或非空唯一索引，使用整行匹配")
+        return columns
+
+    @staticmethod
+    def _choose_key(rows):
+        """
+        从唯一索引的列中选择定位键，rows为 [(索引名, 列名, 是否可空)]
+
+        MySQL 8.0的函数索引中表达式部分的列名为NULL，无法按列定位，这样的索引不使用。
+        """
+        indexes = {}
+        nullable = set()
+        for index_name, column_name, is_nullable in rows:
+            indexes.setdefault(index_name, []).append(column_name)
+            if is_nullable == 'YES' or column_name is None:
+                nullable.add(index_name)
+
+        if 'PRIMARY' in indexes and 'PRIMARY' not in nullable:
+            return tuple(indexes['PRIMARY'])
+        candidates = [cols for name, cols in indexes.items() if name not in nullable]
+        if candidates:
+            return tuple(min(candidates, key=len))
+        return ()
+
+    def prewarm(self, schemas=None, tables=None, known_tables=None):
+        """
+        用一次查询读取匹配的所有表的键定义
+
+        Args:
+            schemas, tables: 过滤条件，与binlog流的only_schemas/only_tables相同
+            known_tables: 已知存在的表 [(schema, table)]，其中没有唯一索引的表缓存为空元组
+        """
+        where, params = table_filter(schemas, tables)
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT TABLE_SCHEMA, TABLE_NAME, INDEX_NAME, COLUMN_NAME, NULLABLE "
+                    "FROM information_schema.STATISTICS WHERE NON_UNIQUE = 0 AND " + where +
+                    " ORDER BY TABLE_SCHEMA, TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX", params)
+                rows = cursor.fetchall()
+        except Exception as e:
+            logger.warning(f"批量查询键定义失败: {str(e)}")
+            return
+
+        tables = dict((key, []) for key in known_tables or ())
+        for table_schema, table_name, index_name, column_name, is_nullable in rows:
+            tables.setdefault((table_schema, table_name), []).append((index_name, column_name, is_nullable))
+        for (table_schema, table_name), index_rows in tables.items():
+            self._keys[(table_schema, table_name)] = self._choose_key(index_rows)
+        logger.info(f"预加载了 {len(tables)} 个表的键定义")
+
+    def invalidate(self, tables=None):
+        """
+        清空缓存，下次使用时重新查询
+
+        Args:
+            tables: 只清空这些表 [(schema, table)]，None表示全部
+        """
+        if tables:
+            for key in tables:
+                self._keys.pop(key, None)
+            return
+        if self._keys:
+            logger.info(f"表结构变更，清空 {len(self._keys)} 个表的键定义缓存")
+        self._keys = {}
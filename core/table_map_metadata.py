@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import struct
+from pymysql.charset import charset_by_id
+from pymysqlreplication.constants import FIELD_TYPE
+from pymysqlreplication.row_event import TableMapEvent
+from pymysqlreplication.table import Table
+from .binlog_util import UNKNOWN_COLUMN_PREFIX
+from .partial_json import read_packed_integer
+
+# TableMapEvent可选元数据字段类型（binlog_row_metadata=FULL时写入，MySQL 8.0.1+）
+SIGNEDNESS = 1
+DEFAULT_CHARSET = 2
+COLUMN_CHARSET = 3
+COLUMN_NAME = 4
+SET_STR_VALUE = 5
+ENUM_STR_VALUE = 6
+GEOMETRY_TYPE = 7
+SIMPLE_PRIMARY_KEY = 8
+PRIMARY_KEY_WITH_PREFIX = 9
+ENUM_AND_SET_DEFAULT_CHARSET = 10
+ENUM_AND_SET_COLUMN_CHARSET = 11
+COLUMN_VISIBILITY = 12
+
+BINARY_COLLATION = 63
+
+# 网络包中事件体的偏移：OK字节 + 19字节的事件头部
+PACKET_BODY_OFFSET = 20
+
+# 每种列类型在元数据块中占用的字节数
+_METADATA_SIZE = {
+    FIELD_TYPE.FLOAT: 1, FIELD_TYPE.DOUBLE: 1,
+    FIELD_TYPE.TINY_BLOB: 1, FIELD_TYPE.MEDIUM_BLOB: 1, FIELD_TYPE.LONG_BLOB: 1, FIELD_TYPE.BLOB: 1,
+    FIELD_TYPE.GEOMETRY: 1, FIELD_TYPE.JSON: 1,
+    FIELD_TYPE.TIMESTAMP2: 1, FIELD_TYPE.DATETIME2: 1, FIELD_TYPE.TIME2: 1,
+    FIELD_TYPE.VARCHAR: 2, FIELD_TYPE.VAR_STRING: 2, FIELD_TYPE.STRING: 2,
+    FIELD_TYPE.NEWDECIMAL: 2, FIELD_TYPE.BIT: 2, FIELD_TYPE.ENUM: 2, FIELD_TYPE.SET: 2,
+}
+
+_NUMERIC_TYPES = (FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.INT24, FIELD_TYPE.LONG, FIELD_TYPE.LONGLONG,
+                  FIELD_TYPE.NEWDECIMAL, FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE)
+_CHARACTER_TYPES = (FIELD_TYPE.STRING, FIELD_TYPE.VAR_STRING, FIELD_TYPE.VARCHAR, FIELD_TYPE.TINY_BLOB,
+                    FIELD_TYPE.MEDIUM_BLOB, FIELD_TYPE.LONG_BLOB, FIELD_TYPE.BLOB)
+
+# 列类型对应的information_schema DATA_TYPE
+_DATA_TYPES = {
+    FIELD_TYPE.DECIMAL: 'decimal', FIELD_TYPE.NEWDECIMAL: 'decimal', FIELD_TYPE.TINY: 'tinyint',
+    FIELD_TYPE.SHORT: 'smallint', FIELD_TYPE.INT24: 'mediumint', FIELD_TYPE.LONG: 'int',
+    FIELD_TYPE.LONGLONG: 'bigint', FIELD_TYPE.FLOAT: 'float', FIELD_TYPE.DOUBLE: 'double',
+    FIELD_TYPE.TIMESTAMP: 'timestamp', FIELD_TYPE.TIMESTAMP2: 'timestamp', FIELD_TYPE.DATE: 'date',
+    FIELD_TYPE.NEWDATE: 'date', FIELD_TYPE.TIME: 'time', FIELD_TYPE.TIME2: 'time',
+    FIELD_TYPE.DATETIME: 'datetime', FIELD_TYPE.DATETIME2: 'datetime', FIELD_TYPE.YEAR: 'year',
+    FIELD_TYPE.BIT: 'bit', FIELD_TYPE.JSON: 'json', FIELD_TYPE.ENUM: 'enum', FIELD_TYPE.SET: 'set',
+    FIELD_TYPE.GEOMETRY: 'geometry', FIELD_TYPE.VARCHAR: 'varchar', FIELD_TYPE.VAR_STRING: 'varchar',
+    FIELD_TYPE.STRING: 'char', FIELD_TYPE.TINY_BLOB: 'blob', FIELD_TYPE.MEDIUM_BLOB: 'blob',
+    FIELD_TYPE.LONG_BLOB: 'blob', FIELD_TYPE.BLOB: 'blob',
+}
+
+
+def _bits(data, count):
+    """按高位在前读取位图"""
+    return [bool(data[i // 8] & (0x80 >> (i % 8))) if i // 8 < len(data) else False for i in range(count)]
+
+
+def _read_string(data, pos):
+    """读取长度编码的字符串，返回 (字符串, 新位置)"""
+    length, pos = read_packed_integer(data, pos)
+    return data[pos:pos + length].decode('utf-8', 'ignore'), pos + length
+
+
+def _read_str_values(data):
+    """读取ENUM/SET的可选值列表，每列一组"""
+    columns = []
+    pos = 0
+    while pos < len(data):
+        count, pos = read_packed_integer(data, pos)
+        values = []
+        for _ in range(count):
+            value, pos = _read_string(data, pos)
+            values.append(value)
+        columns.append(values)
+    return columns
+
+
+def _read_charsets(data, count, with_default):
+    """读取字符列的排序规则ID，with_default时为默认值加例外列表的格式"""
+    pos = 0
+    if not with_default:
+        collations = []
+        while pos < len(data):
+            collation, pos = read_packed_integer(data, pos)
+            collations.append(collation)
+        return collations
+    default, pos = read_packed_integer(data, pos)
+    collations = [default] * count
+    while pos < len(data):
+        index, pos = read_packed_integer(data, pos)
+        collation, pos = read_packed_integer(data, pos)
+        if index < count:
+            collations[index] = collation
+    return collations
+
+
+def parse_table_map(body):
+    """
+    解析TableMapEvent的事件体（不包含事件头和校验和）
+
+    Returns:
+        dict: column_types、column_meta（每列的 (实际类型, 最大长度)）和 optional（可选元数据字段）
+    """
+    pos = 8  # table_id(6) + flags(2)
+    schema_length = body[pos]
+    pos += 1 + schema_length + 1
+    table_length = body[pos]
+    pos += 1 + table_length + 1
+    column_count, pos = read_packed_integer(body, pos)
+    column_types = list(body[pos:pos + column_count])
+    pos += column_count
+
+    metadata_length, pos = read_packed_integer(body, pos)
+    metadata = body[pos:pos + metadata_length]
+    pos += metadata_length
+    column_meta = []
+    meta_pos = 0
+    for column_type in column_types:
+        size = _METADATA_SIZE.get(column_type, 0)
+        real_type, max_length = column_type, None
+        if column_type in (FIELD_TYPE.STRING, FIELD_TYPE.VAR_STRING) and size == 2:
+            value = (metadata[meta_pos] << 8) + metadata[meta_pos + 1]
+            if value >> 8 in (FIELD_TYPE.ENUM, FIELD_TYPE.SET):
+                real_type = value >> 8
+            else:
+                max_length = (((value >> 4) & 0x300) ^ 0x300) + (value & 0x00ff)
+        elif column_type == FIELD_TYPE.VARCHAR:
+            max_length = struct.unpack_from('<H', metadata, meta_pos)[0]
+        column_meta.append((real_type, max_length))
+        meta_pos += size
+
+    pos += (column_count + 7) // 8  # null位图
+
+    optional = {}
+    while pos < len(body):
+        field_type = body[pos]
+        length, pos = read_packed_integer(body, pos + 1)
+        optional[field_type] = body[pos:pos + length]
+        pos += length
+    return {'column_types': column_types, 'column_meta': column_meta, 'optional': optional}
+
+
+def _charset_name(collation):
+    """排序规则ID转换为 (字符集, 排序规则)，二进制类型为 (None, None)"""
+    if collation is None or collation == BINARY_COLLATION:
+        return None, None
+    charset = charset_by_id(collation)
+    return charset.name, charset.collation
+
+
+def column_schemas_from_metadata(table_map):
+    """
+    用可选元数据生成与information_schema.columns查询结果格式相同的列定义
+
+    Returns:
+        list: 列定义；可选元数据中没有列名（binlog_row_metadata=MINIMAL）时返回None
+    """
+    optional = table_map['optional']
+    if COLUMN_NAME not in optional:
+        return None
+    data = optional[COLUMN_NAME]
+    names = []
+    pos = 0
+    while pos < len(data):
+        name, pos = _read_string(data, pos)
+        names.append(name)
+    column_meta = table_map['column_meta']
+    if len(names) != len(column_meta):
+        return None
+
+    numeric = [i for i, (real_type, _) in enumerate(column_meta) if real_type in _NUMERIC_TYPES]
+    character = [i for i, (real_type, _) in enumerate(column_meta) if real_type in _CHARACTER_TYPES]
+    enum_set = [i for i, (real_type, _) in enumerate(column_meta)
+                if real_type in (FIELD_TYPE.ENUM, FIELD_TYPE.SET)]
+
+    unsigned = set()
+    if SIGNEDNESS in optional:
+        unsigned = set(i for i, bit in zip(numeric, _bits(optional[SIGNEDNESS], len(numeric))) if bit)
+
+    collations = {}
+    for default_field, column_field, indexes in ((DEFAULT_CHARSET, COLUMN_CHARSET, character),
+                                                 (ENUM_AND_SET_DEFAULT_CHARSET, ENUM_AND_SET_COLUMN_CHARSET,
+                                                  enum_set)):
+        if default_field in optional:
+            values = _read_charsets(optional[default_field], len(indexes), True)
+        elif column_field in optional:
+            values = _read_charsets(optional[column_field], len(indexes), False)
+        else:
+            continue
+        collations.update(zip(indexes, values))
+
+    str_values = {}
+    for field, real_type in ((ENUM_STR_VALUE, FIELD_TYPE.ENUM), (SET_STR_VALUE, FIELD_TYPE.SET)):
+        if field in optional:
+            indexes = [i for i, (t, _) in enumerate(column_meta) if t == real_type]
+            str_values.update(zip(indexes, _read_str_values(optional[field])))
+
+    primary_key = set()
+    if SIMPLE_PRIMARY_KEY in optional:
+        data = optional[SIMPLE_PRIMARY_KEY]
+        pos = 0
+        while pos < len(data):
+            index, pos = read_packed_integer(data, pos)
+            primary_key.add(index)
+    elif PRIMARY_KEY_WITH_PREFIX in optional:
+        data = optional[PRIMARY_KEY_WITH_PREFIX]
+        pos = 0
+        while pos < len(data):
+            index, pos = read_packed_integer(data, pos)
+            _, pos = read_packed_integer(data, pos)
+            primary_key.add(index)
+
+    schemas = []
+    for i, (name, (real_type, max_length)) in enumerate(zip(names, column_meta)):
+        charset_name, collation_name = _charset_name(collations.get(i))
+        data_type = _DATA_TYPES.get(real_type, 'blob')
+        if real_type == FIELD_TYPE.STRING and charset_name is None and i in collations:
+            data_type = 'binary'
+        if real_type in (FIELD_TYPE.ENUM, FIELD_TYPE.SET):
+            column_type = "%s(%s)" % (data_type, ','.join("'%s'" % v for v in str_values.get(i, [])))
+        else:
+            column_type = data_type + (' unsigned' if i in unsigned else '')
+        schemas.append({
+            'COLUMN_NAME': name,
+            'COLLATION_NAME': collation_name,
+            'CHARACTER_SET_NAME': charset_name,
+            'COLUMN_COMMENT': '',
+            'COLUMN_TYPE': column_type,
+            'COLUMN_KEY': 'PRI' if i in primary_key else '',
+            'ORDINAL_POSITION': i + 1,
+            'DATA_TYPE': data_type,
+            'CHARACTER_OCTET_LENGTH': max_length if data_type == 'binary' else None,
+        })
+    return schemas
+
+
+class _MetadataConnection(object):
+    """只在构造TableMapEvent时使用，列定义取自binlog，其他属性转发给原连接"""
+
+    def __init__(self, connection, column_schemas):
+        self._connection = connection
+        self._column_schemas = column_schemas
+
+    def _get_table_information(self, schema, table):
+        return self._column_schemas
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class TableMapMetadataEvent(TableMapEvent):
+    """
+    读取可选元数据的TableMapEvent
+
+    binlog_row_metadata=FULL时，列名、字符集、ENUM/SET取值和主键直接取自事件，
+    不查询information_schema；没有列名时与TableMapEvent相同，但查询到的列数与事件不一致时
+    （如当时的表结构未知而取到了DDL之后的结构）所有列只使用占位列名，不按位置错配列名。
+    ExtendedPacketWrapper用它替换TABLE_MAP_EVENT的事件类，binlog流需要允许该类（见ExtendedBinLogStreamReader）。
+    """
+
+    def __init__(self, from_packet, event_size, table_map, ctl_connection, **kwargs):
+        try:
+            # 网络包为OK字节和事件头部之后的事件体，不移动读取位置
+            body = from_packet.packet.get_all_data()[PACKET_BODY_OFFSET:PACKET_BODY_OFFSET + event_size]
+            column_schemas = column_schemas_from_metadata(parse_table_map(body))
+        except (IndexError, struct.error, KeyError, TypeError):
+            column_schemas = None
+        self.metadata_from_binlog = column_schemas is not None
+        if self.metadata_from_binlog:
+            ctl_connection = _MetadataConnection(ctl_connection, column_schemas)
+        super(TableMapMetadataEvent, self).__init__(from_packet, event_size, table_map,
+                                                    ctl_connection, **kwargs)
+        columns = getattr(self, 'columns', None)
+        if columns and not self.metadata_from_binlog and len(self.column_schemas) != self.column_count:
+            for i, column in enumerate(columns):
+                column.name = '%s%d__' % (UNKNOWN_COLUMN_PREFIX, i)
+                column.is_primary = False
+            self.table_obj = Table(self.column_schemas, self.table_id, self.schema, self.table, columns)
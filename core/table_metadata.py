@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pymysql
+from .logger import get_logger
+
+# 获取logger实例
+logger = get_logger("TableMetadata")
+
+SYSTEM_SCHEMAS = ('mysql', 'information_schema', 'performance_schema', 'sys')
+
+# 与pymysqlreplication查询information_schema.columns时的列一致
+COLUMN_FIELDS = ('COLUMN_NAME', 'COLLATION_NAME', 'CHARACTER_SET_NAME', 'COLUMN_COMMENT', 'COLUMN_TYPE',
+                 'COLUMN_KEY', 'ORDINAL_POSITION', 'DATA_TYPE', 'CHARACTER_OCTET_LENGTH')
+
+
+def table_filter(schemas=None, tables=None):
+    """
+    生成按过滤条件匹配表的WHERE子句
+
+    Args:
+        schemas: 只匹配这些数据库，None表示所有非系统库
+        tables: 只匹配这些表名（与binlog流的only_tables相同，不区分数据库）
+
+    Returns:
+        tuple: (WHERE子句, 参数列表)
+    """
+    where = 'TABLE_SCHEMA NOT IN (%s)' % ', '.join(['%s'] * len(SYSTEM_SCHEMAS))
+    params = list(SYSTEM_SCHEMAS)
+    if schemas:
+        where += ' AND TABLE_SCHEMA IN (%s)' % ', '.join(['%s'] * len(schemas))
+        params.extend(schemas)
+    if tables:
+        where += ' AND TABLE_NAME IN (%s)' % ', '.join(['%s'] * len(tables))
+        params.extend(tables)
+    return where, params
+
+
+def fetch_columns(connection, schemas=None, tables=None):
+    """
+    用一次查询读取匹配的所有表的列定义
+
+    Returns:
+        dict: {(schema, table): [列定义]}，列定义与information_schema.columns查询结果格式相同
+    """
+    where, params = table_filter(schemas, tables)
+    sql = ('SELECT TABLE_SCHEMA, TABLE_NAME, %s FROM information_schema.COLUMNS WHERE %s '
+           'ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION' % (', '.join(COLUMN_FIELDS), where))
+    with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    tables = {}
+    for row in rows:
+        key = (row.pop('TABLE_SCHEMA'), row.pop('TABLE_NAME'))
+        tables.setdefault(key, []).append(row)
+    return tables
+
+
+class TableColumnCache(object):
+    """
+    表的列定义缓存
+
+    解析前用一次批量查询读取过滤条件匹配的所有表，binlog流中出现新的table_id时
+    直接使用缓存，不再逐表查询information_schema。遇到DDL时丢弃该表的缓存，
+    下次使用时重新查询。
+    """
+
+    def __init__(self):
+        self._columns = {}
+        self.lookups = 0  # 使用缓存的次数
+        self.fetches = 0  # 查询服务器的次数
+
+    def prewarm(self, connection, schemas=None, tables=None):
+        """批量读取匹配的表的列定义"""
+        self._columns.update(fetch_columns(connection, schemas, tables))
+        logger.info(f"预加载了 {len(self._columns)} 个表的列定义")
+        return list(self._columns)
+
+    def columns(self, schema, table, log_file, log_pos, fetch):
+        """
+        获取表的列定义
+
+        Args:
+            fetch: 缓存中没有时查询服务器的函数 fetch(schema, table)
+        """
+        key = (schema, table)
+        if key in self._columns:
+            self.lookups += 1
+            return self._columns[key]
+        self.fetches += 1
+        columns = fetch(schema, table)
+        if columns:
+            self._columns[key] = columns
+        return columns
+
+    def record_ddl(self, schema, table, log_file, log_pos, query=None):
+        """表结构变更，丢弃该表的缓存"""
+        self._columns.pop((schema, table), None)
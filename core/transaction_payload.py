@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import queue
+import struct
+import threading
+from pymysqlreplication.event import BinLogEvent
+
+try:
+    from compression import zstd as _zstd  # Python 3.14+
+except ImportError:
+    _zstd = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TRANSACTION_PAYLOAD_EVENT = 0x28  # MySQL 8.0.20+ binlog_transaction_compression=ON
+
+# 事务载荷头部字段
+PAYLOAD_HEADER_END_MARK = 0
+PAYLOAD_SIZE_FIELD = 1
+PAYLOAD_COMPRESSION_TYPE_FIELD = 2
+PAYLOAD_UNCOMPRESSED_SIZE_FIELD = 3
+
+COMPRESSION_ZSTD = 0
+COMPRESSION_NONE = 255
+
+EVENT_HEADER_SIZE = 19     # 时间戳、类型、server_id、长度、位置、标志
+EVENT_SIZE_OFFSET = 9      # 事件长度在头部中的偏移
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+_END = object()  # 后台线程拆分完所有事件的标记
+
+
+class PayloadDecompressionError(Exception):
+    """无法解压事务载荷（缺少zstd库或数据损坏）"""
+
+
+def zstd_available():
+    """是否可以解压zstd压缩的事务载荷"""
+    return _zstd is not None or zstandard is not None
+
+
+def _zstd_decompressor():
+    """创建流式zstd解压器，优先使用标准库"""
+    if _zstd is not None:
+        return _zstd.ZstdDecompressor()
+    if zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise PayloadDecompressionError(
+        '遇到压缩的事务（binlog_transaction_compression=ON），需要安装zstandard: pip install zstandard')
+
+
+def _read_length_coded(data, pos):
+    """读取长度编码的整数，返回(值, 新位置)"""
+    first = data[pos]
+    if first < 251:
+        return first, pos + 1
+    size = {252: 2, 253: 3, 254: 8}.get(first)
+    if size is None:
+        return None, pos + 1
+    return int.from_bytes(data[pos + 1:pos + 1 + size], 'little'), pos + 1 + size
+
+
+class TransactionPayloadEvent(BinLogEvent):
+    """
+    TRANSACTION_PAYLOAD_EVENT
+
+    整个事务的事件被压缩后放在一个事件中。构造时只读取头部，压缩数据在
+    embedded_events() 中按块从包中读取并解压，每解出一个完整的事件就立即返回。
+    注意pymysql读取的网络包本身是完整的，按块读取避免的是压缩数据的额外拷贝
+    和解压结果的整体缓存，而不是网络包的内存。
+    """
+
+    def __init__(self, from_packet, event_size, table_map, ctl_connection, **kwargs):
+        super(TransactionPayloadEvent, self).__init__(from_packet, event_size, table_map,
+                                                      ctl_connection, **kwargs)
+        self.payload_size = None
+        self.compression_type = COMPRESSION_NONE
+        self.uncompressed_size = None
+        while True:
+            field_type = self._read_length_coded()
+            if field_type == PAYLOAD_HEADER_END_MARK:
+                break
+            field_length = self._read_length_coded()
+            if field_type == PAYLOAD_SIZE_FIELD:
+                self.payload_size = self._read_length_coded()
+            elif field_type == PAYLOAD_COMPRESSION_TYPE_FIELD:
+                self.compression_type = self._read_length_coded()
+            elif field_type == PAYLOAD_UNCOMPRESSED_SIZE_FIELD:
+                self.uncompressed_size = self._read_length_coded()
+            else:
+                self.packet.read(field_length)
+
+        if self.payload_size is None:
+            self.payload_size = self.event_size - self.packet.read_bytes
+        self._chunks = self._packet_chunks()
+
+    def _read_length_coded(self):
+        """读取长度编码的整数（pymysqlreplication读取8字节的值时会出错，超过16MB的载荷使用8字节）"""
+        first = self.packet.read(1)[0]
+        if first < 251:
+            return first
+        size = {252: 2, 253: 3, 254: 8}.get(first)
+        if size is None:
+            return None
+        return int.from_bytes(self.packet.read(size), 'little')
+
+    def _packet_chunks(self):
+        """从包中按块读取压缩数据"""
+        remaining = self.payload_size
+        while remaining > 0:
+            size = min(DECOMPRESS_CHUNK_SIZE, remaining)
+            yield self.packet.read(size)
+            remaining -= size
+
+    @classmethod
+    def from_body(cls, body):
+        """
+        从原始事件体（不含头部和校验和）构造，只用于解压其中的事件
+
+        Args:
+            body: 事件头部之后的字节
+        """
+        event = cls.__new__(cls)
+        event.payload_size = None
+        event.compression_type = COMPRESSION_NONE
+        event.uncompressed_size = None
+        pos = 0
+        while True:
+            field_type, pos = _read_length_coded(body, pos)
+            if field_type == PAYLOAD_HEADER_END_MARK:
+                break
+            field_length, pos = _read_length_coded(body, pos)
+            if field_type == PAYLOAD_SIZE_FIELD:
+                event.payload_size, pos = _read_length_coded(body, pos)
+            elif field_type == PAYLOAD_COMPRESSION_TYPE_FIELD:
+                event.compression_type, pos = _read_length_coded(body, pos)
+            elif field_type == PAYLOAD_UNCOMPRESSED_SIZE_FIELD:
+                event.uncompressed_size, pos = _read_length_coded(body, pos)
+            else:
+                pos += field_length
+        if event.payload_size is None:
+            event.payload_size = len(body) - pos
+        payload = memoryview(body)[pos:pos + event.payload_size]
+        event._chunks = (payload[offset:offset + DECOMPRESS_CHUNK_SIZE]
+                         for offset in range(0, len(payload), DECOMPRESS_CHUNK_SIZE))
+        return event
+
+    def _decompressed_chunks(self):
+        """按块生成解压后的数据"""
+        if self.compression_type == COMPRESSION_NONE:
+            for chunk in self._chunks:
+                yield chunk
+            return
+        if self.compression_type != COMPRESSION_ZSTD:
+            raise PayloadDecompressionError('不支持的事务压缩算法: %s' % self.compression_type)
+
+        decompressor = _zstd_decompressor()
+        for data in self._chunks:
+            try:
+                chunk = decompressor.decompress(bytes(data))
+            except Exception as e:
+                raise PayloadDecompressionError('解压事务载荷失败: %s' % str(e))
+            if chunk:
+                yield chunk
+
+    def embedded_events(self, prefetch=0):
+        """
+        流式生成载荷中的事件，压缩数据只能读取一次
+
+        Args:
+            prefetch: 大于0时在后台线程中读取、解压和拆分事件，最多预先准备prefetch个，
+                与调用方解析事件重叠进行（zstd解压时释放GIL）
+
+        Yields:
+            bytes: 一个完整的事件（包含19字节的头部，不包含校验和）
+        """
+        if prefetch > 0:
+            return self._prefetched_events(prefetch)
+        return self._split_events()
+
+    def _prefetched_events(self, prefetch):
+        """在后台线程中运行_split_events()，通过有界队列传递事件和异常"""
+        events = queue.Queue(prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            # 调用方提前关闭生成器时停止，不会一直阻塞在满的队列上
+            while not stop.is_set():
+                try:
+                    events.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for data in self._split_events():
+                    if not put(data):
+                        return
+            except Exception as e:
+                put(e)
+                return
+            put(_END)
+
+        reader = threading.Thread(target=produce, name='TransactionPayloadReader', daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = events.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def _split_events(self):
+        """按事件头部中的长度拆分解压后的数据"""
+        buffer = bytearray()
+        for chunk in self._decompressed_chunks():
+            buffer += chunk
+            pos = 0
+            while len(buffer) - pos >= EVENT_HEADER_SIZE:
+                size = struct.unpack_from('<I', buffer, pos + EVENT_SIZE_OFFSET)[0]
+                if size < EVENT_HEADER_SIZE:
+                    raise PayloadDecompressionError('事务载荷中的事件长度错误: %d' % size)
+                if len(buffer) - pos < size:
+                    break
+                yield bytes(buffer[pos:pos + size])
+                pos += size
+            del buffer[:pos]
+        if buffer:
+            raise PayloadDecompressionError('事务载荷不完整，剩余 %d 字节' % len(buffer))
+
+    def _dump(self):
+        super(TransactionPayloadEvent, self)._dump()
+        print("Payload size: %s" % self.payload_size)
+        print("Compression type: %s" % self.compression_type)
+        print("Uncompressed size: %s" % self.uncompressed_size)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import array
+import base64
+import decimal
+import datetime
+from .partial_json import JsonPartialUpdate
+
+# 非JSON类型的值编码为 {"$t": 类型, "v": 值}，字典也按此编码以免与类型标记混淆
+TYPE_KEY = '$t'
+_INT64_MIN, _INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+def pack(value):
+    """
+    将行数据中的值转换为只包含JSON类型的数据
+
+    只接受已知的数据类型，其他类型抛出TypeError；读取时不会执行任何代码。
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [pack(item) for item in value]
+    if isinstance(value, dict):
+        return {TYPE_KEY: 'map', 'v': [[pack(k), pack(v)] for k, v in value.items()]}
+    if isinstance(value, (bytes, bytearray)):
+        return {TYPE_KEY: 'bytes', 'v': base64.b64encode(bytes(value)).decode('ascii')}
+    if isinstance(value, decimal.Decimal):
+        return {TYPE_KEY: 'decimal', 'v': str(value)}
+    if isinstance(value, datetime.datetime):
+        return {TYPE_KEY: 'datetime', 'v': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {TYPE_KEY: 'date', 'v': value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {TYPE_KEY: 'time', 'v': value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {TYPE_KEY: 'timedelta', 'v': [value.days, value.seconds, value.microseconds]}
+    if isinstance(value, (set, frozenset)):
+        return {TYPE_KEY: 'set', 'v': [pack(item) for item in sorted(value, key=repr)]}
+    if isinstance(value, JsonPartialUpdate):
+        return {TYPE_KEY: 'json_diff', 'v': [[operation, path, pack(item)] for operation, path, item in value.diffs]}
+    raise TypeError('不支持编码的值类型: %s' % type(value).__name__)
+
+
+def pack_column(values):
+    """一列值：全部为int64范围内的整数时编码为定长数组，否则逐个编码"""
+    if values and all(type(v) is int and _INT64_MIN <= v <= _INT64_MAX for v in values):
+        return {TYPE_KEY: 'int64', 'v': base64.b64encode(array.array('q', values).tobytes()).decode('ascii')}
+    return [pack(v) for v in values]
+
+
+def unpack(data):
+    """pack()的逆操作"""
+    if isinstance(data, list):
+        return [unpack(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    kind, value = data.get(TYPE_KEY), data.get('v')
+    if kind == 'map':
+        return dict((_hashable(unpack(k)), unpack(v)) for k, v in value)
+    if kind == 'bytes':
+        return base64.b64decode(value)
+    if kind == 'decimal':
+        return decimal.Decimal(value)
+    if kind == 'datetime':
+        return datetime.datetime.fromisoformat(value)
+    if kind == 'date':
+        return datetime.date.fromisoformat(value)
+    if kind == 'time':
+        return datetime.time.fromisoformat(value)
+    if kind == 'timedelta':
+        return datetime.timedelta(days=value[0], seconds=value[1], microseconds=value[2])
+    if kind == 'set':
+        return set(_hashable(unpack(item)) for item in value)
+    if kind == 'json_diff':
+        return JsonPartialUpdate([(operation, path, unpack(item)) for operation, path, item in value])
+    if kind == 'int64':
+        values = array.array('q')
+        values.frombytes(base64.b64decode(value))
+        return values.tolist()
+    raise ValueError('未知的值类型标记: %r' % (kind,))
+
+
+def _hashable(value):
+    return tuple(_hashable(item) for item in value) if isinstance(value, list) else value
+
+
+def dumps(value):
+    """编码为JSON文本"""
+    return json.dumps(pack(value), ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(text):
+    """解析dumps()的结果"""
+    return unpack(json.loads(text))
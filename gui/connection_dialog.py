@@ -8,9 +8,11 @@ from PySide6.QtWidgets import (
 )
 from PySide6.QtCore import Qt
 from PySide6.QtGui import QIcon
-import pymysql
 import os
 
+from core.server_metadata import server_metadata_cache
+from core.connection_pool import get_pool
+
 
 class ConnectionDialog(QDialog):
     """数据库连接配置对话框"""
@@ -153,16 +155,20 @@ class ConnectionDialog(QDialog):
             if not conn_info["user"]:
                 raise ValueError("用户名不能为空")
 
-            # 测试连接
-            connection = pymysql.connect(
-                host=conn_info["host"],
-                port=conn_info["port"],
-                user=conn_info["user"],
-                passwd=conn_info["password"],
-                charset=conn_info["charset"],
-                connect_timeout=5
-            )
-            connection.close()
+            # 测试连接，连接归还连接池供获取文件列表和解析复用
+            connection_settings = {
+                'host': conn_info["host"],
+                'port': conn_info["port"],
+                'user': conn_info["user"],
+                'passwd': conn_info["password"],
+                'charset': conn_info["charset"],
+                'connect_timeout': 5
+            }
+            with get_pool(connection_settings).connection() as connection:
+                connection.ping(reconnect=False)
+
+            # 连接可用，在后台读取binlog列表和当前位置供后续使用
+            server_metadata_cache.refresh_async(connection_settings)
 
             self.status_label.setText("连接测试成功！")
             self.status_label.setStyleSheet("color: green;")
@@ -4,7 +4,6 @@
 import os
 import sys
 from datetime import datetime
-import pymysql
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QSplitter,
     QGroupBox, QFormLayout, QLineEdit, QSpinBox, QComboBox,
@@ -22,7 +21,11 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from gui.config_manager import ConfigManager
 from gui.connection_dialog import ConnectionDialog
 from gui.sql_highlighter import SqlHighlighter
-from core.binlog_parser import BinlogParser
+from core.binlog_parser import BinlogParser, ROWS_QUERY_ONLY, ROWS_QUERY_ANNOTATE
+from core.parse_options import OutputLimits, RollbackOptions, SqlOptions, MetadataOptions, CacheOptions, OutputOptions
+from core.change_store import ChangeStore, numpy_available, arrow_available
+from core.server_metadata import server_metadata_cache
+from core.connection_pool import close_all_pools
 from core.logger import get_logger
 
 # 获取logger实例
@@ -44,12 +47,17 @@ class ParseWorker(QThread):
         self.total_files = 0
         self.current_file_index = 0
         self.current_file_name = ""
+        self.seen_files = []  # 已开始解析的文件（flashback模式下按从新到旧的顺序）
 
     def run(self):
         """运行解析任务"""
         try:
             logger.info("ParseWorker开始运行")
 
+            # 服务器探测、表结构预加载和表结构历史初始化在解析线程中进行
+            self.progress_updated.emit(0, "正在探测服务器并准备表结构...")
+            self.parser.prepare()
+
             # 获取要解析的binlog文件范围
             start_file = self.parser.start_file
             end_file = self.parser.end_file or start_file
@@ -97,6 +105,9 @@ class ParseWorker(QThread):
         except Exception as e:
             logger.error(f"ParseWorker运行时发生错误: {str(e)}")
             self.error_occurred.emit(str(e))
+        finally:
+            # 数据库连接归还连接池，下次解析直接复用
+            self.parser.close()
 
     def update_progress(self, current_file_name):
         """更新进度 - 仅基于binlog文件数量计算"""
@@ -108,9 +119,12 @@ class ParseWorker(QThread):
                 self.total_files = len(self.file_range)
                 logger.info(f"动态扩展文件范围，新增文件: {current_file_name}, 总文件数: {self.total_files}")
 
-            # 计算进度
+            if current_file_name not in self.seen_files:
+                self.seen_files.append(current_file_name)
+
+            # 计算进度，按已开始解析的文件数计算，兼容flashback模式的倒序处理
             if hasattr(self, 'file_range') and current_file_name in self.file_range:
-                current_file_index = self.file_range.index(current_file_name)
+                current_file_index = self.seen_files.index(current_file_name)
                 # 简单的文件进度：每个文件占用相等的进度空间
                 progress = (current_file_index / max(self.total_files, 1)) * 100
                 status_msg = f"正在解析: {current_file_name} ({current_file_index + 1}/{self.total_files})"
@@ -166,6 +180,13 @@ class MainWindow(QMainWindow):
         self.filtered_sql_count = 0  # 被过滤的SQL计数
         self.matched_sql_count = 0  # 匹配的SQL计数
 
+        # 分页续读相关
+        self.next_page_position = None  # 上一次解析达到限制时的续读位置
+        self.resume_skip_statements = 0  # 本次解析需要跳过的语句数
+
+        # 变更统计模式下最近一次解析的列式存储，用于导出
+        self.change_store = None
+
         self.setup_ui()
         self.load_settings()
         logger.info("主窗口初始化完成")
@@ -462,13 +483,151 @@ class MainWindow(QMainWindow):
         self.no_pk_check = QCheckBox("不包含主键")
         parse_layout.addRow("", self.no_pk_check)
 
-        # 回滚间隔
+        self.compact_check = QCheckBox("按主键合并净变化")
+        self.compact_check.setToolTip("同一行在窗口内的多次变更只输出一条净变化语句")
+        parse_layout.addRow("", self.compact_check)
+
+        self.coalesce_check = QCheckBox("合并多行语句")
+        self.coalesce_check.setToolTip("连续的同表INSERT合并为多值INSERT，按主键的DELETE合并为 WHERE pk IN (...)，\n"
+                                       "单条语句大小不超过服务器的max_allowed_packet")
+        parse_layout.addRow("", self.coalesce_check)
+
+        self.key_where_check = QCheckBox("按主键定位行")
+        self.key_where_check.setChecked(False)
+        self.key_where_check.setToolTip("UPDATE/DELETE的WHERE只使用主键或非空唯一索引，\n"
+                                        "表没有可用的键时按整行匹配")
+        parse_layout.addRow("", self.key_where_check)
+
+        self.changed_only_check = QCheckBox("UPDATE只包含变化的列")
+        self.changed_only_check.setToolTip("UPDATE的SET只包含前后值不同的列，适合宽表和大字段")
+        parse_layout.addRow("", self.changed_only_check)
+
+        # 输出格式
+        self.output_format_combo = QComboBox()
+        self.output_format_combo.addItem("SQL语句", "sql")
+        self.output_format_combo.addItem("JSON Lines（每行一个变更）", "jsonl")
+        self.output_format_combo.addItem("原始binlog文件（mysqlbinlog可读）", "binlog")
+        self.output_format_combo.addItem("变更统计（内存列式存储，可导出CSV/NPZ/Arrow）", "store")
+        self.output_format_combo.setToolTip("JSON Lines: 每行变更输出一个JSON对象，每张表先输出一条列定义记录\n"
+                                            "原始binlog: 按过滤条件复制匹配事务的原始事件到新的binlog文件，不解码行数据\n"
+                                            "变更统计: 行变更保存在内存中，输出按表和类型的统计，保存时导出全部变更")
+        parse_layout.addRow("输出格式:", self.output_format_combo)
+
+        # 原始语句（需要binlog_rows_query_log_events=ON）
+        rows_query_layout = QHBoxLayout()
+        self.rows_query_combo = QComboBox()
+        self.rows_query_combo.addItem("不使用", None)
+        self.rows_query_combo.addItem("只输出原始语句", ROWS_QUERY_ONLY)
+        self.rows_query_combo.addItem("在行SQL上方注释原始语句", ROWS_QUERY_ANNOTATE)
+        self.rows_query_combo.setToolTip("使用Rows_query事件中的原始SQL，需要服务器开启binlog_rows_query_log_events")
+        self.rows_query_counts_check = QCheckBox("统计行数")
+        self.rows_query_counts_check.setToolTip("只输出原始语句时统计每条语句影响的行数，需要解码行数据")
+        rows_query_layout.addWidget(self.rows_query_combo)
+        rows_query_layout.addWidget(self.rows_query_counts_check)
+        parse_layout.addRow("原始语句:", rows_query_layout)
+
+        # 表结构历史
+        self.schema_history_check = QCheckBox("使用本地表结构历史")
+        self.schema_history_check.setToolTip("按事件位置使用当时的表结构解码，结构保存在本地文件中，多次解析之间复用")
+        parse_layout.addRow("", self.schema_history_check)
+        self.prewarm_metadata_check = QCheckBox("预加载表结构")
+        self.prewarm_metadata_check.setChecked(True)
+        self.prewarm_metadata_check.setToolTip("解析前用一次查询读取过滤条件匹配的所有表的列和键定义，表很多时减少逐表查询")
+        parse_layout.addRow("", self.prewarm_metadata_check)
+        self.decoded_cache_check = QCheckBox("缓存解码结果")
+        self.decoded_cache_check.setToolTip("保存解析范围内解码后的事件，只修改关键字、SQL类型、回滚等条件重新解析时不再下载和解码")
+        parse_layout.addRow("", self.decoded_cache_check)
+
+        # 本地binlog缓存
+        mirror_layout = QHBoxLayout()
+        self.mirror_check = QCheckBox("本地缓存binlog")
+        self.mirror_check.setToolTip("将下载的binlog事件保存在本地，再次解析同一范围时只下载新增部分（持续解析时不使用）")
+        self.mirror_budget_spin = QSpinBox()
+        self.mirror_budget_spin.setRange(0, 10485760)
+        self.mirror_budget_spin.setSpecialValueText("不限制")
+        self.mirror_budget_spin.setSuffix(" MB")
+        self.mirror_budget_spin.setToolTip("本地缓存的磁盘占用上限，超出时删除最久未使用的文件")
+        mirror_layout.addWidget(self.mirror_check)
+        mirror_layout.addWidget(self.mirror_budget_spin)
+        parse_layout.addRow("", mirror_layout)
+        prefetch_layout = QHBoxLayout()
+        self.prefetch_files_spin = QSpinBox()
+        self.prefetch_files_spin.setRange(0, 16)
+        self.prefetch_files_spin.setValue(2)
+        self.prefetch_files_spin.setSpecialValueText("不预取")
+        self.prefetch_files_spin.setSuffix(" 个文件")
+        self.prefetch_files_spin.setToolTip("使用本地缓存时，解析当前文件的同时在后台下载后面的文件")
+        self.prefetch_bandwidth_spin = QSpinBox()
+        self.prefetch_bandwidth_spin.setRange(0, 10240)
+        self.prefetch_bandwidth_spin.setSpecialValueText("不限速")
+        self.prefetch_bandwidth_spin.setSuffix(" MB/秒")
+        self.prefetch_bandwidth_spin.setToolTip("后台预取的下载限速")
+        prefetch_layout.addWidget(self.prefetch_files_spin)
+        prefetch_layout.addWidget(self.prefetch_bandwidth_spin)
+        parse_layout.addRow("后台预取:", prefetch_layout)
+
+        # 回滚分组
+        self.group_rollback_check = QCheckBox("回滚SQL按事务分组(BEGIN/COMMIT)")
+        self.group_rollback_check.setChecked(True)
+        parse_layout.addRow("", self.group_rollback_check)
+
+        self.rollback_group_size_spin = QSpinBox()
+        self.rollback_group_size_spin.setRange(0, 1000000)
+        self.rollback_group_size_spin.setSpecialValueText("按原事务")
+        parse_layout.addRow("分组大小:", self.rollback_group_size_spin)
+
+        # 回滚限速
+        throttle_layout = QHBoxLayout()
+        self.throttle_rows_spin = QSpinBox()
+        self.throttle_rows_spin.setRange(0, 100000000)
+        self.throttle_rows_spin.setSpecialValueText("不限速")
+        self.throttle_rows_spin.setSuffix(" 行/秒")
+        self.throttle_txns_spin = QSpinBox()
+        self.throttle_txns_spin.setRange(0, 1000000)
+        self.throttle_txns_spin.setSpecialValueText("不限速")
+        self.throttle_txns_spin.setSuffix(" 事务/秒")
+        throttle_layout.addWidget(self.throttle_rows_spin)
+        throttle_layout.addWidget(self.throttle_txns_spin)
+        parse_layout.addRow("回滚限速:", throttle_layout)
+
+        # 回滚间隔（不分组时使用）
         self.back_interval_spin = QDoubleSpinBox()
         self.back_interval_spin.setRange(0.0, 60.0)
         self.back_interval_spin.setValue(1.0)
         self.back_interval_spin.setSuffix(" 秒")
         parse_layout.addRow("回滚间隔:", self.back_interval_spin)
 
+        # 分组模式下使用分组大小和限速，不分组时使用回滚间隔
+        self.group_rollback_check.toggled.connect(self.on_group_rollback_toggled)
+        self.on_group_rollback_toggled(True)
+
+        # 回滚SQL暂存目录和磁盘上限
+        self.spool_dir_edit = QLineEdit()
+        self.spool_dir_edit.setPlaceholderText("留空表示当前目录，可指定tmpfs或临时卷")
+        parse_layout.addRow("回滚暂存目录:", self.spool_dir_edit)
+
+        self.spool_budget_spin = QSpinBox()
+        self.spool_budget_spin.setRange(0, 10485760)
+        self.spool_budget_spin.setSpecialValueText("不限制")
+        self.spool_budget_spin.setSuffix(" MB")
+        parse_layout.addRow("暂存磁盘上限:", self.spool_budget_spin)
+
+        # 输出限制（0表示不限制）
+        self.max_statements_spin = QSpinBox()
+        self.max_statements_spin.setRange(0, 999999999)
+        self.max_statements_spin.setSpecialValueText("不限制")
+        parse_layout.addRow("最大语句数:", self.max_statements_spin)
+
+        self.max_transactions_spin = QSpinBox()
+        self.max_transactions_spin.setRange(0, 999999999)
+        self.max_transactions_spin.setSpecialValueText("不限制")
+        parse_layout.addRow("最大事务数:", self.max_transactions_spin)
+
+        self.max_rows_spin = QSpinBox()
+        self.max_rows_spin.setRange(0, 999999999)
+        self.max_rows_spin.setSpecialValueText("不限制")
+        parse_layout.addRow("最大行数:", self.max_rows_spin)
+
         layout.addWidget(parse_group)
 
         # 控制按钮
@@ -478,9 +637,13 @@ class MainWindow(QMainWindow):
         self.stop_btn = QPushButton("停止解析")
         self.stop_btn.clicked.connect(self.stop_parse)
         self.stop_btn.setEnabled(False)
+        self.next_page_btn = QPushButton("下一页")
+        self.next_page_btn.clicked.connect(self.next_page)
+        self.next_page_btn.setEnabled(False)
 
         control_layout.addWidget(self.start_btn)
         control_layout.addWidget(self.stop_btn)
+        control_layout.addWidget(self.next_page_btn)
         layout.addLayout(control_layout)
 
         layout.addStretch()
@@ -556,7 +719,34 @@ class MainWindow(QMainWindow):
         self.only_dml_check.setChecked(parse_settings.get("only_dml", True))
         self.flashback_check.setChecked(parse_settings.get("flashback", False))
         self.no_pk_check.setChecked(parse_settings.get("no_pk", False))
+        self.compact_check.setChecked(parse_settings.get("compact", False))
+        self.coalesce_check.setChecked(parse_settings.get("coalesce", False))
+        self.key_where_check.setChecked(parse_settings.get("key_where", False))
+        self.changed_only_check.setChecked(parse_settings.get("changed_only", False))
+        output_format_index = self.output_format_combo.findData(parse_settings.get("output_format", "sql"))
+        self.output_format_combo.setCurrentIndex(max(output_format_index, 0))
+        rows_query_index = self.rows_query_combo.findData(parse_settings.get("rows_query"))
+        self.rows_query_combo.setCurrentIndex(max(rows_query_index, 0))
+        self.rows_query_counts_check.setChecked(parse_settings.get("rows_query_counts", False))
+        self.schema_history_check.setChecked(parse_settings.get("schema_history", False))
+        self.prewarm_metadata_check.setChecked(parse_settings.get("prewarm_metadata", True))
+        self.decoded_cache_check.setChecked(parse_settings.get("decoded_cache", False))
+        self.mirror_check.setChecked(parse_settings.get("mirror", False))
+        self.mirror_budget_spin.setValue(parse_settings.get("mirror_budget_mb", 0))
+        self.prefetch_files_spin.setValue(parse_settings.get("prefetch_files", 2))
+        self.prefetch_bandwidth_spin.setValue(parse_settings.get("prefetch_bandwidth_mb", 0))
         self.back_interval_spin.setValue(parse_settings.get("back_interval", 1.0))
+        group_rollback = parse_settings.get("group_rollback", True)
+        self.group_rollback_check.setChecked(group_rollback)
+        self.on_group_rollback_toggled(group_rollback)
+        self.rollback_group_size_spin.setValue(parse_settings.get("rollback_group_size", 0))
+        self.throttle_rows_spin.setValue(parse_settings.get("throttle_rows", 0))
+        self.throttle_txns_spin.setValue(parse_settings.get("throttle_txns", 0))
+        self.spool_dir_edit.setText(parse_settings.get("spool_dir", ""))
+        self.spool_budget_spin.setValue(parse_settings.get("spool_budget_mb", 0))
+        self.max_statements_spin.setValue(parse_settings.get("max_statements", 0))
+        self.max_transactions_spin.setValue(parse_settings.get("max_transactions", 0))
+        self.max_rows_spin.setValue(parse_settings.get("max_rows", 0))
 
         # 加载时间过滤设置
         enable_time_filter = parse_settings.get("enable_time_filter", True)
@@ -593,7 +783,30 @@ class MainWindow(QMainWindow):
             "only_dml": self.only_dml_check.isChecked(),
             "flashback": self.flashback_check.isChecked(),
             "no_pk": self.no_pk_check.isChecked(),
+            "compact": self.compact_check.isChecked(),
+            "coalesce": self.coalesce_check.isChecked(),
+            "key_where": self.key_where_check.isChecked(),
+            "changed_only": self.changed_only_check.isChecked(),
+            "output_format": self.output_format_combo.currentData(),
+            "rows_query": self.rows_query_combo.currentData(),
+            "rows_query_counts": self.rows_query_counts_check.isChecked(),
+            "schema_history": self.schema_history_check.isChecked(),
+            "prewarm_metadata": self.prewarm_metadata_check.isChecked(),
+            "decoded_cache": self.decoded_cache_check.isChecked(),
+            "mirror": self.mirror_check.isChecked(),
+            "mirror_budget_mb": self.mirror_budget_spin.value(),
+            "prefetch_files": self.prefetch_files_spin.value(),
+            "prefetch_bandwidth_mb": self.prefetch_bandwidth_spin.value(),
             "back_interval": self.back_interval_spin.value(),
+            "group_rollback": self.group_rollback_check.isChecked(),
+            "rollback_group_size": self.rollback_group_size_spin.value(),
+            "throttle_rows": self.throttle_rows_spin.value(),
+            "throttle_txns": self.throttle_txns_spin.value(),
+            "spool_dir": self.spool_dir_edit.text().strip(),
+            "spool_budget_mb": self.spool_budget_spin.value(),
+            "max_statements": self.max_statements_spin.value(),
+            "max_transactions": self.max_transactions_spin.value(),
+            "max_rows": self.max_rows_spin.value(),
             "enable_time_filter": self.enable_time_filter.isChecked(),
             "enable_keyword_filter": self.enable_keyword_filter.isChecked(),
             "keyword_filter_text": self.keyword_filter_edit.text()
@@ -627,6 +840,17 @@ class MainWindow(QMainWindow):
             self.end_file_combo.clear()
             logger.info(f"连接已改变为: {connection_name}，已清空binlog文件列表")
 
+            # 在后台预先读取binlog列表和当前位置，获取文件列表和开始解析时直接使用
+            conn_info = self.config_manager.get_connection(connection_name)
+            if conn_info:
+                server_metadata_cache.refresh_async({
+                    'host': conn_info['host'],
+                    'port': conn_info['port'],
+                    'user': conn_info['user'],
+                    'passwd': conn_info['password'],
+                    'charset': conn_info['charset']
+                })
+
     def on_time_filter_toggled(self, checked):
         """时间过滤开关切换事件"""
         self.start_time_edit.setEnabled(checked)
@@ -637,6 +861,13 @@ class MainWindow(QMainWindow):
         else:
             logger.info("禁用时间过滤")
 
+    def on_group_rollback_toggled(self, checked):
+        """回滚分组开关切换事件"""
+        self.rollback_group_size_spin.setEnabled(checked)
+        self.throttle_rows_spin.setEnabled(checked)
+        self.throttle_txns_spin.setEnabled(checked)
+        self.back_interval_spin.setEnabled(not checked)
+
     def new_connection(self):
         """新建连接"""
         dialog = ConnectionDialog(self)
@@ -728,47 +959,9 @@ class MainWindow(QMainWindow):
                 'charset': conn_info['charset']
             }
 
-            # 第一步：先通过直接SQL查询获取第一个可用的binlog文件
-            logger.info(f"正在查询第一个可用的binlog文件: {conn_info['host']}:{conn_info['port']}")
-
-            first_binlog_file = None
-            temp_connection = None
-            try:
-                # 创建临时连接以查询binlog文件列表
-                temp_connection = pymysql.connect(
-                    host=conn_info['host'],
-                    port=conn_info['port'],
-                    user=conn_info['user'],
-                    password=conn_info['password'],
-                    charset=conn_info['charset']
-                )
-
-                with temp_connection.cursor() as cursor:
-                    # 执行SHOW MASTER LOGS查询
-                    cursor.execute("SHOW MASTER LOGS")
-                    rows = cursor.fetchall()
-
-                    if rows:
-                        # 获取第一个binlog文件名
-                        first_binlog_file = rows[0][0]
-                        logger.info(f"查询到第一个binlog文件: {first_binlog_file}")
-                    else:
-                        raise Exception("未找到任何binlog文件")
-            finally:
-                if temp_connection:
-                    temp_connection.close()
-
-            # 第二步：使用获取到的第一个binlog文件创建临时解析器
-            logger.info(f"创建临时解析器以获取binlog文件列表，使用start_file: {first_binlog_file}")
-
-            temp_parser = BinlogParser(
-                connection_settings=connection_settings,
-                start_file=first_binlog_file,  # 使用查询到的第一个文件
-                start_pos=4
-            )
-
-            # 获取binlog文件列表
-            binlog_files = temp_parser.get_binlog_files()
+            # 从服务器元数据缓存读取，选择连接时已在后台刷新
+            logger.info(f"正在获取binlog文件列表: {conn_info['host']}:{conn_info['port']}")
+            binlog_files = server_metadata_cache.get(connection_settings).binlog_files
             logger.info(f"成功获取binlog文件列表: {binlog_files}")
 
             if not binlog_files:
@@ -869,6 +1062,23 @@ class MainWindow(QMainWindow):
             databases = self.databases_edit.text().strip().split() if self.databases_edit.text().strip() else None
             tables = self.tables_edit.text().strip().split() if self.tables_edit.text().strip() else None
 
+            # 续读时跳过上一页已输出的语句，仅对本次解析生效
+            skip_statements = self.resume_skip_statements
+            self.resume_skip_statements = 0
+
+            # 导出原始binlog时选择输出文件
+            export_binlog = None
+            if self.output_format_combo.currentData() == "binlog":
+                export_binlog, _ = QFileDialog.getSaveFileName(
+                    self, "导出binlog",
+                    f"binlog_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.bin",
+                    "binlog文件 (*.bin);;所有文件 (*.*)"
+                )
+                if not export_binlog:
+                    return
+
+            change_store = ChangeStore() if self.output_format_combo.currentData() == "store" else None
+
             # 创建解析器
             parser = BinlogParser(
                 connection_settings=connection_settings,
@@ -885,11 +1095,52 @@ class MainWindow(QMainWindow):
                 stop_never=False,
                 back_interval=self.back_interval_spin.value(),
                 only_dml=self.only_dml_check.isChecked(),
-                sql_type=sql_types
+                sql_type=sql_types,
+                limits=OutputLimits(
+                    max_statements=self.max_statements_spin.value(),
+                    max_transactions=self.max_transactions_spin.value(),
+                    max_rows=self.max_rows_spin.value(),
+                    skip_statements=skip_statements
+                ),
+                rollback=RollbackOptions(
+                    spool_dir=self.spool_dir_edit.text().strip() or None,
+                    spool_budget_mb=self.spool_budget_spin.value(),
+                    group_rollback=self.group_rollback_check.isChecked(),
+                    rollback_group_size=self.rollback_group_size_spin.value(),
+                    throttle_rows=self.throttle_rows_spin.value(),
+                    throttle_txns=self.throttle_txns_spin.value()
+                ),
+                sql=SqlOptions(
+                    compact=self.compact_check.isChecked(),
+                    coalesce=self.coalesce_check.isChecked(),
+                    key_where=self.key_where_check.isChecked(),
+                    changed_only=self.changed_only_check.isChecked(),
+                    rows_query=self.rows_query_combo.currentData(),
+                    rows_query_counts=self.rows_query_counts_check.isChecked()
+                ),
+                metadata=MetadataOptions(
+                    schema_history=self.schema_history_check.isChecked(),
+                    prewarm_metadata=self.prewarm_metadata_check.isChecked()
+                ),
+                cache=CacheOptions(
+                    mirror=self.mirror_check.isChecked(),
+                    mirror_budget_mb=self.mirror_budget_spin.value(),
+                    prefetch_files=self.prefetch_files_spin.value(),
+                    prefetch_bandwidth_mb=self.prefetch_bandwidth_spin.value(),
+                    decoded_cache=self.decoded_cache_check.isChecked()
+                ),
+                output=OutputOptions(
+                    export_binlog=export_binlog,
+                    json_lines=self.output_format_combo.currentData() == "jsonl",
+                    change_store=change_store
+                )
             )
+            self.change_store = change_store
 
             # 清空结果
             self.clear_results()
+            self.next_page_position = None
+            self.next_page_btn.setEnabled(False)
 
             # 初始化关键字过滤（必须在clear_results()之后）
             logger.info("开始初始化关键字过滤")
@@ -911,6 +1162,9 @@ class MainWindow(QMainWindow):
             else:
                 logger.info("关键字过滤未启用")
 
+            # 关键字过滤在解析器中执行，以便输出限制按过滤后的结果计数
+            parser.keywords = list(self.keyword_filters)
+
             # 创建工作线程
             self.parse_worker = ParseWorker(parser)
             self.parse_worker.sql_generated.connect(self.on_sql_generated)
@@ -934,6 +1188,23 @@ class MainWindow(QMainWindow):
             logger.error(f"启动解析失败: {str(e)}")
             QMessageBox.critical(self, "错误", f"启动解析失败: {str(e)}")
 
+    def next_page(self):
+        """从上一次达到限制的位置继续解析下一页"""
+        if not self.next_page_position:
+            return
+
+        position = self.next_page_position
+        logger.info(f"继续解析下一页: {position}")
+        if position.get('reverse'):
+            # 回滚SQL倒序输出，下一页回滚更早的变更：起始位置不变，结束位置前移
+            self.end_file_combo.setCurrentText(position['log_file'])
+            self.end_pos_spin.setValue(position['log_pos'] or 0)
+        else:
+            self.start_file_combo.setCurrentText(position['log_file'])
+            self.start_pos_spin.setValue(position['log_pos'])
+        self.resume_skip_statements = position['skip_statements']
+        self.start_parse()
+
     def stop_parse(self):
         """停止解析"""
         logger.info("用户停止解析")
@@ -948,27 +1219,7 @@ class MainWindow(QMainWindow):
 
     def on_sql_generated(self, sql):
         """处理生成的SQL - 使用批量更新机制"""
-        # 检查是否需要进行关键字过滤
-        if self.enable_keyword_filter.isChecked() and self.keyword_filters:
-            # 如果启用了关键字过滤，检查SQL是否包含任意一个关键字（OR逻辑）
-            sql_upper = sql.upper()
-            matched = any(keyword in sql_upper for keyword in self.keyword_filters)
-
-            if not matched:
-                # SQL不匹配任何关键字，跳过此SQL
-                self.filtered_sql_count += 1
-                # 每过滤100条SQL记录一次日志
-                if self.filtered_sql_count % 100 == 0:
-                    logger.debug(f"已过滤 {self.filtered_sql_count} 条SQL")
-                return
-            else:
-                # SQL匹配关键字，计数
-                self.matched_sql_count += 1
-                # 每匹配10条SQL记录一次日志
-                if self.matched_sql_count % 10 == 0:
-                    logger.debug(f"已匹配 {self.matched_sql_count} 条SQL")
-
-        # 添加到缓冲区
+        # 关键字过滤已在解析器中完成，这里直接添加到缓冲区
         self.sql_buffer.append(sql)
         self.sql_count += 1
 
@@ -1042,6 +1293,14 @@ class MainWindow(QMainWindow):
         # 刷新剩余的SQL缓冲区
         self.flush_sql_buffer()
 
+        # 从解析器获取关键字过滤统计和续读位置
+        if self.parse_worker:
+            parser = self.parse_worker.parser
+            self.matched_sql_count = parser.matched_sql_count
+            self.filtered_sql_count = parser.filtered_sql_count
+            self.next_page_position = parser.next_position
+        self.next_page_btn.setEnabled(self.next_page_position is not None)
+
         # 记录过滤统计信息
         logger.info(f"检查关键字过滤状态 - 启用: {self.enable_keyword_filter.isChecked()}, 关键字列表: {self.keyword_filters}")
         if self.enable_keyword_filter.isChecked() and self.keyword_filters:
@@ -1057,7 +1316,16 @@ class MainWindow(QMainWindow):
         self.start_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
         self.progress_bar.setVisible(False)
-        self.statusBar().showMessage("解析完成")
+        if self.next_page_position and self.next_page_position.get('reverse'):
+            self.statusBar().showMessage(
+                f"已达到输出限制，下一页回滚 {self.next_page_position['log_file']}:"
+                f"{self.next_page_position['log_pos'] or '文件末尾'} 及之前的变更")
+        elif self.next_page_position:
+            self.statusBar().showMessage(
+                f"已达到输出限制，下一页从 {self.next_page_position['log_file']}:"
+                f"{self.next_page_position['log_pos']} 继续")
+        else:
+            self.statusBar().showMessage("解析完成")
 
         if self.parse_worker:
             self.parse_worker = None
@@ -1089,15 +1357,24 @@ class MainWindow(QMainWindow):
 
     def save_results(self):
         """保存结果到文件"""
+        if self.change_store is not None and len(self.change_store) and \
+                self.output_format_combo.currentData() == "store":
+            self.export_change_store()
+            return
+
         text = self.result_text.toPlainText()
         if not text:
             QMessageBox.information(self, "提示", "没有可保存的内容")
             return
 
+        if self.output_format_combo.currentData() == "jsonl":
+            suffix, filters = "jsonl", "JSON Lines文件 (*.jsonl);;文本文件 (*.txt);;所有文件 (*.*)"
+        else:
+            suffix, filters = "sql", "SQL文件 (*.sql);;文本文件 (*.txt);;所有文件 (*.*)"
         filename, _ = QFileDialog.getSaveFileName(
             self, "保存结果",
-            f"binlog_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.sql",
-            "SQL文件 (*.sql);;文本文件 (*.txt);;所有文件 (*.*)"
+            f"binlog_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{suffix}",
+            filters
         )
 
         if filename:
@@ -1108,6 +1385,25 @@ class MainWindow(QMainWindow):
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"保存文件失败: {str(e)}")
 
+    def export_change_store(self):
+        """导出变更统计模式保存的全部行变更"""
+        filters = ["CSV文件 (*.csv)"]
+        if numpy_available():
+            filters.append("NumPy文件 (*.npz)")
+        if arrow_available():
+            filters.append("Arrow IPC文件 (*.arrow)")
+        filename, _ = QFileDialog.getSaveFileName(
+            self, "导出行变更",
+            f"binlog_changes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            ";;".join(filters)
+        )
+        if filename:
+            try:
+                self.change_store.export(filename)
+                QMessageBox.information(self, "成功", f"{len(self.change_store)} 行变更已导出到: {filename}")
+            except Exception as e:
+                QMessageBox.critical(self, "错误", f"导出失败: {str(e)}")
+
     def export_results(self):
         """导出结果（菜单项）"""
         self.save_results()
@@ -1135,4 +1431,5 @@ class MainWindow(QMainWindow):
         # 保存设置
         self.save_settings()
 
+        close_all_pools()
         event.accept()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import zlib
+import struct
+from pymysqlreplication.constants.BINLOG import (
+    QUERY_EVENT, ROTATE_EVENT, FORMAT_DESCRIPTION_EVENT, XID_EVENT, TABLE_MAP_EVENT, GTID_LOG_EVENT,
+    WRITE_ROWS_EVENT_V2, DELETE_ROWS_EVENT_V2,
+)
+from core.binlog_export import (BinlogExporter, BINLOG_MAGIC, EVENT_HEADER, HEADER_SIZE, CHECKSUM_SIZE,
+                                LOG_EVENT_BINLOG_IN_USE_F, STMT_END_F, parse_header, rows_flags)
+
+TIMESTAMP = 1700000000
+
+
+def event(event_type, body, log_pos=1000, flags=0, checksum=True):
+    data = EVENT_HEADER.pack(TIMESTAMP, event_type, 1, HEADER_SIZE + len(body) + (CHECKSUM_SIZE if checksum else 0),
+                             log_pos, flags) + body
+    if checksum:
+        data += struct.pack('<I', zlib.crc32(data) & 0xffffffff)
+    return data
+
+
+def query(sql, schema=b'db'):
+    return event(QUERY_EVENT, struct.pack('<IIBHH', 1, 0, len(schema), 0, 0) + schema + b'\x00' + sql)
+
+
+def table_map(table_id, schema, table):
+    return event(TABLE_MAP_EVENT, table_id.to_bytes(6, 'little') + b'\x00\x00' + bytes([len(schema)]) + schema +
+                 b'\x00' + bytes([len(table)]) + table + b'\x00' + b'\x01\x03\x00\x00')
+
+
+def rows(event_type, table_id, flags):
+    return event(event_type, table_id.to_bytes(6, 'little') + struct.pack('<H', flags) + b'\x02\x00\x01\xff\x00')
+
+
+def read_events(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:len(BINLOG_MAGIC)] == BINLOG_MAGIC
+    pos, events = len(BINLOG_MAGIC), []
+    while pos < len(data):
+        size = parse_header(data[pos:])[3]
+        events.append((pos, data[pos:pos + size]))
+        pos += size
+    return events
+
+
+def export(tmp_path, events, **kwargs):
+    path = str(tmp_path / 'out.bin')
+    with BinlogExporter(path, **kwargs) as exporter:
+        for data in events:
+            exporter.feed(data, True)
+    return exporter, read_events(path)
+
+
+def transaction(statement_rows):
+    return [event(GTID_LOG_EVENT, b'\x00' * 25), query(b'BEGIN')] + statement_rows + \
+        [event(XID_EVENT, struct.pack('<Q', 7))]
+
+
+def test_headers_and_checksums_are_rewritten(tmp_path):
+    fde = event(FORMAT_DESCRIPTION_EVENT, b'\x04\x00' + b'8.0.30'.ljust(50, b'\x00') + b'\x00' * 6 + b'\x01',
+                log_pos=120, flags=LOG_EVENT_BINLOG_IN_USE_F)
+    exporter, events = export(tmp_path, [fde] + transaction(
+        [table_map(5, b'db', b't'), rows(WRITE_ROWS_EVENT_V2, 5, STMT_END_F)]))
+
+    assert exporter.transactions == 1
+    assert [data[4] for _, data in events] == [FORMAT_DESCRIPTION_EVENT, GTID_LOG_EVENT, QUERY_EVENT,
+                                               TABLE_MAP_EVENT, WRITE_ROWS_EVENT_V2, XID_EVENT]
+    for offset, data in events:
+        _, _, _, size, log_pos, flags = parse_header(data)
+        assert log_pos == offset + size
+        assert struct.unpack('<I', data[-CHECKSUM_SIZE:])[0] == zlib.crc32(data[:-CHECKSUM_SIZE]) & 0xffffffff
+    assert not parse_header(events[0][1])[5] & LOG_EVENT_BINLOG_IN_USE_F
+
+
+def test_filtered_statement_gets_statement_end_flag(tmp_path):
+    exporter, events = export(tmp_path, transaction([
+        table_map(5, b'db', b't'), table_map(6, b'db', b'other'),
+        rows(WRITE_ROWS_EVENT_V2, 5, 0), rows(DELETE_ROWS_EVENT_V2, 6, STMT_END_F),
+    ]), only_tables=['t'])
+
+    kept_rows = [data for _, data in events if data[4] in (WRITE_ROWS_EVENT_V2, DELETE_ROWS_EVENT_V2)]
+    assert len(kept_rows) == 1
+    assert rows_flags(kept_rows[0]) & STMT_END_F
+    assert sum(1 for _, data in events if data[4] == TABLE_MAP_EVENT) == 1
+
+
+def test_unmatched_and_unfinished_transactions_are_skipped(tmp_path):
+    rotate = event(ROTATE_EVENT, struct.pack('<Q', 4) + b'mysql-bin.000002')
+    exporter, events = export(tmp_path, transaction(
+        [table_map(6, b'db', b'other'), rows(WRITE_ROWS_EVENT_V2, 6, STMT_END_F)]) +
+        [event(GTID_LOG_EVENT, b'\x00' * 25), query(b'BEGIN'), rotate], only_tables=['t'])
+
+    assert exporter.transactions == 0
+    assert exporter.skipped_transactions == 2
+    assert events == []
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import struct
+
+import pytest
+from pymysql.protocol import MysqlPacket
+from pymysqlreplication.constants.BINLOG import ROTATE_EVENT, FORMAT_DESCRIPTION_EVENT, QUERY_EVENT
+
+from core import binlog_mirror
+from core.binlog_mirror import (
+    BinlogMirror, BinlogPrefetcher, BinlogMirrorError, EVENT_HEADER, LOG_EVENT_ARTIFICIAL_F, EOF_PACKET,
+)
+
+FILE1 = 'mysql-bin.000001'
+FILE2 = 'mysql-bin.000002'
+
+
+def make_event(event_type, log_pos, body, flags=0, server_id=1):
+    size = EVENT_HEADER.size + len(body)
+    return EVENT_HEADER.pack(0, event_type, server_id, size, log_pos, flags) + body
+
+
+def rotate_body(log_file):
+    return struct.pack('<Q', 4) + log_file.encode()
+
+
+def binlog_file(log_file, bodies, next_file=None):
+    """构造一个binlog文件的事件：格式描述事件、查询事件，以及可选的轮换事件"""
+    events, pos = [], 4
+    for event_type, body in [(FORMAT_DESCRIPTION_EVENT, b'f' * 20)] + [(QUERY_EVENT, b) for b in bodies] + (
+            [(ROTATE_EVENT, rotate_body(next_file))] if next_file else []):
+        pos += EVENT_HEADER.size + len(body)
+        events.append(make_event(event_type, pos, body))
+    return events
+
+
+FILE1_EVENTS = binlog_file(FILE1, [b'q1' * 10, b'q2' * 10], next_file=FILE2)
+FILE2_EVENTS = binlog_file(FILE2, [b'q3' * 10])
+
+
+def server_packets(log_file, log_pos):
+    """服务器从指定位置发送的事件：虚拟轮换事件、（不在开头时）格式描述事件和之后的事件"""
+    packets = [make_event(ROTATE_EVENT, 0, struct.pack('<Q', log_pos) + log_file.encode(),
+                          LOG_EVENT_ARTIFICIAL_F, server_id=0)]
+    files = [(FILE1, FILE1_EVENTS), (FILE2, FILE2_EVENTS)]
+    started = False
+    for name, events in files:
+        if name == log_file:
+            started = True
+            if log_pos > 4:
+                packets.append(events[0][:13] + struct.pack('<I', 0) + events[0][17:])
+        elif not started:
+            continue
+        for event in events:
+            end = EVENT_HEADER.unpack_from(event)[4]
+            if name != log_file or end - len(event) >= log_pos:
+                packets.append(event)
+    return packets
+
+
+class FakeDumpConnection(object):
+    def __init__(self, events):
+        self.events = list(events)
+
+    def _read_packet(self):
+        if not self.events:
+            return MysqlPacket(EOF_PACKET, 'utf8')
+        return MysqlPacket(b'\x00' + self.events.pop(0), 'utf8')
+
+
+@pytest.fixture
+def dumps(monkeypatch):
+    """替换复制连接，记录每次下载的起始位置"""
+    started = []
+
+    def open_dump_connection(connection_settings, server_id, log_file, log_pos):
+        started.append((log_file, log_pos))
+        return FakeDumpConnection(server_packets(log_file, log_pos)), False, lambda: None
+
+    monkeypatch.setattr(binlog_mirror, 'open_dump_connection', open_dump_connection)
+    return started
+
+
+def read_all(source):
+    events = []
+    while True:
+        packet = source._read_packet()
+        if packet.is_eof_packet():
+            return events
+        events.append(packet.get_all_data()[1:])
+
+
+def test_sync_and_read(tmp_path, dumps):
+    """下载两个文件，从缓存读取时与服务器发送的事件相同"""
+    mirror = BinlogMirror(str(tmp_path), 'server')
+    mirror.sync({}, 1, [FILE1, FILE2], FILE2)
+    assert dumps == [(FILE1, 4)]
+    assert mirror.covers(FILE1)
+    assert mirror.covers(FILE2, mirror.end(FILE2))
+    assert not mirror.covers(FILE2)
+    assert os.path.getsize(mirror.path(FILE1)) == mirror.end(FILE1)
+
+    source = mirror.open_source(FILE1, 4, 'utf8')
+    assert read_all(source) == server_packets(FILE1, 4)
+    source.close()
+
+    # 从文件中间开始读取时先返回位置为0的格式描述事件
+    middle = EVENT_HEADER.unpack_from(FILE1_EVENTS[1])[4]
+    source = mirror.open_source(FILE1, middle, 'utf8')
+    assert read_all(source) == server_packets(FILE1, middle)
+    source.close()
+
+    with pytest.raises(BinlogMirrorError):
+        mirror.open_source(FILE1, middle - 1, 'utf8')
+
+    # 已缓存的文件不再下载，重新打开后索引仍然有效
+    mirror.sync({}, 1, [FILE1], FILE1)
+    assert dumps == [(FILE1, 4)]
+    reopened = BinlogMirror(str(tmp_path), 'server')
+    assert reopened.covers(FILE1)
+
+
+def test_sync_resumes_from_cached_end(tmp_path, dumps):
+    """正在写入的文件只下载追加的部分"""
+    mirror = BinlogMirror(str(tmp_path), 'server')
+    first_end = EVENT_HEADER.unpack_from(FILE1_EVENTS[1])[4]
+    mirror.sync({}, 1, [FILE1], FILE1, first_end)
+    assert mirror.end(FILE1) == first_end
+    mirror.sync({}, 1, [FILE1], FILE1)
+    assert dumps == [(FILE1, 4), (FILE1, first_end)]
+    assert mirror.covers(FILE1)
+
+
+def test_evict(tmp_path, dumps):
+    """超出预算时删除最久未使用且不在keep中的文件"""
+    mirror = BinlogMirror(str(tmp_path), 'server')
+    mirror.sync({}, 1, [FILE1, FILE2], FILE2)
+    mirror.budget = mirror.end(FILE2)
+    mirror.evict(keep=[FILE2])
+    assert mirror.end(FILE1) is None
+    assert not os.path.exists(mirror.path(FILE1))
+    assert mirror.end(FILE2) is not None
+
+
+def test_validate_server_uuid(tmp_path, dumps):
+    """server_uuid记录在索引中，变化时清空缓存"""
+    mirror = BinlogMirror(str(tmp_path), 'server')
+    mirror.validate('uuid-a')
+    mirror.sync({}, 1, [FILE1], FILE1)
+    mirror.validate('uuid-a')
+    assert mirror.covers(FILE1)
+    # MariaDB等无法获取server_uuid时不比较
+    mirror.validate(None)
+    assert mirror.covers(FILE1)
+
+    reopened = BinlogMirror(str(tmp_path), 'server')
+    reopened.validate('uuid-b')
+    assert reopened.end(FILE1) is None
+    assert not os.path.exists(reopened.path(FILE1))
+    assert BinlogMirror(str(tmp_path), 'server')._server_uuid == 'uuid-b'
+
+
+def test_validate_file_sizes(tmp_path, dumps):
+    """服务器上已写完的同名文件长度不同（RESET MASTER）时删除该文件，正在写入的文件不比较"""
+    mirror = BinlogMirror(str(tmp_path), 'server')
+    mirror.sync({}, 1, [FILE1, FILE2], FILE2)
+    end1, end2 = mirror.end(FILE1), mirror.end(FILE2)
+    mirror.validate('uuid-a', [(FILE1, end1), (FILE2, 100)])
+    assert mirror.end(FILE1) == end1
+    assert mirror.end(FILE2) == end2
+    mirror.validate('uuid-a', [(FILE1, end1 + 10), (FILE2, 100)])
+    assert mirror.end(FILE1) is None
+    assert mirror.end(FILE2) == end2
+
+
+def test_legacy_index(tmp_path, dumps):
+    """读取只有文件记录的旧格式索引"""
+    mirror = BinlogMirror(str(tmp_path), 'server')
+    mirror.sync({}, 1, [FILE1], FILE1)
+    index_path = os.path.join(mirror.directory, binlog_mirror.INDEX_FILE)
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(mirror._index, f)
+    reopened = BinlogMirror(str(tmp_path), 'server')
+    assert reopened.covers(FILE1)
+    assert reopened._server_uuid is None
+
+
+class FakeMirror(object):
+    """记录预取的下载，fail中的文件第一次下载失败"""
+
+    def __init__(self, fail=()):
+        self.synced = []
+        self.fail = set(fail)
+
+    def sync(self, connection_settings, server_id, files, target_file, target_pos=None, keep=None,
+             bandwidth=0, cancel=None):
+        self.synced.append((target_file, target_pos))
+        if target_file in self.fail:
+            self.fail.discard(target_file)
+            raise BinlogMirrorError('下载失败')
+
+
+def test_prefetcher():
+    """按顺序预取，ensure()等待文件下载完成"""
+    files = ['mysql-bin.%06d' % i for i in range(1, 5)]
+    mirror = FakeMirror()
+    prefetcher = BinlogPrefetcher(mirror, {}, 1, files, targets={files[-1]: 1000}, depth=1).start()
+    for log_file in files:
+        prefetcher.ensure(log_file)
+    prefetcher.stop()
+    assert mirror.synced == [(f, None) for f in files[:-1]] + [(files[-1], 1000)]
+    stats = prefetcher.stats()
+    assert 0.0 <= stats['overlap_ratio'] <= 1.0
+    # 不在预取列表中的文件直接返回
+    prefetcher.ensure('mysql-bin.000009')
+
+
+def test_prefetcher_retries_failed_file():
+    """后台下载失败的文件在ensure()中重新下载"""
+    files = ['mysql-bin.000001', 'mysql-bin.000002']
+    mirror = FakeMirror(fail=[files[0]])
+    prefetcher = BinlogPrefetcher(mirror, {}, 1, files, depth=2).start()
+    prefetcher.ensure(files[0])
+    prefetcher.ensure(files[1])
+    prefetcher.stop()
+    assert sorted(f for f, _ in mirror.synced) == [files[0], files[0], files[1]]
+
+
+def test_prefetch_with_concurrent_eviction(tmp_path, dumps):
+    """预取线程下载时解析线程读取、记录使用时间和删除文件，正在下载的文件不会被删除"""
+    mirror = BinlogMirror(str(tmp_path), 'server', budget_mb=1)
+    mirror.budget = 1
+    prefetcher = BinlogPrefetcher(mirror, {}, 1, [FILE1, FILE2], depth=2).start()
+    for _ in range(200):
+        mirror.touch([FILE1, FILE2])
+        mirror.evict()
+        mirror.covers(FILE1)
+    prefetcher.stop()
+    assert not prefetcher._errors
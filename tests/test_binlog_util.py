@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from core.binlog_util import key_where_values, compose_batch_parts, compose_sql_pattern, net_change_args
+
+
+def test_key_where_values_keeps_only_key_columns():
+    where = {'id': 1, 'name': 'a', 'note': None}
+    assert key_where_values(where, ('id',)) == {'id': 1}
+
+
+def test_key_where_values_falls_back_to_full_row():
+    """没有键列、键列缺失或为NULL时按整行匹配"""
+    assert key_where_values({'id': 1}, ()) is None
+    assert key_where_values({}, ('id',)) is None
+    assert key_where_values({'name': 'a'}, ('id',)) is None
+    assert key_where_values({'id': None, 'name': 'a'}, ('id',)) is None
+
+
+def test_compose_sql_pattern_uses_key_columns():
+    pattern = compose_sql_pattern('DELETE', 'db', 't', where_values={'id': 1, 'name': 'a'}, key_columns=('id',))
+    assert pattern == {'template': 'DELETE FROM `db`.`t` WHERE `id`=%s;', 'values': [1]}
+
+    pattern = compose_sql_pattern('DELETE', 'db', 't', where_values={'id': 1, 'name': 'a'})
+    assert pattern['template'] == 'DELETE FROM `db`.`t` WHERE `id`=%s AND `name`=%s LIMIT 1;'
+
+
+def test_compose_batch_parts_insert():
+    parts = compose_batch_parts('INSERT', 'db', 't', values={'id': 1, 'name': 'a'})
+    assert parts == {'prefix': 'INSERT INTO `db`.`t`(`id`, `name`) VALUES ', 'template': '(%s, %s)',
+                     'values': [1, 'a'], 'suffix': ';'}
+
+
+def test_compose_batch_parts_delete_by_primary_key():
+    parts = compose_batch_parts('DELETE', 'db', 't', where_values={'id': 3, 'name': 'a'}, primary_key='id')
+    assert parts == {'prefix': 'DELETE FROM `db`.`t` WHERE `id` IN (', 'template': '%s', 'values': [3],
+                     'suffix': ');'}
+
+    parts = compose_batch_parts('DELETE', 'db', 't', where_values={'a': 1, 'b': 2}, primary_key=('a', 'b'))
+    assert parts['prefix'] == 'DELETE FROM `db`.`t` WHERE (`a`, `b`) IN ('
+    assert parts['template'] == '(%s, %s)'
+    assert parts['values'] == [1, 2]
+
+
+def test_compose_batch_parts_not_batchable():
+    """UPDATE、没有主键或主键为NULL的DELETE不合并"""
+    assert compose_batch_parts('UPDATE', 'db', 't', set_values={'a': 1}, where_values={'a': 0}) is None
+    assert compose_batch_parts('DELETE', 'db', 't', where_values={'id': 1}) is None
+    assert compose_batch_parts('DELETE', 'db', 't', where_values={'id': None}, primary_key='id') is None
+
+
+def test_net_change_args():
+    row = {'id': 1, 'v': 'a'}
+    changed = {'id': 1, 'v': 'b'}
+    assert net_change_args(None, None) is None
+    assert net_change_args(row, dict(row)) is None
+    assert net_change_args(None, row) == {'kind': 'INSERT', 'values': row}
+    assert net_change_args(row, None) == {'kind': 'DELETE', 'where_values': row}
+    assert net_change_args(row, changed) == {'kind': 'UPDATE', 'set_values': changed, 'where_values': row}
+
+
+def test_net_change_args_no_pk():
+    args = net_change_args(None, {'a': 1, 'b': 2, 'v': 3}, primary_key=('a', 'b'), no_pk=True)
+    assert args == {'kind': 'INSERT', 'values': {'v': 3}}
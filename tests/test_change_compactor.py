@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import decimal
+import datetime
+import pytest
+from core.change_compactor import ChangeCompactor
+
+
+def net_changes(compactor, reverse=False):
+    return [(c['table'], c['before'], c['after'], c['start_pos'], c['end_pos'], c['count'])
+            for c in compactor.changes(reverse=reverse)]
+
+
+@pytest.mark.parametrize('max_keys', [1000, 1])
+def test_merge_keeps_first_before_and_last_after(tmp_path, max_keys):
+    """max_keys=1时每次合并都溢出到SQLite，结果应与内存中合并相同"""
+    with ChangeCompactor(spill_dir=str(tmp_path), max_keys=max_keys) as compactor:
+        compactor.add('db', 't', 'id', None, {'id': 1, 'v': 'a'}, 100, 110, 1)
+        compactor.add('db', 't', 'id', {'id': 2, 'v': 'x'}, {'id': 2, 'v': 'y'}, 110, 120, 2)
+        compactor.add('db', 't', 'id', {'id': 1, 'v': 'a'}, {'id': 1, 'v': 'b'}, 120, 130, 3)
+        compactor.add('db', 't', 'id', {'id': 2, 'v': 'y'}, None, 130, 140, 4)
+        assert compactor.row_changes == 4
+        assert net_changes(compactor) == [
+            ('t', None, {'id': 1, 'v': 'b'}, 100, 130, 2),
+            ('t', {'id': 2, 'v': 'x'}, None, 110, 140, 2),
+        ]
+        assert [c['before'] for c in compactor.changes(reverse=True)] == [{'id': 2, 'v': 'x'}, None]
+
+
+def test_primary_key_change_is_split(tmp_path):
+    with ChangeCompactor(spill_dir=str(tmp_path)) as compactor:
+        compactor.add('db', 't', 'id', {'id': 1, 'v': 'a'}, {'id': 5, 'v': 'a'}, 100, 110, 1)
+        assert net_changes(compactor) == [
+            ('t', {'id': 1, 'v': 'a'}, None, 100, 110, 1),
+            ('t', None, {'id': 5, 'v': 'a'}, 100, 110, 1),
+        ]
+
+
+def test_rows_without_primary_key_are_not_merged(tmp_path):
+    with ChangeCompactor(spill_dir=str(tmp_path)) as compactor:
+        compactor.add('db', 't', None, None, {'v': 1}, 100, 110, 1)
+        compactor.add('db', 't', None, {'v': 1}, None, 110, 120, 2)
+        assert len(compactor) == 2
+
+
+def test_spill_preserves_value_types(tmp_path):
+    row = {'id': 1, 'price': decimal.Decimal('1.10'), 'at': datetime.datetime(2024, 1, 2, 3, 4, 5),
+           'raw': b'\x00\xff', 'tags': {'a', 'b'}}
+    with ChangeCompactor(spill_dir=str(tmp_path), max_keys=1) as compactor:
+        compactor.add('db', 't', ('id',), None, row, 100, 110, 1)
+        compactor.add('db', 't', ('id',), row, dict(row, price=decimal.Decimal('2.20')), 110, 120, 2)
+        (change,) = list(compactor.changes())
+        assert change['before'] is None
+        assert change['after'] == dict(row, price=decimal.Decimal('2.20'))
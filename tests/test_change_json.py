@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import decimal
+from types import SimpleNamespace
+from pymysqlreplication.constants import FIELD_TYPE
+from core.change_json import JsonChangeWriter
+
+
+def rows_event(log_pos=200):
+    columns = [SimpleNamespace(name='id', type=FIELD_TYPE.LONG), SimpleNamespace(name='price', type=FIELD_TYPE.NEWDECIMAL)]
+    return SimpleNamespace(schema='db', table='t', timestamp=1700000000, columns=columns,
+                           packet=SimpleNamespace(log_pos=log_pos))
+
+
+def add_insert(writer, binlog_event, values):
+    header = writer.table_header(binlog_event, ('id',))
+    line = writer.encode_row(binlog_event, 'INSERT', {'values': values}, header, 'mysql-bin.000001', 100)
+    writer.add_row(binlog_event.schema, binlog_event.table, header, line)
+
+
+def test_xid_is_patched_on_commit():
+    lines = []
+    writer = JsonChangeWriter(lines.append)
+    binlog_event = rows_event()
+    add_insert(writer, binlog_event, {'id': 1, 'price': decimal.Decimal('1.10')})
+    add_insert(writer, binlog_event, {'id': 2, 'price': None})
+    assert lines == []
+
+    writer.commit(2 ** 64 - 1)
+    records = [json.loads(line) for line in lines]
+    assert [r['type'] for r in records] == ['table', 'insert', 'insert']
+    assert records[0]['columns'] == ['id', 'price']
+    assert records[0]['types'] == ['LONG', 'NEWDECIMAL']
+    assert 'xid' not in records[0]
+    assert records[1]['after'] == [1, '1.10']
+    assert records[1]['pk'] == [1]
+    assert all(r['xid'] == 2 ** 64 - 1 for r in records[1:])
+    assert (writer.rows, writer.transactions) == (2, 1)
+
+
+def test_header_only_once_per_table_and_null_xid_on_flush():
+    lines = []
+    writer = JsonChangeWriter(lines.append)
+    binlog_event = rows_event()
+    add_insert(writer, binlog_event, {'id': 1, 'price': None})
+    writer.commit(1)
+    add_insert(writer, binlog_event, {'id': 2, 'price': None})
+    writer.flush()
+    records = [json.loads(line) for line in lines]
+    assert [r['type'] for r in records] == ['table', 'insert', 'insert']
+    assert records[2]['xid'] is None
+    assert writer.transactions == 1
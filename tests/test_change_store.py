@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import pytest
+from core import change_store
+from core.change_store import ChangeStore
+
+BASE = 1700000000
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def store(request, monkeypatch):
+    """同一组数据分别用NumPy和纯Python实现计算"""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(change_store, 'numpy', None)
+    store = ChangeStore()
+    columns = ('id', 'name')
+    store.add('db', 'a', 'INSERT', {'values': {'id': 1, 'name': 'x'}}, columns, ('id',), BASE, 'bin.1', 100, 150)
+    store.add('db', 'a', 'UPDATE', {'before_values': {'id': 1, 'name': 'x'}, 'after_values': {'id': 1, 'name': 'y'}},
+              columns, ('id',), BASE + 30, 'bin.1', 200, 250)
+    store.add('db', 'b', 'DELETE', {'values': {'id': 7, 'name': None}}, columns, ('id',), BASE + 90, 'bin.2', 4, 80)
+    store.add('other', 'a', 'INSERT', {'values': {'id': 2, 'name': 'z'}}, columns, ('id',), BASE + 120, 'bin.2',
+              100, 180)
+    return store
+
+
+def test_select(store):
+    assert list(store.select()) == [0, 1, 2, 3]
+    assert list(store.select(schemas=['db'])) == [0, 1, 2]
+    assert list(store.select(tables=['a'], types=['insert'])) == [0, 3]
+    start = datetime.datetime.fromtimestamp(BASE + 30)
+    stop = datetime.datetime.fromtimestamp(BASE + 120)
+    assert list(store.select(start_time=start, stop_time=stop)) == [1, 2]
+    assert list(store.select(tables=['missing'])) == []
+
+
+def test_group_counts(store):
+    assert store.group_counts(by=('table',)) == [(('db.a',), 2), (('db.b',), 1), (('other.a',), 1)]
+    assert store.group_counts(by=('file', 'type'), selection=store.select(schemas=['db'])) == [
+        (('bin.1', 'INSERT'), 1), (('bin.1', 'UPDATE'), 1), (('bin.2', 'DELETE'), 1)]
+    assert store.group_counts(selection=store.select(tables=['missing'])) == []
+
+
+def test_change_round_trip(store):
+    change = store.change(1)
+    assert (change['schema'], change['table'], change['type'], change['file']) == ('db', 'a', 'UPDATE', 'bin.1')
+    assert (change['start_pos'], change['end_pos'], change['timestamp']) == (200, 250, BASE + 30)
+    assert change['pk'] == [1]
+    assert change['columns'] == ('id', 'name')
+    assert change['before'] == [1, 'x']
+    assert change['after'] == [1, 'y']
+    deleted = store.change(2)
+    assert deleted['before'] == [7, None]
+    assert deleted['after'] is None
+    assert [c['table'] for c in store.iter_changes(store.select(schemas=['other']))] == ['a']
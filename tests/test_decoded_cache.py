@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+from decimal import Decimal
+
+import pytest
+from pymysqlreplication.event import QueryEvent, RotateEvent, XidEvent
+from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent
+
+from core.decoded_cache import DecodedEventCache, RecordingStream, ReplayStream, _replay_event, artificial_rotate
+
+FILE1 = 'mysql-bin.000001'
+FILE2 = 'mysql-bin.000002'
+DECODE = {'schemas': ['db'], 'tables': None, 'rows_query': False, 'schema_source': 'server'}
+TABLE = ('db', 't', 'id', ('id', 'name', 'price', 'created'), (3, 15, 246, 12))
+ROWS = [{'values': {'id': i, 'name': 'n%d' % i, 'price': Decimal('%d.50' % i),
+                    'created': datetime.datetime(2024, 1, i + 1, 8, 0)}} for i in range(3)]
+UPDATE_ROWS = [{'before_values': {'id': 1, 'name': 'a'}, 'after_values': {'id': 1, 'name': None}}]
+
+
+def file1_events():
+    """服务器发送的第一个文件中的事件，开头是虚拟轮换事件"""
+    return [
+        artificial_rotate(FILE1, 120),
+        _replay_event('query', 100, 200, 'db', 'BEGIN', None, None, None, None),
+        _replay_event('write', 100, 300, None, None, None, TABLE, ([1, 1, 1, 1], None), ['rows', []]),
+        _replay_event('update', 100, 400, None, None, None, ('db', 't', 'id', ('id', 'name'), (3, 15)),
+                      (None, None), ['rows', []]),
+        _replay_event('xid', 100, 450, None, None, 7, None, None, None),
+        _replay_event('rotate', 100, 500, None, FILE2, 4, None, None, None),
+    ]
+
+
+def file2_events():
+    return [_replay_event('query', 101, 600, 'db', 'DROP TABLE t', None, None, None, None)]
+
+
+def with_rows(events):
+    events[2]._RowsEvent__rows = [dict(row) for row in ROWS]
+    events[3]._RowsEvent__rows = [dict(row) for row in UPDATE_ROWS]
+    return events
+
+
+class FakeStream(object):
+    """
+    按顺序返回事件，与BinLogStreamReader一样在返回事件后更新位置；
+    log_pos在读取第一个事件前已指向过滤掉的事件之后
+    """
+
+    def __init__(self, events, log_file, log_pos):
+        self.events = list(events)
+        self.log_file, self.log_pos = log_file, log_pos
+        self.closed = False
+
+    def fetchone(self):
+        if not self.events:
+            return None
+        event = self.events.pop(0)
+        if isinstance(event, RotateEvent):
+            self.log_file, self.log_pos = event.next_binlog, event.position
+        else:
+            self.log_pos = event.packet.log_pos
+        return event
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self.closed = True
+
+
+def summary(event):
+    """便于比较的事件内容"""
+    result = [type(event), event.timestamp, event.packet.log_pos]
+    if isinstance(event, QueryEvent):
+        result += [event.schema, event.query]
+    elif isinstance(event, RotateEvent):
+        result += [event.next_binlog, event.position]
+    elif isinstance(event, XidEvent):
+        result.append(event.xid)
+    elif isinstance(event, (WriteRowsEvent, UpdateRowsEvent)):
+        result += [event.schema, event.table, event.primary_key, [tuple(c) for c in event.columns],
+                   event.columns_present_bitmap, event.rows]
+    return result
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DecodedEventCache(str(tmp_path), 'server')
+
+
+def record(cache, events, log_file, log_pos, stream_pos=None):
+    stream = FakeStream(events, log_file, stream_pos or log_pos)
+    recording = RecordingStream(stream, cache, DECODE, lambda tables: 'v1', log_file, log_pos)
+    returned = list(recording)
+    recording.close()
+    assert stream.closed
+    return returned
+
+
+def test_round_trip(cache):
+    """记录的事件重放时内容和类型不变，行数据按列保存"""
+    events = with_rows(file1_events()) + file2_events()
+    record(cache, events, FILE1, 120)
+
+    first = cache.find(FILE1, 120, DECODE, lambda tables: 'v1')
+    assert (first['start'], first['end'], first['complete']) == (120, 500, True)
+    assert [tuple(table) for table in first['tables']] == [('db', 't')]
+    second = cache.find(FILE2, 4, DECODE, lambda tables: 'v1')
+    assert (second['start'], second['end'], second['complete']) == (4, 600, False)
+
+    # 虚拟轮换事件不保存，重放时重新生成
+    replayed = list(cache.read(first))
+    assert [summary(e) for e in replayed] == [summary(e) for e in with_rows(file1_events())[1:]]
+    assert [summary(e) for e in cache.read(first, 300)] == [summary(e) for e in with_rows(file1_events())[3:]]
+
+
+def test_segment_starts_at_requested_position(cache):
+    """段的起始位置取自请求的位置，而不是读取第一个事件前stream的位置"""
+    record(cache, with_rows(file1_events()), FILE1, 120, stream_pos=300)
+    segment = cache.find(FILE1, 120, DECODE, lambda tables: 'v1')
+    assert segment is not None
+    assert segment['start'] == 120
+
+
+def test_find_checks_schema_version_and_decode(cache):
+    record(cache, with_rows(file1_events()), FILE1, 120)
+    assert cache.find(FILE1, 200, DECODE, lambda tables: 'v2') is None
+    assert cache.find(FILE1, 500, DECODE, lambda tables: 'v1') is None
+    assert cache.find(FILE1, 200, dict(DECODE, schemas=None), lambda tables: 'v1') is None
+    assert cache.find(FILE1, 200, dict(DECODE, schemas=['db'], tables=['t']), lambda tables: 'v1') is not None
+
+
+def test_replay_stream_continues_from_server(cache):
+    """缓存之后的部分从tail打开的stream读取"""
+    record(cache, with_rows(file1_events()), FILE1, 120)
+    segment = cache.find(FILE1, 120, DECODE, lambda tables: 'v1')
+    opened = []
+
+    def tail(log_file, log_pos):
+        # 与解析器相同，从服务器读取的部分继续记录
+        opened.append((log_file, log_pos))
+        return RecordingStream(FakeStream([artificial_rotate(FILE2, 4)] + file2_events(), log_file, log_pos),
+                               cache, DECODE, lambda tables: 'v1', log_file, log_pos)
+
+    stream = ReplayStream(cache, [(segment, 120)], tail)
+    events = list(stream)
+    stream.close()
+    assert opened == [(FILE2, 4)]
+    assert [summary(e) for e in events[1:6]] == [summary(e) for e in with_rows(file1_events())[1:]]
+    assert summary(events[-1]) == summary(file2_events()[0])
+    assert (stream.log_file, stream.log_pos) == (FILE2, 600)
+    assert cache.find(FILE2, 4, DECODE, lambda tables: 'v1')['start'] == 4
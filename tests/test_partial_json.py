@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import struct
+
+from pymysqlreplication.constants import FIELD_TYPE
+from pymysqlreplication.packet import BinLogPacketWrapper, JSONB_TYPE_INT32, JSONB_TYPE_STRING
+
+from core.partial_json import (
+    JsonPartialUpdate, PartialUpdateRowsEvent, read_packed_integer, JSON_DIFF_REPLACE, JSON_DIFF_INSERT,
+    JSON_DIFF_REMOVE,
+)
+
+
+def test_sql_expression_applies_diffs_in_order():
+    update = JsonPartialUpdate([
+        (JSON_DIFF_REPLACE, '$.a', 1),
+        (JSON_DIFF_INSERT, '$.b', {b'k': [b'v', None]}),
+        (JSON_DIFF_INSERT, '$.c[0]', 'x'),
+        (JSON_DIFF_REMOVE, '$.d', None),
+    ])
+    expression, params = update.sql_expression('`doc`')
+    assert expression == ('JSON_REMOVE(JSON_ARRAY_INSERT(JSON_INSERT(JSON_REPLACE(`doc`, %s, CAST(%s AS JSON)), '
+                          '%s, CAST(%s AS JSON)), %s, CAST(%s AS JSON)), %s)')
+    assert params == ['$.a', '1', '$.b', '{"k": ["v", null]}', '$.c[0]', '"x"', '$.d']
+
+
+def test_sql_expression_without_diffs():
+    assert JsonPartialUpdate([]).sql_expression('`doc`') == ('`doc`', [])
+
+
+def json_string(text):
+    """二进制JSON格式的字符串"""
+    data = text.encode('utf-8')
+    return bytes([JSONB_TYPE_STRING, len(data)]) + data
+
+
+def json_int(value):
+    return bytes([JSONB_TYPE_INT32]) + struct.pack('<i', value)
+
+
+def diff(operation, path, value=None):
+    data = bytes([operation, len(path)]) + path.encode('utf-8')
+    if value is not None:
+        data += bytes([len(value)]) + value
+    return data
+
+
+def test_read_packed_integer():
+    assert read_packed_integer(b'\x05', 0) == (5, 1)
+    assert read_packed_integer(b'x\xfc\x01\x02', 1) == (0x0201, 4)
+    assert read_packed_integer(b'\xfd\x01\x02\x03', 0) == (0x030201, 4)
+    assert read_packed_integer(b'\xfe' + struct.pack('<Q', 1 << 40), 0) == (1 << 40, 9)
+
+
+def test_parse_diffs():
+    """解析二进制的JSON diff列表"""
+    data = diff(JSON_DIFF_REPLACE, '$.a', json_int(7)) + diff(JSON_DIFF_INSERT, '$.b', json_string('x')) + \
+        diff(JSON_DIFF_REMOVE, '$.c')
+    update = JsonPartialUpdate.parse(data)
+    assert update.diffs == [(JSON_DIFF_REPLACE, '$.a', 7), (JSON_DIFF_INSERT, '$.b', b'x'),
+                            (JSON_DIFF_REMOVE, '$.c', None)]
+
+
+class Column(object):
+    def __init__(self, name, column_type):
+        self.name = name
+        self.type = column_type
+        self.unsigned = self.zerofill = False
+        self.fixed_binary_length = None
+        self.length_size = 4
+
+
+class BytesPacket(BinLogPacketWrapper):
+    """从字节串读取的行数据，读取方法与BinLogPacketWrapper相同"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read(self, size):
+        size = int(size)
+        value = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return value
+
+
+def make_event(data):
+    columns = [Column('id', FIELD_TYPE.LONG), Column('doc', FIELD_TYPE.JSON), Column('note', FIELD_TYPE.JSON)]
+    event = PartialUpdateRowsEvent.__new__(PartialUpdateRowsEvent)
+    event.packet = BytesPacket(data)
+    event.columns = columns
+    event.table_id = 1
+    event.table_map = {1: type('Table', (), {'columns': columns})()}
+    event.columns_present_bitmap = event.columns_present_bitmap2 = b'\x07'
+    return event
+
+
+def full_json(value):
+    return struct.pack('<I', len(value)) + value
+
+
+def before_image():
+    return b'\x00' + struct.pack('<i', 1) + full_json(json_string('old')) + full_json(json_string('n'))
+
+
+def test_partial_update_row():
+    """后镜像中标记为局部更新的JSON列读取为diff，其他列按完整值读取"""
+    changes = diff(JSON_DIFF_REPLACE, '$.k', json_int(2))
+    data = before_image() + b'\x01' + b'\x01' + \
+        b'\x00' + struct.pack('<i', 1) + full_json(changes) + full_json(json_string('m'))
+    event = make_event(data)
+    row = event._fetch_one_row()
+    assert row['before_values'] == {'id': 1, 'doc': b'old', 'note': b'n'}
+    after = row['after_values']
+    assert (after['id'], after['note']) == (1, b'm')
+    assert isinstance(after['doc'], JsonPartialUpdate)
+    assert after['doc'].diffs == [(JSON_DIFF_REPLACE, '$.k', 2)]
+    assert event.packet.pos == len(data)
+
+
+def test_update_row_without_partial_json():
+    """value_options没有局部更新时与UPDATE_ROWS_EVENT相同"""
+    data = before_image() + b'\x00' + b'\x00' + struct.pack('<i', 2) + full_json(json_string('new')) + \
+        full_json(json_string('n'))
+    event = make_event(data)
+    row = event._fetch_one_row()
+    assert row['after_values'] == {'id': 2, 'doc': b'new', 'note': b'n'}
+    assert event.packet.pos == len(data)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import pytest
+from core.rollback_spool import (RollbackSpool, SpoolBudgetExceededError, RECORD_STATEMENT, RECORD_TXN_END,
+                                 RECORD_COMMENT)
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_reversed_records_across_blocks(tmp_path, compress):
+    spool = RollbackSpool(str(tmp_path / 'spool'), compress=compress, block_size=64)
+    expected = []
+    for txn in range(20):
+        for row in range(3):
+            sql = 'DELETE FROM `t` WHERE `id`=%d; -- 中文 %d' % (txn, row)
+            spool.write(sql)
+            expected.append((RECORD_STATEMENT, sql))
+        spool.end_transaction(1000 + txn)
+        expected.append((RECORD_TXN_END, str(1000 + txn)))
+    spool.write('# 注释', RECORD_COMMENT)
+    expected.append((RECORD_COMMENT, '# 注释'))
+
+    assert list(spool.reversed_records()) == list(reversed(expected))
+    assert spool.count == len(expected)
+    spool.remove()
+    assert not os.path.exists(spool.filename)
+
+
+def test_empty_spool(tmp_path):
+    spool = RollbackSpool(str(tmp_path / 'spool'))
+    assert list(spool.reversed_records()) == []
+    spool.remove()
+
+
+def test_transaction_end_without_position(tmp_path):
+    with RollbackSpool(str(tmp_path / 'spool')) as spool:
+        spool.end_transaction()
+        assert list(spool.reversed_records()) == [(RECORD_TXN_END, '')]
+
+
+def test_budget_exceeded(tmp_path):
+    spool = RollbackSpool(str(tmp_path / 'spool'), compress=False, budget=256, block_size=64)
+    with pytest.raises(SpoolBudgetExceededError):
+        for i in range(100):
+            spool.write('UPDATE `t` SET `v`=%d WHERE `id`=%d;' % (i, i))
+    spool.remove()
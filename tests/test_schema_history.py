@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+from core import schema_history
+from core.schema_history import SchemaHistory, UNKNOWN_COLUMNS, ddl_tables, revert_ddl
+
+LOG_FILE = 'mysql-bin.000003'
+
+
+def column(name, ordinal, key=''):
+    return {'COLUMN_NAME': name, 'COLLATION_NAME': None, 'CHARACTER_SET_NAME': None, 'COLUMN_COMMENT': '',
+            'COLUMN_TYPE': 'int', 'COLUMN_KEY': key, 'ORDINAL_POSITION': ordinal, 'DATA_TYPE': 'int',
+            'CHARACTER_OCTET_LENGTH': None}
+
+
+def names(columns):
+    return [(c['COLUMN_NAME'], c['ORDINAL_POSITION']) for c in columns]
+
+
+CURRENT = [column('id', 1, 'PRI'), column('name', 2), column('age', 3)]
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    """表结构历史在位置1000记录当前结构（id, name, age）"""
+    monkeypatch.setattr(schema_history, 'fetch_columns', lambda *args: {('db', 't'): [dict(c) for c in CURRENT]})
+    history = SchemaHistory(str(tmp_path / 'history.db'))
+    history.seed(None, LOG_FILE, 1000)
+    yield history
+    history.close()
+
+
+def no_fetch(schema, table):
+    raise AssertionError('不应查询服务器')
+
+
+def test_ddl_tables():
+    assert ddl_tables('ALTER TABLE `db`.`t` ADD COLUMN c INT') == [('db', 't')]
+    assert ddl_tables('DROP TABLE IF EXISTS a, `db`.b /* generated by server */', 'x') == [('x', 'a'), ('db', 'b')]
+    assert ddl_tables('RENAME TABLE a TO b', 'db') == [('db', 'a'), ('db', 'b')]
+    assert ddl_tables('INSERT INTO t VALUES (1)') == []
+
+
+def test_revert_add_and_rename_column():
+    columns = revert_ddl(CURRENT, 'ALTER TABLE t ADD COLUMN `name` VARCHAR(10) AFTER id, ADD INDEX idx (id, age)')
+    assert names(columns) == [('id', 1), ('age', 2)]
+    assert names(revert_ddl(CURRENT, 'ALTER TABLE t ADD (name INT, age INT DEFAULT 0)')) == [('id', 1)]
+    assert names(revert_ddl(CURRENT, 'ALTER TABLE t RENAME COLUMN nick TO name, ENGINE=InnoDB')) == [
+        ('id', 1), ('nick', 2), ('age', 3)]
+    assert CURRENT[1]['COLUMN_NAME'] == 'name'
+
+
+def test_revert_keeps_columns_for_index_and_options():
+    for query in ('ALTER TABLE t ADD UNIQUE KEY uk (name), DROP INDEX idx',
+                  'ALTER TABLE t ALTER COLUMN age SET DEFAULT 1, COMMENT=\'a, b\'',
+                  'TRUNCATE TABLE t'):
+        assert names(revert_ddl(CURRENT, query)) == names(CURRENT)
+    reverted = revert_ddl(CURRENT, 'ALTER TABLE t ADD PRIMARY KEY (id)')
+    assert [c['COLUMN_KEY'] for c in reverted] == ['', '', '']
+
+
+def test_revert_lossy_ddl():
+    for query in ('ALTER TABLE t DROP COLUMN old', 'ALTER TABLE t MODIFY age BIGINT',
+                  'ALTER TABLE t CHANGE age years INT', 'ALTER TABLE t ADD COLUMN missing INT',
+                  'CREATE TABLE t (id INT)', 'ALTER TABLE t CONVERT TO CHARACTER SET utf8mb4', None):
+        assert revert_ddl(CURRENT, query) is None
+
+
+def test_rows_before_ddl_use_reverted_columns(history):
+    history.record_ddl('db', 't', LOG_FILE, 500, 'ALTER TABLE t ADD COLUMN age INT')
+    assert names(history.columns('db', 't', LOG_FILE, 300, no_fetch)) == [('id', 1), ('name', 2)]
+    assert names(history.columns('db', 't', LOG_FILE, 600, no_fetch)) == names(CURRENT)
+    assert names(history.columns('db', 't', LOG_FILE, 200, no_fetch)) == [('id', 1), ('name', 2)]
+
+    # DDL语句保存在文件中，重新打开后同样可以还原
+    reopened = SchemaHistory(history.filename)
+    assert names(reopened.columns('db', 't', LOG_FILE, 100, no_fetch)) == [('id', 1), ('name', 2)]
+    reopened.close()
+
+
+def test_rows_before_lossy_ddl_are_unknown(history):
+    history.record_ddl('db', 't', LOG_FILE, 500, 'ALTER TABLE t DROP COLUMN note')
+    assert history.columns('db', 't', LOG_FILE, 300, no_fetch) is UNKNOWN_COLUMNS
+    assert names(history.columns('db', 't', LOG_FILE, 600, no_fetch)) == names(CURRENT)
+
+
+def test_ddl_after_current_version_fetches_once(history):
+    history.record_ddl('db', 't', 'mysql-bin.000004', 100, 'ALTER TABLE t ADD COLUMN email INT')
+    fetched = []
+
+    def fetch(schema, table):
+        fetched.append(table)
+        return CURRENT + [column('email', 4)]
+
+    assert names(history.columns('db', 't', 'mysql-bin.000004', 200, fetch))[-1] == ('email', 4)
+    assert names(history.columns('db', 't', 'mysql-bin.000004', 300, no_fetch))[-1] == ('email', 4)
+    assert names(history.columns('db', 't', LOG_FILE, 2000, no_fetch)) == names(CURRENT)
+    assert fetched == ['t']
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from core import server_probe
+from core.server_probe import ServerCapabilities, get_server_capabilities, CAPABILITIES_TTL
+
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, args=None):
+        if sql.startswith('SHOW GRANTS'):
+            self.rows = [(grant,) for grant in self.connection.grants]
+        else:
+            self.connection.probes += 1
+            self.rows = [('version', '8.0.36'), ('binlog_format', 'ROW'), ('binlog_row_image', 'MINIMAL')]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection(object):
+    def __init__(self, grants):
+        self.grants = grants
+        self.probes = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(server_probe, '_capabilities', {})
+
+
+def settings(user):
+    return {'host': '127.0.0.1', 'port': 3306, 'user': user}
+
+
+def test_capabilities():
+    caps = ServerCapabilities({'version': '8.0.36-log', 'binlog_format': 'row', 'binlog_row_image': 'MINIMAL'},
+                              ["GRANT REPLICATION SLAVE, REPLICATION CLIENT ON *.* TO `repl`@`%`"])
+    assert caps.version == (8, 0, 36)
+    assert caps.row_format
+    assert not caps.full_row_image
+    assert caps.can_replicate
+    assert ServerCapabilities({}, ["GRANT SELECT ON *.* TO `app`@`%`"]).can_replicate is False
+    assert ServerCapabilities({}).can_replicate is None
+
+
+def test_cache_per_user():
+    """权限与用户有关，不同用户分别探测"""
+    repl = FakeConnection(["GRANT REPLICATION SLAVE, REPLICATION CLIENT ON *.* TO `repl`@`%`"])
+    app = FakeConnection(["GRANT SELECT ON *.* TO `app`@`%`"])
+    assert get_server_capabilities(repl, settings('repl')).can_replicate is True
+    assert get_server_capabilities(app, settings('app')).can_replicate is False
+    assert get_server_capabilities(repl, settings('repl')).can_replicate is True
+    assert repl.probes == 1
+    assert app.probes == 1
+
+
+def test_cache_expires():
+    """超过有效期后重新探测"""
+    connection = FakeConnection([])
+    caps = get_server_capabilities(connection, settings('repl'))
+    assert get_server_capabilities(connection, settings('repl')) is caps
+    caps.probed_at -= CAPABILITIES_TTL + 1
+    assert get_server_capabilities(connection, settings('repl')) is not caps
+    assert connection.probes == 2
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from core.sql_coalescer import SqlCoalescer, pack_parts, unpack_parts, parts_to_sql
+
+INSERT_PREFIX = 'INSERT INTO `db`.`t`(`id`) VALUES '
+DELETE_PREFIX = 'DELETE FROM `db`.`t` WHERE `id` IN ('
+
+
+def insert(value, start, end):
+    return INSERT_PREFIX, '(%d)' % value, ';', str(start), str(end), '2024-01-01 00:00:%02d' % value
+
+
+def test_consecutive_rows_are_merged():
+    out = []
+    coalescer = SqlCoalescer(out.append)
+    for i in range(3):
+        coalescer.add(insert(i, 100 + i * 10, 110 + i * 10))
+    coalescer.flush()
+    assert out == ['INSERT INTO `db`.`t`(`id`) VALUES (0), (1), (2); #start 100 end 130 time 2024-01-01 00:00:02']
+    assert (coalescer.rows, coalescer.batches) == (3, 1)
+
+
+def test_reversed_rows_cover_whole_range():
+    """回滚时行倒序加入，位置注释仍覆盖整个批次"""
+    out = []
+    coalescer = SqlCoalescer(out.append)
+    coalescer.add((DELETE_PREFIX, '2', ');', '120', '130', 't2'))
+    coalescer.add((DELETE_PREFIX, '1', ');', '100', '110', 't1'))
+    coalescer.flush()
+    assert out == ['DELETE FROM `db`.`t` WHERE `id` IN (2, 1); #start 100 end 130 time t2']
+
+
+def test_statement_flushes_pending_batch():
+    out = []
+    coalescer = SqlCoalescer(out.append)
+    coalescer.add(insert(1, 100, 110))
+    coalescer.add_statement('COMMIT;')
+    coalescer.add(insert(2, 110, 120))
+    coalescer.flush()
+    assert out[1] == 'COMMIT;'
+    assert len(out) == 3
+
+
+def test_prefix_change_and_size_limit_start_new_batch():
+    out = []
+    coalescer = SqlCoalescer(out.append, max_bytes=len(INSERT_PREFIX) + 64 + 8)
+    coalescer.add(insert(1, 100, 110))
+    coalescer.add(insert(2, 110, 120))
+    coalescer.add((DELETE_PREFIX, '3', ');', '120', '130', 't'))
+    coalescer.flush()
+    assert [sql.split(' #')[0] for sql in out] == [
+        'INSERT INTO `db`.`t`(`id`) VALUES (1);',
+        'INSERT INTO `db`.`t`(`id`) VALUES (2);',
+        'DELETE FROM `db`.`t` WHERE `id` IN (3);',
+    ]
+
+
+def test_parts_round_trip():
+    parts = insert(7, 1, 2)
+    assert unpack_parts(pack_parts(parts)) == parts
+    assert parts_to_sql(parts) == 'INSERT INTO `db`.`t`(`id`) VALUES (7); #start 1 end 2 time 2024-01-01 00:00:07'
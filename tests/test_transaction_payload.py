@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import struct
+
+import pytest
+
+from core.transaction_payload import (
+    TransactionPayloadEvent, PayloadDecompressionError, _read_length_coded,
+    PAYLOAD_SIZE_FIELD, PAYLOAD_COMPRESSION_TYPE_FIELD, PAYLOAD_UNCOMPRESSED_SIZE_FIELD,
+    PAYLOAD_HEADER_END_MARK, COMPRESSION_NONE, COMPRESSION_ZSTD, EVENT_HEADER_SIZE,
+    DECOMPRESS_CHUNK_SIZE)
+
+
+def make_event(event_type, data):
+    """构造包含19字节头部的事件"""
+    size = EVENT_HEADER_SIZE + len(data)
+    return struct.pack('<IBIII', 0, event_type, 1, size, 0) + b'\x00\x00' + data
+
+
+def length_coded(value):
+    if value < 251:
+        return bytes([value])
+    if value < 1 << 16:
+        return b'\xfc' + value.to_bytes(2, 'little')
+    if value < 1 << 24:
+        return b'\xfd' + value.to_bytes(3, 'little')
+    return b'\xfe' + value.to_bytes(8, 'little')
+
+
+def make_body(payload, compression_type, uncompressed_size):
+    """按 类型、长度、值 的格式构造事务载荷的头部"""
+    header = b''
+    for field_type, value in ((PAYLOAD_SIZE_FIELD, len(payload)),
+                              (PAYLOAD_COMPRESSION_TYPE_FIELD, compression_type),
+                              (PAYLOAD_UNCOMPRESSED_SIZE_FIELD, uncompressed_size)):
+        encoded = length_coded(value)
+        header += length_coded(field_type) + length_coded(len(encoded)) + encoded
+    return header + length_coded(PAYLOAD_HEADER_END_MARK) + payload
+
+
+def sample_events():
+    # 第二个事件跨过解压块的边界
+    return [make_event(0x1e, b'a' * 10),
+            make_event(0x1f, b'b' * (DECOMPRESS_CHUNK_SIZE + 100)),
+            make_event(0x10, b'')]
+
+
+def test_read_length_coded():
+    """一个字节以及2、3、8字节的长度编码"""
+    for value in (0, 250, 251, 65535, 1 << 20, 1 << 40):
+        data = b'x' + length_coded(value) + b'y'
+        assert _read_length_coded(data, 1) == (value, len(data) - 1)
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_uncompressed_payload(prefetch):
+    """未压缩的载荷按事件头部中的长度拆分，后台预取时顺序不变"""
+    events = sample_events()
+    raw = b''.join(events)
+    event = TransactionPayloadEvent.from_body(make_body(raw, COMPRESSION_NONE, len(raw)))
+    assert event.payload_size == len(raw)
+    assert event.uncompressed_size == len(raw)
+    assert list(event.embedded_events(prefetch=prefetch)) == events
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_truncated_payload(prefetch):
+    """载荷不完整时报错，预取线程中的异常传给调用方"""
+    raw = b''.join(sample_events())[:-5]
+    event = TransactionPayloadEvent.from_body(make_body(raw, COMPRESSION_NONE, len(raw)))
+    with pytest.raises(PayloadDecompressionError):
+        list(event.embedded_events(prefetch=prefetch))
+
+
+def test_unsupported_compression():
+    raw = b''.join(sample_events())
+    event = TransactionPayloadEvent.from_body(make_body(raw, 7, len(raw)))
+    with pytest.raises(PayloadDecompressionError):
+        list(event.embedded_events())
+
+
+def test_close_prefetch_early():
+    """调用方提前关闭生成器时后台线程不会阻塞"""
+    events = sample_events() * 10
+    raw = b''.join(events)
+    event = TransactionPayloadEvent.from_body(make_body(raw, COMPRESSION_NONE, len(raw)))
+    reader = event.embedded_events(prefetch=1)
+    assert next(reader) == events[0]
+    reader.close()
+
+
+def test_zstd_payload():
+    """zstd压缩的载荷流式解压"""
+    zstandard = pytest.importorskip('zstandard')
+    events = sample_events()
+    raw = b''.join(events)
+    compressed = zstandard.ZstdCompressor().compress(raw)
+    event = TransactionPayloadEvent.from_body(make_body(compressed, COMPRESSION_ZSTD, len(raw)))
+    assert list(event.embedded_events(prefetch=2)) == events